@@ -1,16 +1,44 @@
 import os
-import requests
 import json
-import asyncio
+import time
+from typing import AsyncIterator, Optional
 from pathlib import Path
+from .context_builder import build_context, hits_to_items
+from .ollama_client import get_async_client
 from .rag_engine import SimpleRAG
 
 # Configuration
 OLLAMA_BASE_URL = (os.environ.get("OLLAMA_BASE_URL") or os.environ.get("OLLAMA_HOST") or "http://127.0.0.1:11434").rstrip("/")
-OLLAMA_URL = f"{OLLAMA_BASE_URL}/api/chat"
 MODEL_NAME = "river:latest"
 DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
 RAG_DB_PATH = os.path.join(DATA_DIR, "serenity_brain.json")
+# Token budget for the retrieved context in each prompt (bounds prefill time)
+CONTEXT_TOKENS = 600
+
+# Markdown characters stripped from answers before they are spoken or shown
+_MARKDOWN_MARKS = str.maketrans("", "", "*#_")
+
+class AnswerStream:
+    """The cleaned tokens of one answer, as Ollama generates them.
+
+    ttft is the seconds to this answer's first token (None until it arrives), so
+    concurrent answers from one agent each keep their own.
+    """
+
+    def __init__(self, agent: "RiverAgent", query: str, user_name: str):
+        self.ttft: Optional[float] = None
+        self._tokens = agent._stream(query, user_name, self)
+
+    def __aiter__(self) -> "AnswerStream":
+        return self
+
+    def __anext__(self):
+        return self._tokens.__anext__()
+
+    def aclose(self):
+        """Drops the connection and aborts the generation."""
+        return self._tokens.aclose()
+
 
 class RiverAgent:
     def __init__(self):
@@ -23,36 +51,45 @@ class RiverAgent:
         Asks River a question. She will check her RAG memory first.
         Returns the text response.
         """
-        # 1. RAG Retrieval (Run in thread to avoid blocking)
-        docs = await asyncio.to_thread(self.rag.query, query, k=2)
-        context = "\n".join([d['text'] for d in docs]) if docs else "No specific data found."
-
-        # 2. Construct Messages
-        # We inject the RAG context as a system or user message
-        messages = [
-            {
-                "role": "system", 
-                "content": f"CONTEXT DATA FROM SHIP'S DATABASE:\n{context}\n\nUse this data if relevant. Keep response short."
-            },
-            {
-                "role": "user", 
-                "content": query
-            }
-        ]
-        
-        payload = {"model": MODEL_NAME, "messages": messages, "stream": False}
-        
-        # 3. Call Ollama (Run in thread)
-        def _call_ollama():
-            try:
-                resp = requests.post(OLLAMA_URL, json=payload, timeout=30)
-                resp.raise_for_status()
-                return resp.json()['message']['content']
-            except Exception as e:
-                return f"[Thinking error: {e}]"
-
-        response = await asyncio.to_thread(_call_ollama)
-        
-        # 4. Clean up response for speech/text
-        clean_text = response.replace("**", "").replace("*", "").replace("#", "").replace("_", "")
-        return clean_text
+        return "".join([token async for token in self.ask_stream(query, user_name)])
+
+    def ask_stream(self, query: str, user_name: str = "Captain") -> AnswerStream:
+        """
+        Same as ask(), but yields the cleaned response piece by piece as Ollama
+        generates it. The returned stream's ttft holds its time to first token.
+        """
+        return AnswerStream(self, query, user_name)
+
+    async def _stream(self, query: str, user_name: str, answer: AnswerStream) -> AsyncIterator[str]:
+        started = time.perf_counter()
+        try:
+            # 1. RAG Retrieval (the embedding call is awaited; the vector search runs in a worker thread)
+            docs = await self.rag.aquery(query, k=4)
+            context = build_context(hits_to_items(docs), CONTEXT_TOKENS).text if docs else "No specific data found."
+
+            # 2. Construct Messages
+            # We inject the RAG context as a system or user message
+            messages = [
+                {
+                    "role": "system", 
+                    "content": f"CONTEXT DATA FROM SHIP'S DATABASE:\n{context}\n\nUse this data if relevant. Keep response short."
+                },
+                {
+                    "role": "user", 
+                    "content": query
+                }
+            ]
+
+            # 3. Stream from Ollama on the shared async client. Closing this generator
+            #    (or cancelling its task) drops the connection and aborts the generation.
+            # 4. Clean up each piece for speech/text; the markdown marks are single
+            #    characters, so stripping them chunk by chunk is exact.
+            async for chunk in get_async_client(OLLAMA_BASE_URL).chat_stream(messages, MODEL_NAME):
+                token = chunk.get('message', {}).get('content', '').translate(_MARKDOWN_MARKS)
+                if not token:
+                    continue
+                if answer.ttft is None:
+                    answer.ttft = time.perf_counter() - started
+                yield token
+        except Exception as e:
+            yield f"[Thinking error: {e}]"
@@ -0,0 +1,222 @@
+"""Inverted-file (IVF) approximate nearest-neighbour index for large brains.
+
+Rows are bucketed under the nearest of `nlist` spherical k-means centroids. A
+query ranks the centroids, then scores only the rows in the `nprobe` closest
+buckets exactly, so its cost is about nprobe / nlist of a full scan. Raise
+`nprobe` for recall, lower it for latency.
+
+New rows are assigned to a bucket as they are ingested. The centroids are only
+retrained once the brain has grown well past the size they were trained on,
+on a background thread (`train_async`); the old centroids keep answering until
+the new ones are installed. Centroids and assignments persist in
+`<base>.ivf.npz` next to the store.
+
+The index is shared by the ingesting thread and the query worker threads
+(`SimpleRAG.aquery` searches via `asyncio.to_thread`); its own lock serializes
+every read and update of the buckets.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Rows assigned per matrix product while bucketing or training, to bound temporary memory.
+_ASSIGN_CHUNK = 8192
+
+
+class IVFIndex:
+    def __init__(self, path: str, nprobe: int = 16, retrain_growth: float = 4.0):
+        self.path = path
+        self.nprobe = nprobe
+        self.retrain_growth = retrain_growth
+        self.centroids: Optional[np.ndarray] = None
+        self.trained_rows = 0
+        self._buffer = np.zeros(0, dtype=np.int32)  # row -> bucket, grown geometrically
+        self._count = 0
+        self._lists: List[np.ndarray] = []  # bucket -> rows, as of the last rebuild
+        self._extra: Dict[int, List[int]] = {}  # bucket -> rows added since
+        self._trainer: Optional[threading.Thread] = None
+        self._trained: Optional[Tuple[int, np.ndarray, int, np.ndarray]] = None  # finished in the background
+        self._generation = 0  # bumped when rows are renumbered, so stale training is discarded
+        self._lock = threading.RLock()
+
+    @property
+    def ready(self) -> bool:
+        return self.centroids is not None
+
+    @property
+    def assignments(self) -> np.ndarray:
+        return self._buffer[:self._count]
+
+    def _set_assignments(self, assignments: np.ndarray) -> None:
+        self._buffer = np.ascontiguousarray(assignments, dtype=np.int32)
+        self._count = len(self._buffer)
+
+    @property
+    def training(self) -> bool:
+        return self._trainer is not None and self._trainer.is_alive()
+
+    def needs_training(self, n_rows: int) -> bool:
+        return not self.ready or n_rows > self.trained_rows * self.retrain_growth
+
+    def load(self, n_rows: int) -> bool:
+        """Loads a persisted index, ignoring assignments for rows the store no longer has."""
+        if not os.path.exists(self.path):
+            return False
+        with self._lock, np.load(self.path) as data:
+            self.centroids = data["centroids"]
+            self._set_assignments(data["assignments"][:n_rows])
+            self.trained_rows = int(data["trained_rows"])
+            self._rebuild_lists()
+        return True
+
+    def save(self) -> None:
+        with self._lock:
+            if not self.ready:
+                return
+            tmp = self.path + ".tmp.npz"
+            np.savez(tmp, centroids=self.centroids, assignments=self.assignments, trained_rows=self.trained_rows)
+            os.replace(tmp, self.path)
+
+    def _fit(self, matrix, n: int, iterations: int, sample_size: int, seed: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Spherical k-means on a sample of the first `n` rows; (centroids, their assignments)."""
+        nlist = int(np.clip(4 * np.sqrt(n), 16, 4096))
+        rng = np.random.default_rng(seed)
+        sample_rows = np.sort(rng.choice(n, size=min(n, max(sample_size, nlist)), replace=False))
+        sample, norms = matrix.take(sample_rows)
+        sample = sample / np.maximum(norms, 1e-12)[:, None]
+
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(iterations):
+            sums = np.zeros_like(centroids)
+            for lo in range(0, len(sample), _ASSIGN_CHUNK):
+                block = sample[lo:lo + _ASSIGN_CHUNK]
+                np.add.at(sums, _nearest(block, centroids), block)
+            lengths = np.linalg.norm(sums, axis=1)
+            filled = lengths > 0
+            centroids[filled] = sums[filled] / lengths[filled][:, None]
+
+        centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        return centroids, _assign_rows(matrix, centroids, 0, n)
+
+    def train(self, matrix, iterations: int = 10, sample_size: int = 65_536, seed: int = 0) -> None:
+        """Trains the centroids and buckets every row, blocking the caller."""
+        n = len(matrix)
+        centroids, assignments = self._fit(matrix, n, iterations, sample_size, seed)
+        with self._lock:
+            self._install(centroids, n, assignments, matrix)
+
+    def train_async(self, matrix, iterations: int = 10, sample_size: int = 65_536, seed: int = 0) -> None:
+        """Starts training on a background thread; `poll` installs the result once it is done."""
+        if self.training:
+            return
+        n, generation = len(matrix), self._generation
+
+        def run() -> None:
+            try:
+                centroids, assignments = self._fit(matrix, n, iterations, sample_size, seed)
+            except Exception as e:
+                print(f"[RAG] Warning: IVF training failed: {e}")
+                return
+            self._trained = (generation, centroids, n, assignments)
+
+        self._trainer = threading.Thread(target=run, name="ivf-train", daemon=True)
+        self._trainer.start()
+
+    def poll(self, matrix) -> bool:
+        """Installs centroids trained in the background, if any are ready. True if installed."""
+        with self._lock:
+            trained, self._trained = self._trained, None
+            if trained is None:
+                return False
+            generation, centroids, n, assignments = trained
+            if generation != self._generation or n > len(matrix):
+                return False
+            self._install(centroids, n, assignments, matrix)
+            return True
+
+    def _install(self, centroids: np.ndarray, n: int, assignments: np.ndarray, matrix) -> None:
+        self.centroids = centroids
+        self.trained_rows = n
+        self._set_assignments(assignments)
+        if n < len(matrix):
+            self.sync(matrix)  # rows appended while training
+        else:
+            self._rebuild_lists()
+        print(f"[RAG] Trained IVF index: {len(centroids)} lists over {n} rows")
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        return _nearest(vectors, self.centroids)
+
+    def sync(self, matrix) -> None:
+        """Buckets every matrix row that does not have an assignment yet."""
+        with self._lock:
+            start = self._count
+            if not self.ready or start >= len(matrix):
+                return
+            self._reserve(len(matrix))
+            self._buffer[start:len(matrix)] = _assign_rows(matrix, self.centroids, start, len(matrix))
+            self._count = len(matrix)
+            self._rebuild_lists()
+
+    def truncate(self, n_rows: int) -> None:
+        """Forgets assignments from row `n_rows` on (those rows were renumbered)."""
+        with self._lock:
+            self._generation += 1
+            if not self.ready or n_rows >= self._count:
+                return
+            self._count = n_rows
+            self._rebuild_lists()
+
+    def _reserve(self, size: int) -> None:
+        if size > len(self._buffer):
+            buffer = np.zeros(max(size, 2 * len(self._buffer), 1024), dtype=np.int32)
+            buffer[:self._count] = self._buffer[:self._count]
+            self._buffer = buffer
+
+    def add(self, row: int, vector) -> None:
+        """Buckets one newly appended row."""
+        with self._lock:
+            if not self.ready or row != self._count:
+                return
+            bucket = int(self._assign(np.asarray(vector, dtype=np.float32)[None, :])[0])
+            self._reserve(row + 1)
+            self._buffer[row] = bucket
+            self._count += 1
+            self._extra.setdefault(bucket, []).append(row)
+
+    def _rebuild_lists(self) -> None:
+        nlist = len(self.centroids)
+        assignments = self.assignments
+        order = np.argsort(assignments, kind="stable").astype(np.int64)
+        bounds = np.searchsorted(assignments[order], np.arange(nlist + 1))
+        self._lists = [order[bounds[i]:bounds[i + 1]] for i in range(nlist)]
+        self._extra = {}
+
+    def candidates(self, query: np.ndarray, nprobe: Optional[int] = None) -> np.ndarray:
+        """Rows in the `nprobe` buckets whose centroids are closest to the query."""
+        with self._lock:
+            nprobe = min(nprobe or self.nprobe, len(self.centroids))
+            sims = self.centroids @ query
+            probe = np.argpartition(-sims, nprobe - 1)[:nprobe] if nprobe < len(sims) else np.arange(len(sims))
+            parts = [self._lists[b] for b in probe]
+            parts.extend(np.asarray(self._extra[b], dtype=np.int64) for b in probe if b in self._extra)
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+
+
+def _nearest(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    # argmax of x.c equals argmax of the cosine: |x| is constant per row.
+    return np.argmax(vectors @ centroids.T, axis=1).astype(np.int32)
+
+
+def _assign_rows(matrix, centroids: np.ndarray, start: int, stop: int) -> np.ndarray:
+    """Buckets for matrix rows [start, stop), one block of rows at a time."""
+    out = np.empty(stop - start, dtype=np.int32)
+    for lo in range(start, stop, _ASSIGN_CHUNK):
+        hi = min(lo + _ASSIGN_CHUNK, stop)
+        out[lo - start:hi - start] = _nearest(matrix.take(np.arange(lo, hi))[0], centroids)
+    return out
@@ -0,0 +1,292 @@
+"""Background audio for the voice interface.
+
+`AudioPlayer` plays in-memory clips (MP3 bytes straight from edge-tts) from a
+queue on its own thread, so nothing touches the disk and the caller never
+blocks on playback. `stop()` cuts the current clip and drops everything queued.
+
+`MicrophoneListener` keeps the microphone open on another thread and queues
+every utterance it hears, so the user can talk over River while she speaks.
+Each utterance is offered to an `interrupt` callback first; when that returns
+True (a reply was cut short) the utterance is treated as a barge-in and dropped.
+Speakers leaking into the microphone can trigger barge-in too; use headphones.
+It reads WAV files just as well as the microphone, for offline runs.
+
+`UtteranceDetector` cuts the input into utterances frame by frame (30 ms),
+ending one after a short run of silence rather than speech_recognition's fixed
+pause. It uses webrtcvad when installed and an energy gate otherwise. The
+ambient noise level is measured once and cached on disk for later sessions.
+"""
+
+from __future__ import annotations
+
+import collections
+import io
+import json
+import os
+import queue
+import threading
+import time
+from typing import Callable, Iterable, Iterator, Optional
+
+import numpy as np
+import pygame
+import speech_recognition as sr
+
+try:
+    import webrtcvad
+except ImportError:  # optional; the energy gate is used instead
+    webrtcvad = None  # type: ignore
+
+
+class AudioPlayer:
+    def __init__(self, poll_interval: float = 0.02):
+        pygame.mixer.init()
+        self.poll_interval = poll_interval
+        self._clips: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._generation = 0  # bumped by stop(); clips from older generations are skipped
+        self._idle = threading.Event()
+        self._idle.set()
+        self._wake = threading.Event()
+        self.speaking = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="audio-player", daemon=True)
+        self._thread.start()
+
+    @property
+    def busy(self) -> bool:
+        """True while a clip is playing or queued."""
+        return not self._idle.is_set()
+
+    @property
+    def generation(self) -> int:
+        """Bumped by every stop(); pass it to play() to drop clips made before a stop."""
+        return self._generation
+
+    def play(self, data: bytes, hint: str = "mp3", generation: Optional[int] = None) -> bool:
+        """Queues a clip behind whatever is already playing.
+
+        With `generation`, the clip is dropped (False) if stop() was called since
+        that generation was read.
+        """
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return False
+            self._pending += 1
+            self._idle.clear()
+            self._clips.put((self._generation, data, hint))
+            return True
+
+    def stop(self) -> None:
+        """Stops the current clip and discards the queued ones."""
+        with self._lock:
+            self._generation += 1
+        self._wake.set()
+
+    def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        return self._idle.wait(timeout)
+
+    def close(self) -> None:
+        self.stop()
+        self._clips.put(None)
+        self._thread.join(timeout=2)
+
+    def _run(self) -> None:
+        while True:
+            item = self._clips.get()
+            if item is None:
+                break
+            generation, data, hint = item
+            try:
+                if generation == self._generation:
+                    self._play_one(generation, data, hint)
+            finally:
+                with self._lock:
+                    self._pending -= 1
+                    if not self._pending:
+                        self._idle.set()
+
+    def _play_one(self, generation: int, data: bytes, hint: str) -> None:
+        self._wake.clear()
+        try:
+            pygame.mixer.music.load(io.BytesIO(data), hint)
+            pygame.mixer.music.play()
+            self.speaking.set()
+            while pygame.mixer.music.get_busy():
+                # Sleeps on an event, so stop() takes effect immediately.
+                if self._wake.wait(self.poll_interval) and generation != self._generation:
+                    pygame.mixer.music.stop()
+                    break
+        except Exception as e:
+            print(f"[Audio Error: {e}]")
+        finally:
+            self.speaking.clear()
+            pygame.mixer.music.unload()
+
+
+class UtteranceDetector:
+    FRAME_SECONDS = 0.03
+
+    def __init__(
+        self,
+        end_silence: float = 0.45,
+        start_speech: float = 0.09,
+        pre_roll: float = 0.3,
+        max_duration: float = 15.0,
+        energy_ratio: float = 2.5,
+        min_energy: float = 300.0,
+        aggressiveness: int = 2,
+        calibration_path: Optional[str] = None,
+        calibration_max_age: float = 6 * 3600,
+    ):
+        self.end_silence = end_silence
+        self.start_speech = start_speech
+        self.pre_roll = pre_roll
+        self.max_duration = max_duration
+        self.energy_ratio = energy_ratio
+        self.min_energy = min_energy
+        self.calibration_path = calibration_path
+        self.calibration_max_age = calibration_max_age
+        self.ambient: Optional[float] = None  # RMS of background noise, on a 16-bit scale
+        self._vad = webrtcvad.Vad(aggressiveness) if webrtcvad is not None else None
+
+    @property
+    def threshold(self) -> float:
+        return max(self.min_energy, (self.ambient or 0.0) * self.energy_ratio)
+
+    def calibrate(self, source, duration: float = 0.5) -> None:
+        """Measures the background noise, or reuses a recent measurement from disk."""
+        cached = self._load_calibration()
+        if cached is not None:
+            self.ambient = cached
+            return
+        frames = int(duration / self.FRAME_SECONDS)
+        levels = [self._rms(f, source.SAMPLE_WIDTH) for f in self._frames(source, frames)]
+        if levels:
+            self.ambient = float(np.median(levels))
+            self._save_calibration()
+
+    def _load_calibration(self) -> Optional[float]:
+        if not self.calibration_path or not os.path.exists(self.calibration_path):
+            return None
+        try:
+            with open(self.calibration_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - data.get("saved", 0) > self.calibration_max_age:
+            return None
+        return float(data["ambient"])
+
+    def _save_calibration(self) -> None:
+        if not self.calibration_path or self.ambient is None:
+            return
+        with open(self.calibration_path, "w", encoding="utf-8") as f:
+            json.dump({"ambient": self.ambient, "saved": time.time()}, f)
+
+    def _frames(self, source, limit: Optional[int] = None) -> Iterator[bytes]:
+        size = int(source.SAMPLE_RATE * self.FRAME_SECONDS)
+        frame_bytes = size * source.SAMPLE_WIDTH
+        count = 0
+        while limit is None or count < limit:
+            frame = source.stream.read(size)
+            if not frame:
+                return
+            if len(frame) < frame_bytes:  # last frame of a file
+                frame += b"\0" * (frame_bytes - len(frame))
+            count += 1
+            yield frame
+
+    @staticmethod
+    def _rms(frame: bytes, width: int) -> float:
+        if width != 2:
+            frame = sr.AudioData(frame, 16000, width).get_raw_data(convert_width=2)
+        samples = np.frombuffer(frame, dtype="<i2").astype(np.float32)
+        return float(np.sqrt(np.mean(samples * samples))) if len(samples) else 0.0
+
+    def _is_speech(self, frame: bytes, source) -> bool:
+        level = self._rms(frame, source.SAMPLE_WIDTH)
+        if level < self.threshold:
+            # Track slow changes in the background noise while nobody talks.
+            self.ambient = level if self.ambient is None else 0.95 * self.ambient + 0.05 * level
+            return False
+        if self._vad is not None and source.SAMPLE_WIDTH == 2 and source.SAMPLE_RATE in (8000, 16000, 32000, 48000):
+            return self._vad.is_speech(frame, source.SAMPLE_RATE)
+        return True
+
+    def utterances(self, source, stop: Optional[Callable[[], bool]] = None) -> Iterator[sr.AudioData]:
+        """Yields each utterance heard on `source` (a Microphone or an AudioFile)."""
+        start_frames = max(1, round(self.start_speech / self.FRAME_SECONDS))
+        end_frames = max(1, round(self.end_silence / self.FRAME_SECONDS))
+        max_frames = round(self.max_duration / self.FRAME_SECONDS)
+        ring: "collections.deque[bytes]" = collections.deque(maxlen=round(self.pre_roll / self.FRAME_SECONDS))
+        frames: list = []
+        voiced = silent = 0
+
+        def utterance():
+            return sr.AudioData(b"".join(frames[:len(frames) - silent] or frames), source.SAMPLE_RATE, source.SAMPLE_WIDTH)
+
+        for frame in self._frames(source):
+            if stop and stop():
+                return
+            speech = self._is_speech(frame, source)
+            if not frames:
+                ring.append(frame)
+                voiced = voiced + 1 if speech else 0
+                if voiced >= start_frames:
+                    frames, silent = list(ring), 0
+                    ring.clear()
+                continue
+
+            frames.append(frame)
+            silent = 0 if speech else silent + 1
+            if silent >= end_frames or len(frames) >= max_frames:
+                yield utterance()
+                frames, voiced, silent = [], 0, 0
+
+        if frames:
+            yield utterance()
+
+
+class MicrophoneListener:
+    def __init__(
+        self,
+        interrupt: Optional[Callable[[], bool]] = None,
+        detector: Optional[UtteranceDetector] = None,
+        sources: Optional[Iterable] = None,
+        calibrate: bool = True,
+    ):
+        self.interrupt = interrupt
+        self.detector = detector or UtteranceDetector()
+        self.sources = sources
+        self.calibrate = calibrate
+        self.utterances: "queue.Queue[Optional[sr.AudioData]]" = queue.Queue()
+        self.error: Optional[Exception] = None
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="microphone", daemon=True)
+        self._thread.start()
+
+    def next_utterance(self) -> Optional[sr.AudioData]:
+        """Blocks until the next utterance; None once the input has ended or failed (see .error)."""
+        return self.utterances.get()
+
+    def close(self) -> None:
+        self._closed.set()
+        self._thread.join(timeout=2)
+
+    def _run(self) -> None:
+        try:
+            for source in self.sources if self.sources is not None else [sr.Microphone()]:
+                with source:
+                    if self.calibrate:
+                        self.detector.calibrate(source)
+                    for audio in self.detector.utterances(source, stop=self._closed.is_set):
+                        if self.interrupt and self.interrupt():
+                            continue
+                        self.utterances.put(audio)
+                if self._closed.is_set():
+                    break
+        except Exception as e:
+            self.error = e
+        finally:
+            self.utterances.put(None)
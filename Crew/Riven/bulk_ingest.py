@@ -0,0 +1,173 @@
+"""Bulk indexer: rebuilds the Neural Link from the files on disk in one pass.
+
+Streams every arXiv dump in `data/raw/` (JSON lists of title/summary/link/
+published, with or without a .json extension) and every report in
+`data/processed/`, chunks them, and feeds them to SimpleRAG in large batches:
+one batched embedding pass and one store commit per batch. Duplicates (the
+same paper returned by several searches) are dropped before they are embedded.
+
+A checkpoint next to the brain records which files are committed, so an
+interrupted run picks up where it stopped; changed files are indexed again,
+and so are files with a chunk that could not be embedded.
+
+Usage:
+    python bulk_ingest.py
+    python bulk_ingest.py --brain data/fresh_brain.json --restart
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+try:
+    from .chunker import DEFAULT_MAX_TOKENS, DEFAULT_OVERLAP, chunk_document
+    from .rag_engine import EMBEDDING_BATCH_SIZE, SimpleRAG
+except ImportError:  # run as a script from this folder
+    from chunker import DEFAULT_MAX_TOKENS, DEFAULT_OVERLAP, chunk_document
+    from rag_engine import EMBEDDING_BATCH_SIZE, SimpleRAG
+
+DATA_DIR = Path(__file__).parent / "data"
+
+# Chunks per ingest_many call, i.e. per store commit and checkpoint update.
+COMMIT_EVERY = 512
+
+
+def _file_state(path: Path) -> List[int]:
+    stat = path.stat()
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _load_checkpoint(path: Path) -> Dict[str, List[int]]:
+    if not path.exists():
+        return {}
+    try:
+        return json.loads(path.read_text(encoding="utf-8")).get("done", {})
+    except (OSError, ValueError):
+        print(f"[Bulk] Ignoring unreadable checkpoint {path}")
+        return {}
+
+
+def _save_checkpoint(path: Path, done: Dict[str, List[int]]) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps({"done": done}, indent=1), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _raw_documents(path: Path) -> Iterator[Tuple[str, Dict, str]]:
+    """(text, metadata, parent id) for each paper in an arXiv dump."""
+    try:
+        papers = json.loads(path.read_text(encoding="utf-8") or "[]")
+    except ValueError:
+        print(f"[Bulk] Skipping {path.name}: not valid JSON")
+        return
+    for paper in papers if isinstance(papers, list) else []:
+        title = (paper.get("title") or "").strip()
+        summary = (paper.get("summary") or "").strip()
+        if not summary:
+            continue
+        text = f"Title: {title}\nAbstract: {summary}" if title else summary
+        metadata = {
+            "source": "arXiv",
+            "title": title,
+            "link": paper.get("link"),
+            "published": paper.get("published"),
+            "file": path.name,
+        }
+        yield text, metadata, paper.get("link") or f"{path.name}#{title}"
+
+
+def _report_documents(path: Path) -> Iterator[Tuple[str, Dict, str]]:
+    text = path.read_text(encoding="utf-8", errors="replace")
+    if text.strip():
+        yield text, {"source": "River Report", "file": path.name}, f"report:{path.name}"
+
+
+def _sources(raw_dir: Path, processed_dir: Path):
+    """(path, document iterator factory, markdown?) for every input file, in a stable order."""
+    if raw_dir.is_dir():
+        for path in sorted(p for p in raw_dir.iterdir() if p.is_file()):
+            yield path, _raw_documents, False
+    if processed_dir.is_dir():
+        for path in sorted(processed_dir.glob("*.md")):
+            yield path, _report_documents, True
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Index data/raw and data/processed into the Neural Link")
+    parser.add_argument("--brain", default=str(DATA_DIR / "serenity_brain.json"), help="Brain to write to")
+    parser.add_argument("--raw", default=str(DATA_DIR / "raw"), help="Folder of arXiv JSON dumps")
+    parser.add_argument("--processed", default=str(DATA_DIR / "processed"), help="Folder of markdown reports")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: next to the brain)")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and index every file again")
+    parser.add_argument("--batch-size", type=int, default=EMBEDDING_BATCH_SIZE, help="Texts per embedding request")
+    parser.add_argument("--commit-every", type=int, default=COMMIT_EVERY, help="Chunks per store commit")
+    parser.add_argument("--max-tokens", type=int, default=DEFAULT_MAX_TOKENS)
+    parser.add_argument("--overlap", type=int, default=DEFAULT_OVERLAP)
+    args = parser.parse_args()
+
+    checkpoint = Path(args.checkpoint or os.path.splitext(args.brain)[0] + ".ingest_checkpoint.json")
+    done = {} if args.restart else _load_checkpoint(checkpoint)
+    rag = SimpleRAG(args.brain)
+
+    texts: List[str] = []
+    metadatas: List[Dict] = []
+    staged: Dict[str, Tuple[List[int], int, int]] = {}  # file -> (state, its chunks' slice of the buffer)
+    totals = {"files": 0, "skipped": 0, "chunks": 0, "added": 0, "incomplete": 0}
+    started = time.perf_counter()
+
+    def commit() -> None:
+        accepted = rag.ingest_many(texts, metadatas, batch_size=args.batch_size) if texts else []
+        totals["added"] += sum(accepted)
+        totals["chunks"] += len(texts)
+        # A rejected chunk is fine if it was a duplicate; if the brain does not hold
+        # it, embedding failed and its file must be indexed again next run.
+        failed = [i for i, ok in enumerate(accepted) if not ok and not rag.contains(texts[i])]
+        # Files are only marked done once all their chunks are in the store.
+        for key, (state, lo, hi) in staged.items():
+            if any(lo <= i < hi for i in failed):
+                totals["incomplete"] += 1
+            else:
+                done[key] = state
+        _save_checkpoint(checkpoint, done)
+        elapsed = time.perf_counter() - started
+        print(
+            f"[Bulk] {totals['files']} files, {totals['chunks']} chunks ({totals['added']} new) "
+            f"in {elapsed:.1f}s — {totals['chunks'] / max(elapsed, 1e-9):.1f} docs/s"
+        )
+        texts.clear()
+        metadatas.clear()
+        staged.clear()
+
+    for path, documents, markdown in _sources(Path(args.raw), Path(args.processed)):
+        key = str(path.resolve())
+        state = _file_state(path)
+        if done.get(key) == state:
+            totals["skipped"] += 1
+            continue
+        first_chunk = len(texts)
+        for text, metadata, parent_id in documents(path):
+            chunk_texts, chunk_metadatas = chunk_document(
+                text, metadata, parent_id, max_tokens=args.max_tokens, overlap=args.overlap, markdown=markdown
+            )
+            texts.extend(chunk_texts)
+            metadatas.extend(chunk_metadatas)
+        staged[key] = (state, first_chunk, len(texts))
+        totals["files"] += 1
+        if len(texts) >= args.commit_every:
+            commit()
+
+    commit()
+    if totals["incomplete"]:
+        print(f"[Bulk] {totals['incomplete']} files had chunks that could not be embedded; they will be indexed again next run.")
+    if totals["skipped"]:
+        print(f"[Bulk] {totals['skipped']} unchanged files skipped (checkpoint {checkpoint}).")
+    print(f"[Bulk] Brain now holds {len(rag)} documents.")
+
+
+if __name__ == "__main__":
+    main()
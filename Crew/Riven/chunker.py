@@ -0,0 +1,196 @@
+"""Splits long documents into overlapping chunks for the Neural Link.
+
+One vector per report either gets truncated by the embedding model or averages
+a dozen topics into nothing. Chunks are token windows (`max_tokens` long,
+sharing `overlap` tokens with the previous window) that prefer to end on a
+sentence or paragraph break. Markdown documents are first cut at headings, so a
+chunk never straddles two sections and remembers which section it came from.
+
+Tokens are counted with a word/punctuation regex, which tracks the subword
+counts of the embedding models closely enough for sizing windows without
+pulling in a tokenizer.
+
+Every chunk records its parent document and character offsets, so
+`collapse_by_parent` can fold query hits back into one passage per document,
+merging overlapping chunks instead of sending the overlap to the LLM twice.
+"""
+
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+_HEADING = re.compile(r"^(#{1,6})[ \t]+(.+?)[ \t#]*$", re.MULTILINE)
+_SENTENCE_END = {".", "!", "?"}
+
+DEFAULT_MAX_TOKENS = 256
+DEFAULT_OVERLAP = 48
+
+
+@dataclass
+class Chunk:
+    text: str
+    start: int  # character offsets into the parent document
+    end: int
+    section: Optional[str] = None  # "Heading > Subheading" for markdown documents
+    # The text between the previous chunk's end and this chunk's start, when it
+    # is only whitespace; None when the chunks overlap or other text lies between.
+    leading_space: Optional[str] = None
+
+
+def count_tokens(text: str) -> int:
+    return sum(1 for _ in _TOKEN.finditer(text))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """The longest prefix of `text` holding at most `max_tokens` tokens."""
+    if max_tokens <= 0:
+        return ""
+    for i, match in enumerate(_TOKEN.finditer(text)):
+        if i == max_tokens - 1:
+            return text[:match.end()]
+    return text
+
+
+def _sections(text: str) -> List[Tuple[int, int, Optional[str]]]:
+    """(start, end, heading path) for each markdown section, in order."""
+    headings = list(_HEADING.finditer(text))
+    if not headings:
+        return [(0, len(text), None)]
+
+    sections = []
+    if headings[0].start() > 0:
+        sections.append((0, headings[0].start(), None))
+    path: List[Tuple[int, str]] = []
+    for i, match in enumerate(headings):
+        level, title = len(match.group(1)), match.group(2).strip()
+        path = [(lvl, t) for lvl, t in path if lvl < level] + [(level, title)]
+        end = headings[i + 1].start() if i + 1 < len(headings) else len(text)
+        sections.append((match.start(), end, " > ".join(t for _, t in path)))
+    return sections
+
+
+def _windows(text: str, start: int, end: int, max_tokens: int, overlap: int) -> List[Tuple[int, int]]:
+    """Character spans of token windows over text[start:end]."""
+    tokens = [(m.start(), m.end()) for m in _TOKEN.finditer(text, start, end)]
+    if not tokens:
+        return []
+    if len(tokens) <= max_tokens:
+        return [(tokens[0][0], tokens[-1][1])]
+
+    spans = []
+    first = 0
+    while first < len(tokens):
+        last = min(first + max_tokens, len(tokens)) - 1
+        if last < len(tokens) - 1:
+            # Prefer to stop after a sentence or paragraph within the last quarter of the window.
+            floor = first + (max_tokens * 3) // 4
+            for i in range(last, floor - 1, -1):
+                t_start, t_end = tokens[i]
+                if text[t_start:t_end] in _SENTENCE_END or "\n\n" in text[t_end:tokens[i + 1][0]]:
+                    last = i
+                    break
+        spans.append((tokens[first][0], tokens[last][1]))
+        if last == len(tokens) - 1:
+            break
+        first = max(last + 1 - overlap, first + 1)
+    return spans
+
+
+def chunk_text(
+    text: str,
+    max_tokens: int = DEFAULT_MAX_TOKENS,
+    overlap: int = DEFAULT_OVERLAP,
+    markdown: bool = True,
+) -> List[Chunk]:
+    if overlap >= max_tokens:
+        raise ValueError("overlap must be smaller than max_tokens")
+    sections = _sections(text) if markdown else [(0, len(text), None)]
+    chunks = []
+    previous_end = 0
+    for start, end, section in sections:
+        for lo, hi in _windows(text, start, end, max_tokens, overlap):
+            gap = text[previous_end:lo] if lo >= previous_end else None
+            leading_space = gap if gap is not None and not gap.strip() else None
+            chunks.append(Chunk(text=text[lo:hi], start=lo, end=hi, section=section, leading_space=leading_space))
+            previous_end = hi
+    return chunks
+
+
+def chunk_document(
+    text: str,
+    metadata: Optional[Dict] = None,
+    parent_id: Optional[str] = None,
+    max_tokens: int = DEFAULT_MAX_TOKENS,
+    overlap: int = DEFAULT_OVERLAP,
+    markdown: bool = True,
+) -> Tuple[List[str], List[Dict]]:
+    """(texts, metadatas) ready for SimpleRAG.ingest_many.
+
+    Each chunk's metadata is the document's metadata plus parent_id,
+    chunk/chunks (position), start/end (character offsets), leading_space
+    (see Chunk) and section.
+    """
+    chunks = chunk_text(text, max_tokens=max_tokens, overlap=overlap, markdown=markdown)
+    metadatas = [
+        {
+            **(metadata or {}),
+            "parent_id": parent_id,
+            "chunk": i,
+            "chunks": len(chunks),
+            "start": chunk.start,
+            "end": chunk.end,
+            "leading_space": chunk.leading_space,
+            "section": chunk.section,
+        }
+        for i, chunk in enumerate(chunks)
+    ]
+    return [c.text for c in chunks], metadatas
+
+
+def collapse_by_parent(results: List[Dict], k: int) -> List[Dict]:
+    """Folds chunk hits into one result per parent document, best parent first.
+
+    The parent's text is its matching chunks in document order; overlapping or
+    adjacent chunks are merged, and wherever document text between two chunks
+    is left out, an ellipsis marks the gap. Results that are not chunks pass
+    through as their own parent.
+    """
+    groups: Dict[str, List[Dict]] = {}
+    for result in results:
+        parent = result.get("metadata", {}).get("parent_id") or result["id"]
+        groups.setdefault(parent, []).append(result)
+
+    collapsed = []
+    for parent, hits in groups.items():
+        best = max(hits, key=lambda r: r.get("score", 0.0))
+        if len(hits) == 1 or "start" not in best.get("metadata", {}):
+            collapsed.append({**best, "parent_id": parent, "chunks": len(hits)})
+            continue
+
+        hits = sorted(hits, key=lambda r: r["metadata"]["start"])
+        parts = [hits[0]["text"]]
+        covered = hits[0]["metadata"]["end"]
+        for hit in hits[1:]:
+            start, end = hit["metadata"]["start"], hit["metadata"]["end"]
+            if end <= covered:
+                continue
+            lead = hit["metadata"].get("leading_space")
+            if start <= covered:
+                parts.append(hit["text"][covered - start:])
+            elif lead is not None and start - len(lead) == covered:  # nothing but whitespace skipped
+                parts.append(lead + hit["text"])
+            else:
+                parts.append(" … " + hit["text"])
+            covered = end
+        collapsed.append({
+            **best,
+            "text": "".join(parts),
+            "parent_id": parent,
+            "chunks": len(hits),
+        })
+
+    collapsed.sort(key=lambda r: r.get("score", 0.0), reverse=True)
+    return collapsed[:k]
@@ -0,0 +1,227 @@
+"""Packs prompt context into a token budget.
+
+Prompt length sets prefill time, so every call site that pastes notes or Neural
+Link hits into a prompt goes through `build_context` with a budget: candidates
+are ranked by relevance (the RAG score, or BM25 against the query for plain
+documents), the best are packed first until the budget is spent, and text that
+is already in the context (a duplicate memory, the overlap between two chunks
+of the same document) is only paid for once. The result says how many tokens
+it used, counted with `chunker.count_tokens`.
+
+Items that share a `group` (the same source file or parent document) are
+rendered together under one header, in document order.
+"""
+
+from __future__ import annotations
+
+import math
+import os
+import re
+from collections import Counter
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+try:
+    from .chunker import DEFAULT_MAX_TOKENS, chunk_text, count_tokens, truncate_tokens
+except ImportError:  # run as a script from this folder
+    from chunker import DEFAULT_MAX_TOKENS, chunk_text, count_tokens, truncate_tokens
+
+# num_ctx from the Modelfiles in this repo; Ollama's default for anything else.
+MODEL_CONTEXT_TOKENS: Dict[str, int] = {"riven": 16384, "serenity": 8192, "dash": 8192}
+DEFAULT_CONTEXT_TOKENS = 4096
+# Below this many tokens a cut-down passage is more noise than context.
+MIN_TRIM_TOKENS = 48
+
+_WORD = re.compile(r"\w+")
+
+
+def context_window(model: str) -> int:
+    """The model's context length in tokens (RIVEN_CONTEXT_TOKENS overrides)."""
+    override = os.environ.get("RIVEN_CONTEXT_TOKENS")
+    if override:
+        return int(override)
+    return MODEL_CONTEXT_TOKENS.get(model.split(":")[0].lower(), DEFAULT_CONTEXT_TOKENS)
+
+
+@dataclass
+class ContextItem:
+    text: str
+    score: float = 0.0
+    group: str = ""  # items of one group share a header
+    header: str = ""
+    start: Optional[int] = None  # offsets into the group's document, when known
+    end: Optional[int] = None
+    leading_space: Optional[str] = None  # see chunker.Chunk
+
+
+@dataclass
+class PackedContext:
+    text: str
+    tokens: int
+    budget: int
+    included: int
+    dropped: int  # candidates left out: over budget or already covered
+
+    def summary(self) -> str:
+        return f"{self.tokens}/{self.budget} tokens, {self.included} passages ({self.dropped} left out)"
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def _uncovered(spans: List[Tuple[int, int]], start: int, end: int) -> List[Tuple[int, int]]:
+    """The parts of [start, end) not already in `spans`."""
+    parts = []
+    cursor = start
+    for lo, hi in sorted(spans):
+        if hi <= cursor or lo >= end:
+            continue
+        if lo > cursor:
+            parts.append((cursor, lo))
+        cursor = max(cursor, hi)
+    if cursor < end:
+        parts.append((cursor, end))
+    return parts
+
+
+def bm25_scores(query: str, texts: List[str], k1: float = 1.2, b: float = 0.75) -> List[float]:
+    terms = set(_WORD.findall(query.lower()))
+    if not terms or not texts:
+        return [0.0] * len(texts)
+    counts = [Counter(_WORD.findall(t.lower())) for t in texts]
+    lengths = [sum(c.values()) for c in counts]
+    avg = sum(lengths) / len(lengths) or 1.0
+    df = {term: sum(1 for c in counts if term in c) for term in terms}
+    scores = []
+    for c, length in zip(counts, lengths):
+        score = 0.0
+        for term in terms:
+            tf = c.get(term, 0)
+            if tf:
+                idf = math.log(1 + (len(texts) - df[term] + 0.5) / (df[term] + 0.5))
+                score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / avg))
+        scores.append(score)
+    return scores
+
+
+def documents_to_items(
+    documents: Iterable[Tuple[str, str]],
+    query: str = "",
+    max_tokens: int = DEFAULT_MAX_TOKENS,
+) -> List[ContextItem]:
+    """Chunks (header, text) documents and scores each chunk against `query`.
+
+    With no query every chunk scores 0, so documents are packed in the order given.
+    """
+    items = []
+    for i, (header, text) in enumerate(documents):
+        for chunk in chunk_text(text, max_tokens=max_tokens, overlap=0):
+            items.append(ContextItem(
+                chunk.text, group=f"{i}:{header}", header=header,
+                start=chunk.start, end=chunk.end, leading_space=chunk.leading_space,
+            ))
+    for item, score in zip(items, bm25_scores(query, [item.text for item in items])):
+        item.score = score
+    return items
+
+
+def hits_to_items(hits: List[Dict], header: Optional[Callable[[Dict], str]] = None) -> List[ContextItem]:
+    """ContextItems for SimpleRAG results; chunks of one document share a group."""
+    items = []
+    for hit in hits:
+        metadata = hit.get("metadata") or {}
+        # Collapsed results hold merged text, so their offsets no longer apply.
+        exact = hit.get("chunks", 1) == 1 and "start" in metadata
+        items.append(ContextItem(
+            text=hit["text"],
+            score=hit.get("score", 0.0),
+            group=str(metadata.get("parent_id") or hit.get("id")),
+            header=header(hit) if header else "",
+            start=metadata["start"] if exact else None,
+            end=metadata["end"] if exact else None,
+            leading_space=metadata.get("leading_space") if exact else None,
+        ))
+    return items
+
+
+def _render(chosen: List[Tuple[ContextItem, str]], separator: str) -> str:
+    groups: Dict[str, List[Tuple[ContextItem, str]]] = {}
+    for item, text in chosen:  # best first, so groups come out in rank order
+        groups.setdefault(item.group, []).append((item, text))
+
+    blocks = []
+    for members in groups.values():
+        if all(item.start is not None for item, _ in members):
+            members.sort(key=lambda m: m[0].start)
+        parts: List[str] = []
+        covered = None
+        for item, text in members:
+            if item.start is None or covered is None:
+                parts.append(text if not parts else "\n" + text)
+            elif item.start <= covered:
+                parts.append(text[covered - item.start:])
+            elif item.leading_space is not None and item.start - len(item.leading_space) == covered:
+                parts.append(item.leading_space + text)  # nothing but whitespace skipped
+            else:
+                parts.append(" … " + text)
+            if item.start is not None:
+                covered = max(covered or 0, item.start + len(text))
+        body = "".join(parts)
+        header = members[0][0].header
+        blocks.append(f"{header}\n{body}" if header else body)
+    return separator.join(blocks)
+
+
+def build_context(items: Iterable[ContextItem], budget: int, separator: str = "\n\n") -> PackedContext:
+    """Packs the highest-scoring items into at most `budget` tokens."""
+    candidates = sorted(enumerate(items), key=lambda p: (-p[1].score, p[0]))
+    chosen: List[Tuple[ContextItem, str]] = []
+    seen: List[str] = []
+    spans: Dict[str, List[Tuple[int, int]]] = {}
+    groups = set()
+    remaining = budget
+    dropped = 0
+
+    for _, item in candidates:
+        normalized = _normalize(item.text)
+        if not normalized or any(normalized in s for s in seen):
+            dropped += 1
+            continue
+        text = item.text
+        header_cost = 0 if item.group in groups else count_tokens(item.header)
+        if item.start is not None:
+            fresh = _uncovered(spans.get(item.group, []), item.start, item.start + len(text))
+            if not fresh:
+                dropped += 1
+                continue
+            cost = sum(count_tokens(text[lo - item.start:hi - item.start]) for lo, hi in fresh)
+        else:
+            fresh = None
+            cost = count_tokens(text)
+
+        if header_cost + cost > remaining:
+            room = remaining - header_cost
+            # Only a passage with nothing of it in the context yet is cut down to fit.
+            if room < MIN_TRIM_TOKENS or (fresh is not None and fresh != [(item.start, item.start + len(text))]):
+                dropped += 1
+                continue
+            text = truncate_tokens(text, room)
+            cost = count_tokens(text)
+
+        chosen.append((item, text))
+        seen.append(_normalize(text))
+        groups.add(item.group)
+        if item.start is not None:
+            spans.setdefault(item.group, []).append((item.start, item.start + len(text)))
+        remaining -= header_cost + cost
+
+    # Joins and gap markers can shift the count slightly; shed the weakest passages until it fits.
+    text = _render(chosen, separator)
+    tokens = count_tokens(text)
+    while tokens > budget and chosen:
+        chosen.pop()
+        dropped += 1
+        text = _render(chosen, separator)
+        tokens = count_tokens(text)
+    return PackedContext(text=text, tokens=tokens, budget=budget, included=len(chosen), dropped=dropped)
@@ -0,0 +1,98 @@
+"""Duplicate detection for the Neural Link.
+
+Exact duplicates are caught by a digest of the normalized text (whitespace
+collapsed, case folded). Optionally, near duplicates (reworded abstracts) are
+caught by a 64-bit SimHash over word shingles, looked up through band tables so
+a query only compares against candidates that share at least one band.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import re
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+SIMHASH_BITS = 64
+_MASK = (1 << SIMHASH_BITS) - 1
+_WORD = re.compile(r"\w+")
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFKC", text).split()).casefold()
+
+
+def content_digest(text: str) -> str:
+    return hashlib.blake2b(normalize_text(text).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def simhash(text: str, shingle: int = 3) -> int:
+    """64-bit SimHash of the text's word shingles."""
+    words = _WORD.findall(normalize_text(text))
+    if len(words) >= shingle:
+        features = [" ".join(words[i:i + shingle]) for i in range(len(words) - shingle + 1)]
+    else:
+        features = words
+
+    if not features:
+        return 0
+
+    # Bit b of the result is set when most feature hashes have bit b set.
+    digests = b"".join(hashlib.blake2b(f.encode("utf-8"), digest_size=8).digest() for f in features)
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8).reshape(len(features), 8), axis=1)
+    majority = bits.sum(axis=0) * 2 > len(features)
+    return int.from_bytes(np.packbits(majority).tobytes(), "big")
+
+
+def to_signed64(value: int) -> int:
+    """SQLite integers are signed; store SimHashes in that range."""
+    return value - (1 << SIMHASH_BITS) if value >= 1 << (SIMHASH_BITS - 1) else value
+
+
+def from_signed64(value: int) -> int:
+    return value & _MASK
+
+
+class DuplicateIndex:
+    """digest -> doc id, plus optional SimHash band tables for near-duplicate lookups.
+
+    With `near_distance = d`, the 64 bits are split into d + 1 bands; two hashes
+    within Hamming distance d must agree exactly on at least one band.
+    """
+
+    def __init__(self, near_distance: Optional[int] = None):
+        self.near_distance = near_distance
+        self._exact: Dict[str, str] = {}
+        self._bands: List[Tuple[int, int]] = []
+        self._tables: List[Dict[int, List[Tuple[int, str]]]] = []
+        if near_distance is not None:
+            count = near_distance + 1
+            width = SIMHASH_BITS // count
+            for i in range(count):
+                shift = i * width
+                span = SIMHASH_BITS - shift if i == count - 1 else width
+                self._bands.append((shift, (1 << span) - 1))
+                self._tables.append({})
+
+    def __len__(self) -> int:
+        return len(self._exact)
+
+    def add(self, digest: str, doc_id: str, sim: Optional[int] = None) -> None:
+        self._exact.setdefault(digest, doc_id)
+        if sim is None or self.near_distance is None:
+            return
+        for (shift, mask), table in zip(self._bands, self._tables):
+            table.setdefault((sim >> shift) & mask, []).append((sim, doc_id))
+
+    def find(self, digest: str, sim: Optional[int] = None) -> Optional[str]:
+        """Id of an existing exact (or, if enabled, near) duplicate."""
+        doc_id = self._exact.get(digest)
+        if doc_id is not None or sim is None or self.near_distance is None:
+            return doc_id
+        for (shift, mask), table in zip(self._bands, self._tables):
+            for other, other_id in table.get((sim >> shift) & mask, ()):
+                if bin(sim ^ other).count("1") <= self.near_distance:
+                    return other_id
+        return None
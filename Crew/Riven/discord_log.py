@@ -0,0 +1,207 @@
+"""Background Discord logging that never blocks the caller.
+
+`DiscordDispatcher.send` only appends to a bounded in-memory queue. A worker
+thread drains it: messages that arrive within `coalesce_s` of each other go out
+as one post (up to Discord's message limit), the `X-RateLimit-*` headers and
+429 `retry_after` are honoured, and when the queue is full new messages are
+dropped and counted, with the count reported in the next post. File uploads
+go through the same queue so they stay in order with the text around them.
+
+Dispatchers from `get_dispatcher` are flushed when the interpreter exits.
+
+Environment:
+- `DISCORD_API_BASE` — API root (default https://discord.com/api/v9); point it
+  at a local stub server to test without Discord
+"""
+
+from __future__ import annotations
+
+import atexit
+import os
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+import requests
+
+DEFAULT_API_BASE = "https://discord.com/api/v9"
+MAX_MESSAGE_CHARS = 1900  # Discord allows 2000; leave room for the drop notice
+MAX_QUEUE = 200
+COALESCE_S = 1.0
+TIMEOUT = (5, 15)  # connect, read
+MAX_RETRIES = 3
+MAX_WAIT_S = 60.0  # longest rate-limit pause honoured before giving up on a post
+
+
+def _truncate(message: str) -> str:
+    if len(message) > MAX_MESSAGE_CHARS:
+        return message[:MAX_MESSAGE_CHARS] + "... (truncated)"
+    return message
+
+
+class DiscordDispatcher:
+    def __init__(
+        self,
+        token: str,
+        channel_id: str,
+        *,
+        api_base: Optional[str] = None,
+        max_queue: int = MAX_QUEUE,
+        coalesce_s: float = COALESCE_S,
+    ):
+        base = (api_base or os.environ.get("DISCORD_API_BASE") or DEFAULT_API_BASE).rstrip("/")
+        self.url = f"{base}/channels/{channel_id}/messages"
+        self.max_queue = max_queue
+        self.coalesce_s = coalesce_s
+        self.posts = 0
+        self.dropped = 0  # total, for the caller's information
+        self._unreported = 0  # dropped since the last post
+        self._items: Deque[Tuple[str, str, str]] = deque()  # (kind, text, filepath)
+        self._cond = threading.Condition()
+        self._busy = False
+        self._closing = False
+        self._blocked_until = 0.0
+        self._session = requests.Session()
+        self._session.headers["Authorization"] = f"Bot {token}"
+        self._thread = threading.Thread(target=self._run, name="discord-log", daemon=True)
+        self._thread.start()
+
+    def send(self, message: str) -> bool:
+        """Queues a message; False if it was dropped because the queue is full."""
+        return self._enqueue(("text", _truncate(message), ""))
+
+    def upload(self, filepath: str, message: str = "") -> bool:
+        return self._enqueue(("file", message, filepath))
+
+    def _enqueue(self, item: Tuple[str, str, str]) -> bool:
+        with self._cond:
+            if self._closing or len(self._items) >= self.max_queue:
+                self.dropped += 1
+                self._unreported += 1
+                return False
+            self._items.append(item)
+            self._cond.notify_all()
+            return True
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Waits until everything queued so far is posted (or given up on)."""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._items and not self._busy, timeout)
+
+    def close(self, timeout: float = 10.0) -> None:
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+
+    def _next_batch(self) -> Optional[Tuple[str, str, str]]:
+        """Blocks for work, then waits out the coalescing window and merges queued text."""
+        with self._cond:
+            while not self._items and not self._closing:
+                self._cond.wait()
+            if not self._items:
+                return None
+            deadline = time.monotonic() + self.coalesce_s
+            while not self._closing and time.monotonic() < deadline:
+                self._cond.wait(deadline - time.monotonic())
+
+            self._busy = True
+            if self._items[0][0] == "file":
+                item = self._items.popleft()
+            else:
+                parts: List[str] = []
+                size = 0
+                while self._items and self._items[0][0] == "text":
+                    text = self._items[0][1]
+                    if parts and size + len(text) + 1 > MAX_MESSAGE_CHARS:
+                        break
+                    parts.append(self._items.popleft()[1])
+                    size += len(text) + 1
+                item = ("text", "\n".join(parts), "")
+            if self._unreported:
+                notice = f"[{self._unreported} log messages dropped: queue full]"
+                item = (item[0], f"{notice}\n{item[1]}" if item[1] else notice, item[2])
+                self._unreported = 0
+            return item
+
+    def _run(self) -> None:
+        while True:
+            item = self._next_batch()
+            if item is None:
+                return
+            kind, text, filepath = item
+            try:
+                if kind == "file":
+                    self._upload(filepath, text)
+                else:
+                    self._post(json={"content": text})
+            except Exception as e:
+                print(f"Failed to log to Discord: {e}")
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+
+    def _upload(self, filepath: str, message: str) -> None:
+        with open(filepath, "rb") as f:
+            data = f.read()
+        name = os.path.basename(filepath)
+        self._post(
+            data={"content": message} if message else {},
+            files={"file": (name, data, "text/markdown")},
+        )
+        print(f"Uploaded {filepath} to Discord.")
+
+    def _post(self, **kwargs) -> None:
+        for _ in range(MAX_RETRIES):
+            wait = self._blocked_until - time.monotonic()
+            if wait > 0:
+                time.sleep(min(wait, MAX_WAIT_S))
+            resp = self._session.post(self.url, timeout=TIMEOUT, **kwargs)
+            self._note_rate_limit(resp)
+            if resp.status_code != 429:
+                resp.raise_for_status()
+                self.posts += 1
+                return
+            try:
+                retry_after = float(resp.json().get("retry_after", 1.0))
+            except ValueError:
+                retry_after = float(resp.headers.get("Retry-After", 1.0))
+            if retry_after > MAX_WAIT_S:
+                break
+            self._blocked_until = time.monotonic() + retry_after
+        raise RuntimeError("rate limited by Discord, message dropped")
+
+    def _note_rate_limit(self, resp: requests.Response) -> None:
+        # Out of requests in this bucket: hold the next post until it resets.
+        if resp.headers.get("X-RateLimit-Remaining") == "0":
+            try:
+                reset_after = float(resp.headers.get("X-RateLimit-Reset-After", "1"))
+            except ValueError:
+                reset_after = 1.0
+            self._blocked_until = time.monotonic() + reset_after
+
+
+_dispatchers: Dict[Tuple[str, str], DiscordDispatcher] = {}
+_dispatchers_lock = threading.Lock()
+
+
+def get_dispatcher(token: str, channel_id: str) -> DiscordDispatcher:
+    """The shared dispatcher for a channel, started on first use."""
+    with _dispatchers_lock:
+        key = (token, str(channel_id))
+        if key not in _dispatchers:
+            if not _dispatchers:
+                atexit.register(close_all)
+            _dispatchers[key] = DiscordDispatcher(token, str(channel_id))
+        return _dispatchers[key]
+
+
+def close_all(timeout: float = 10.0) -> None:
+    """Flushes and stops every shared dispatcher; runs at exit."""
+    with _dispatchers_lock:
+        dispatchers = list(_dispatchers.values())
+        _dispatchers.clear()
+    for dispatcher in dispatchers:
+        dispatcher.close(timeout)
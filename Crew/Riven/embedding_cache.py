@@ -0,0 +1,99 @@
+"""On-disk LRU cache of embeddings keyed by (model, text digest).
+
+Repeated questions, repeated QUERY actions and re-ingests after a model switch
+all ask for embeddings we have already paid for. Entries live in one SQLite file
+shared by every brain in the data folder; when it grows past `max_entries` the
+least recently used rows are evicted.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    key       TEXT PRIMARY KEY,
+    model     TEXT NOT NULL,
+    vector    BLOB NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used);
+"""
+
+
+def cache_key(model: str, text: str) -> str:
+    return hashlib.blake2b(f"{model}\0{text}".encode("utf-8"), digest_size=20).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, path: str, max_entries: int = 100_000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(_SCHEMA)
+
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """Cached vectors for `texts` (None for misses); hits are marked as recently used."""
+        keys = [cache_key(model, t) for t in texts]
+        found: Dict[str, bytes] = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                found.update(self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+                ).fetchall())
+            if found:
+                now = time.time()
+                with self._conn:
+                    self._conn.executemany(
+                        "UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, k) for k in found]
+                    )
+
+        results = [np.frombuffer(found[k], dtype=np.float32).tolist() if k in found else None for k in keys]
+        hits = len(keys) - results.count(None)
+        self.hits += hits
+        self.misses += len(keys) - hits
+        return results
+
+    def put_many(self, model: str, texts: Sequence[str], vectors: Sequence[List[float]]) -> None:
+        now = time.time()
+        rows = [
+            (cache_key(model, t), model, np.asarray(v, dtype=np.float32).tobytes(), now)
+            for t, v in zip(texts, vectors)
+            if v
+        ]
+        if not rows:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector, last_used) VALUES (?, ?, ?, ?)", rows
+            )
+            excess = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (excess,),
+                )
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -1,15 +1,21 @@
+import argparse
 import asyncio
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 import json
 import re
-import sys
-import edge_tts
-import requests
+import subprocess
+from datetime import datetime
 from pathlib import Path
+from generate_video import create_fast_video
+from generation_cache import cached_generate, open_generation_cache
+from ollama_client import get_client
+from tts_cache import get_tts_cache, synthesize as synthesize_clip
 
 # Configuration
-OLLAMA_URL = "http://localhost:11434/api/generate"
 MODEL_NAME = "river"
+# Every run gets its own folder under here, so runs never see each other's segments.
 OUTPUT_DIR = os.path.join(os.path.dirname(__file__), "podcast_output")
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
@@ -19,6 +25,15 @@ VOICE_HOST = "en-US-ChristopherNeural"
 # River (Guest) - Female, soft, slightly mystic
 VOICE_RIVER = "en-US-AriaNeural"
 
+# Lines synthesized at once, and attempts per line before it is skipped.
+TTS_CONCURRENCY = int(os.environ.get("RIVEN_TTS_CONCURRENCY", "4"))
+TTS_RETRIES = 3
+
+# Batch mode: reports are fed through script -> TTS -> render as a pipeline.
+BATCH_PATTERN = "River_Report_*.md"
+SCRIPT_CONCURRENCY = 1  # Ollama runs one generation at a time per model anyway
+RENDER_WORKERS = max(1, min(4, (os.cpu_count() or 2) // 2))
+
 SYSTEM_PROMPT = """
 You are an expert audio producer.
 Convert the provided Research Report into a lively, 2-person podcast script.
@@ -35,129 +50,264 @@ Convert the provided Research Report into a lively, 2-person podcast script.
 - **FORMAT:** Output strict JSON list of objects: `[{"speaker": "Mal", "text": "Hello folks..."}, {"speaker": "River", "text": "Hi Mal..."}]`
 """
 
-def generate_script(report_text):
+def create_run_dir(report_path):
+    """podcast_output/<timestamp>_<report name>/, unique even for simultaneous runs."""
+    slug = re.sub(r"[^a-z0-9]+", "-", Path(report_path).stem.lower()).strip("-")[:60] or "podcast"
+    run_id = f"{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}_{slug}"
+    for attempt in range(1, 100):
+        run_dir = os.path.join(OUTPUT_DIR, run_id if attempt == 1 else f"{run_id}-{attempt}")
+        try:
+            os.makedirs(run_dir)
+            return run_dir
+        except FileExistsError:
+            continue
+    raise RuntimeError(f"could not create a run folder for {run_id}")
+
+def write_manifest(run_dir, manifest):
+    with open(os.path.join(run_dir, "manifest.json"), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+
+def parse_script(result):
+    """The JSON script in a model response; raises ValueError if there is none."""
+    # Sanitize json if needed (sometimes models add text before/after)
+    start = result.find('[')
+    end = result.rfind(']') + 1
+    if start != -1 and end != -1:
+        return json.loads(result[start:end])
+    return json.loads(result)
+
+def _is_script(result):
+    try:
+        parse_script(result)
+        return True
+    except ValueError:
+        return False
+
+def generate_script(report_text, cache=None):
     print("Generating podcast script from report...")
     
     prompt = f"{SYSTEM_PROMPT}\n\n**REPORT:**\n{report_text}\n\n**JSON SCRIPT:**"
     
-    payload = {
-        "model": MODEL_NAME,
-        "prompt": prompt,
-        "format": "json",
-        "stream": False
-    }
-    
     try:
-        response = requests.post(OLLAMA_URL, json=payload)
-        response.raise_for_status()
-        result = response.json()['response']
-        # Sanitize json if needed (sometimes models add text before/after)
-        start = result.find('[')
-        end = result.rfind(']') + 1
-        if start != -1 and end != -1:
-            return json.loads(result[start:end])
-        return json.loads(result)
+        # With a generation cache, an unchanged report gets its earlier script back;
+        # only a response that parses is stored.
+        result = cached_generate(get_client(), prompt, MODEL_NAME, cache, validate=_is_script, format="json")['response']
+        return parse_script(result)
     except Exception as e:
         print(f"Error generating script: {e}")
         return None
 
-async def synthesize_audio(script):
-    print("Synthesizing audio...")
-    files = []
-    
+def parse_line(line):
+    """(speaker, text) for one script entry, or None if it can't be voiced."""
+    if isinstance(line, str):
+        # Fallback if the model returned ["Speaker: text", ...]
+        parts = line.split(':', 1)
+        if len(parts) != 2:
+            return None
+        speaker, text = parts[0].strip().title(), parts[1].strip()
+    elif isinstance(line, dict):
+        speaker = line.get("speaker", "Mal").title()
+        text = line.get("text", "")
+    else:
+        return None
+    return (speaker, text) if text else None
+
+async def synthesize_line(text, voice, filepath, retries=TTS_RETRIES):
+    for attempt in range(retries):
+        try:
+            # Unchanged lines come straight from the TTS cache.
+            data = await synthesize_clip(text, voice, cache=get_tts_cache())
+            break
+        except Exception:
+            if attempt == retries - 1:
+                raise
+            await asyncio.sleep(2 ** attempt)
+
+    # Written under a temporary name so a failed run never leaves a partial segment behind.
+    tmp_path = filepath + ".part"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, filepath)
+
+async def synthesize_audio(script, run_dir, concurrency=TTS_CONCURRENCY, limit=None):
+    """Synthesizes every line into run_dir, `concurrency` at a time.
+
+    Pass `limit` (a semaphore) to share the TTS budget between podcasts made at once.
+    Returns one segment record (index, speaker, voice, file) per voiced line, in script order.
+    """
+    jobs = []
     for i, line in enumerate(script):
-        if isinstance(line, str):
-            # Fallback if the model returned ["Speaker: text", ...]
-            parts = line.split(':', 1)
-            if len(parts) == 2:
-                speaker = parts[0].strip().title()
-                text = parts[1].strip()
-            else:
-                continue
-        elif isinstance(line, dict):
-            speaker = line.get("speaker", "Mal").title()
-            text = line.get("text", "")
-        else:
-            continue
-        
-        if not text: continue
-        
-        voice = VOICE_RIVER if "River" in speaker else VOICE_HOST
-        
-        filename = f"{i:03d}_{speaker}.mp3"
-        filepath = os.path.join(OUTPUT_DIR, filename)
-        
-        print(f"  Generating line {i+1}: {speaker} -> {filepath}")
-        
-        communicate = edge_tts.Communicate(text, voice)
-        await communicate.save(filepath)
-        files.append(filename)
-        
-    return files
-
-def create_playlist(files):
-    playlist_path = os.path.join(OUTPUT_DIR, "play_podcast.m3u")
+        parsed = parse_line(line)
+        if parsed:
+            speaker, text = parsed
+            voice = VOICE_RIVER if "River" in speaker else VOICE_HOST
+            jobs.append((i, speaker, text, voice, f"{i:03d}_{speaker}.mp3"))
+
+    if limit is None:
+        limit = asyncio.Semaphore(concurrency)
+    print(f"Synthesizing audio for {os.path.basename(run_dir)} ({len(jobs)} lines)...")
+    done = 0
+
+    async def run(i, speaker, text, voice, filename):
+        nonlocal done
+        async with limit:
+            try:
+                await synthesize_line(text, voice, os.path.join(run_dir, filename))
+            except Exception as e:
+                print(f"  Line {i+1} ({speaker}) failed after {TTS_RETRIES} attempts: {e}")
+                return None
+        done += 1
+        print(f"  [{done}/{len(jobs)}] line {i+1}: {speaker} -> {filename}")
+        return {"index": i, "speaker": speaker, "voice": voice, "file": filename}
+
+    results = await asyncio.gather(*(run(*job) for job in jobs))
+    cache = get_tts_cache()
+    if cache:
+        stats = cache.stats()
+        print(f"  TTS cache: {stats['hits']} reused, {stats['misses']} synthesized")
+    return [segment for segment in results if segment]
+
+def concat_segments(run_dir, files, final_output):
+    """Joins the segments with ffmpeg's concat demuxer, feeding the file list on stdin."""
+    def quote(path):
+        return "'" + path.replace("'", "'\\''") + "'"
+
+    # Explicit file: URLs, since relative entries would resolve against the stdin URL.
+    listing = "".join(f"file {quote('file:' + os.path.abspath(os.path.join(run_dir, name)))}\n" for name in files)
+    cmd = [
+        "ffmpeg", "-hide_banner", "-loglevel", "error",
+        # stdin is the pipe: protocol on older ffmpeg builds and fd: on newer ones.
+        "-f", "concat", "-safe", "0", "-protocol_whitelist", "file,pipe,fd", "-i", "-",
+        "-c", "copy", final_output, "-y",
+    ]
+    subprocess.run(cmd, input=listing.encode("utf-8"), check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+def create_playlist(files, run_dir):
+    """Writes the .m3u, merges the segments into podcast_final.mp3 and renders the video.
+
+    Returns (final audio path or None, video path or None).
+    """
+    playlist_path = os.path.join(run_dir, "play_podcast.m3u")
     with open(playlist_path, 'w') as f:
         for file in files:
             f.write(file + "\n")
     print("Open the .m3u file with VLC, Windows Media Player, or any audio player to listen.")
 
     # Concatenate with FFmpeg
-    final_output = os.path.join(OUTPUT_DIR, "podcast_final.mp3")
+    final_output = os.path.join(run_dir, "podcast_final.mp3")
     print(f"Merging into {final_output}...")
-    
-    # Create input list for ffmpeg
-    list_path = os.path.join(OUTPUT_DIR, "ffmpeg_list.txt")
-    with open(list_path, 'w', encoding='utf-8') as f:
-        for file in files:
-            f.write(f"file '{file}'\n")
-            
-    # Run FFmpeg
     try:
-        import subprocess
-        # Check if ffmpeg is available
-        subprocess.run(["ffmpeg", "-version"], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        
-        cmd = ["ffmpeg", "-f", "concat", "-safe", "0", "-i", list_path, "-c", "copy", final_output, "-y"]
-        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        concat_segments(run_dir, files, final_output)
         print(f"Successfully created: {final_output}")
-    except (subprocess.CalledProcessError, FileNotFoundError):
-        print("FFmpeg not found or failed. Returning separate files.")
+    except FileNotFoundError:
+        print("FFmpeg not found. Returning separate files.")
+        return None, None
+    except subprocess.CalledProcessError as e:
+        print(f"FFmpeg failed: {e.stderr.decode('utf-8', errors='replace').strip()[:500]}")
+        return None, None
 
     # Generate Video
+    video_output = None
     try:
-        video_script = os.path.join(os.path.dirname(__file__), "generate_video.py")
         print("Generating video...")
-        subprocess.run([sys.executable, video_script, OUTPUT_DIR], check=True)
+        video_output = create_fast_video(run_dir)
     except Exception as e:
         print(f"Video generation failed: {e}")
+    return final_output, video_output
+
+async def produce_podcast(report_path, script_limit=None, tts_limit=None, executor=None, cache=None):
+    """Runs one report through every stage. Returns its manifest.
+
+    Scripting runs on a thread under `script_limit`, synthesis shares `tts_limit`,
+    and the CPU-bound concat + video step runs on `executor` (a process pool in
+    batch mode), so different reports can occupy different stages at once.
+    """
+    with open(report_path, 'r', encoding='utf-8') as f:
+        report_text = f.read()
+
+    run_dir = create_run_dir(report_path)
+    print(f"Run folder: {run_dir}")
+    manifest = {
+        "run_id": os.path.basename(run_dir),
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "report": os.path.abspath(report_path),
+        "model": MODEL_NAME,
+        "status": "scripting",
+        "segments": [],
+    }
+    write_manifest(run_dir, manifest)
+
+    async with (script_limit or asyncio.Semaphore(1)):
+        script = await asyncio.to_thread(generate_script, report_text, cache)
+    if not script:
+        manifest["status"] = "failed"
+        write_manifest(run_dir, manifest)
+        return manifest
+
+    # Save script for debug
+    with open(os.path.join(run_dir, "script.json"), 'w') as f:
+        json.dump(script, f, indent=2)
+
+    # The playlist is built from exactly the segments this run produced, in script order.
+    manifest["segments"] = await synthesize_audio(script, run_dir, limit=tts_limit)
+    manifest["status"] = "synthesized"
+    write_manifest(run_dir, manifest)
+
+    files = [seg["file"] for seg in manifest["segments"]]
+    final_audio, video = await asyncio.get_running_loop().run_in_executor(executor, create_playlist, files, run_dir)
+    manifest.update({
+        "status": "done" if final_audio else "segments_only",
+        "final_audio": final_audio and os.path.basename(final_audio),
+        "video": video and os.path.basename(video),
+    })
+    write_manifest(run_dir, manifest)
+    return manifest
+
+async def produce_batch(report_paths, workers=RENDER_WORKERS, cache=None):
+    script_limit = asyncio.Semaphore(SCRIPT_CONCURRENCY)
+    tts_limit = asyncio.Semaphore(TTS_CONCURRENCY)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return await asyncio.gather(
+            *(produce_podcast(path, script_limit, tts_limit, executor, cache) for path in report_paths),
+            return_exceptions=True,
+        )
 
 def main():
-    if len(sys.argv) < 2:
-        print("Usage: python generate_podcast.py <path_to_report.md>")
-        print("Or provide text via stdin.")
+    parser = argparse.ArgumentParser(description="Turn research reports into podcasts")
+    parser.add_argument("report", nargs="?", help="Path to one report (.md)")
+    parser.add_argument("--batch", metavar="DIR", help="Produce a podcast for every matching report in DIR")
+    parser.add_argument("--pattern", default=BATCH_PATTERN, help=f"Report glob for --batch (default {BATCH_PATTERN})")
+    parser.add_argument("--workers", type=int, default=RENDER_WORKERS, help="Processes for concat + video in --batch")
+    parser.add_argument(
+        "--cache",
+        action=argparse.BooleanOptionalAction,
+        default=None,
+        help="Reuse the stored script for an unchanged report (default: RIVEN_GENERATION_CACHE)",
+    )
+    args = parser.parse_args()
+    cache = open_generation_cache(args.cache)
+
+    if args.batch:
+        reports = sorted(Path(args.batch).glob(args.pattern))
+        if not reports:
+            print(f"No reports matching {args.pattern} in {args.batch}.")
+            return
+        print(f"Batch: {len(reports)} reports, {args.workers} render workers")
+        started = time.perf_counter()
+        results = asyncio.run(produce_batch(reports, args.workers, cache))
+        for path, result in zip(reports, results):
+            status = f"error: {result}" if isinstance(result, BaseException) else result["status"]
+            print(f"  {path.name}: {status}")
+        print(f"Batch finished in {time.perf_counter() - started:.1f}s")
         return
 
-    report_path = sys.argv[1]
-    
-    if os.path.exists(report_path):
-        with open(report_path, 'r', encoding='utf-8') as f:
-            report_text = f.read()
-    else:
+    if not args.report:
+        parser.print_usage()
+        return
+    if not os.path.exists(args.report):
         print("File not found.")
         return
-
-    script = generate_script(report_text)
-    if script:
-        # Save script for debug
-        with open(os.path.join(OUTPUT_DIR, "script.json"), 'w') as f:
-            json.dump(script, f, indent=2)
-            
-        asyncio.run(synthesize_audio(script))
-        
-        # Re-list files to ensure order (glob might differ, but our numbering 001_ helps)
-        files = sorted([f for f in os.listdir(OUTPUT_DIR) if f.endswith(".mp3")])
-        create_playlist(files)
+    asyncio.run(produce_podcast(args.report, cache=cache))
 
 if __name__ == "__main__":
     main()
@@ -1,60 +1,134 @@
+import argparse
 import os
-import sys
-from moviepy import *
-from pathlib import Path
+import subprocess
 
 # Configuration
 SIZE = (1280, 720) # 720p
 FONT_COLOR = 'green'
+TITLE = "SERENITY CORTEX\nAUDIO BRIEFING"
+FONT_SIZE = 70
+# Tried in order for the fast path's title card; Pillow's built-in font is the last resort.
+CARD_FONTS = ["cour.ttf", "Courier New.ttf", "DejaVuSansMono.ttf", "LiberationMono-Regular.ttf"]
+
+def render_title_card(path):
+    """Draws the title card once, as a PNG."""
+    from PIL import Image, ImageDraw, ImageFont
+
+    font = None
+    for name in CARD_FONTS:
+        try:
+            font = ImageFont.truetype(name, FONT_SIZE)
+            break
+        except OSError:
+            continue
+    if font is None:
+        try:
+            font = ImageFont.load_default(size=FONT_SIZE)
+        except TypeError:  # Pillow < 10.1 has a single fixed-size default font
+            font = ImageFont.load_default()
+
+    card = Image.new("RGB", SIZE, (0, 0, 0))
+    draw = ImageDraw.Draw(card)
+    center = (SIZE[0] // 2, SIZE[1] // 2)
+    draw.multiline_text(center, TITLE, font=font, fill=FONT_COLOR, anchor="mm", align="center", spacing=12)
+    card.save(path)
+    return path
+
+def create_fast_video(output_dir):
+    """Title card PNG looped by ffmpeg as a still image under the podcast audio."""
+    audio_path = os.path.join(output_dir, "podcast_final.mp3")
+    if not os.path.exists(audio_path):
+        print("Final audio not found.")
+        return None
+
+    card_path = render_title_card(os.path.join(output_dir, "title_card.png"))
+    output_path = os.path.join(output_dir, "podcast_video.mp4")
+    cmd = [
+        "ffmpeg", "-hide_banner", "-loglevel", "error",
+        "-loop", "1", "-framerate", "1", "-i", card_path,
+        "-i", audio_path,
+        # One frame per second of a still picture: the video costs next to nothing to encode.
+        "-c:v", "libx264", "-tune", "stillimage", "-preset", "ultrafast", "-pix_fmt", "yuv420p", "-r", "1",
+        # MP3 is valid in MP4, so the podcast audio is copied as-is.
+        "-c:a", "copy",
+        "-shortest", "-movflags", "+faststart",
+        output_path, "-y",
+    ]
+    try:
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    except FileNotFoundError:
+        print("FFmpeg not found.")
+        return None
+    except subprocess.CalledProcessError as e:
+        print(f"FFmpeg failed: {e.stderr.decode('utf-8', errors='replace').strip()[:500]}")
+        return None
+
+    print(f"Video generated: {output_path}")
+    return output_path
 
 def create_simple_video(output_dir):
     print("Initializing Simple Video Generation...")
-    
+    # MoviePy is slow to import and only needed for this compositing path.
+    from moviepy import AudioFileClip, ColorClip, CompositeVideoClip, TextClip
+
     audio_path = os.path.join(output_dir, "podcast_final.mp3")
     if not os.path.exists(audio_path):
         print("Final audio not found.")
         return None
-        
+
     # Create simple background (Black)
     # In a real scenario, we could load a 'serenity_logo.png' if it existed
     bg_clip = ColorClip(size=SIZE, color=(0, 0, 0), duration=1) # Duration fixed later
-    
+
     # Add Title Text
     txt_clip = TextClip(
-        text="SERENITY CORTEX\nAUDIO BRIEFING",
+        text=TITLE,
         font="Courier",
-        font_size=70,
+        font_size=FONT_SIZE,
         color=FONT_COLOR,
         size=SIZE,
         method='caption',
         text_align='center'
     ).with_position('center')
-    
+
     # Load Audio
     audio = AudioFileClip(audio_path)
-    
+
     # Set durations
     video = CompositeVideoClip([bg_clip, txt_clip])
     video = video.with_duration(audio.duration)
     video = video.with_audio(audio)
-    
+
     output_path = os.path.join(output_dir, "podcast_video.mp4")
-    
+
     # Write file (faster preset)
     video.write_videofile(
-        output_path, 
+        output_path,
         fps=1, # 1 FPS is enough for a static image
-        codec='libx264', 
+        codec='libx264',
         audio_codec='aac',
         preset='ultrafast',
         logger=None
     )
-    
+
     print(f"Video generated: {output_path}")
     return output_path
 
-if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python generate_video.py <output_dir>")
+def main():
+    parser = argparse.ArgumentParser(description="Render the podcast video for a podcast run folder")
+    parser.add_argument("output_dir", help="Folder containing podcast_final.mp3")
+    parser.add_argument(
+        "--mode",
+        choices=["fast", "full"],
+        default="fast",
+        help="fast: still title card looped by ffmpeg; full: MoviePy compositing",
+    )
+    args = parser.parse_args()
+
+    if args.mode == "full":
+        create_simple_video(args.output_dir)
     else:
-        create_simple_video(sys.argv[1])
\ No newline at end of file
+        create_fast_video(args.output_dir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""Opt-in disk cache of finished Ollama generations.
+
+A research dossier or podcast script takes minutes to generate, and the same
+(model, prompt, options) request is often sent again: a rerun of a topic, a
+podcast regenerated for an unchanged report. Responses are stored under a
+digest of the model's *digest* (so rebuilding a model from an edited Modelfile
+invalidates its entries), the prompt and the request options.
+
+Entries expire after a TTL, and the least recently used are evicted once the
+cache outgrows its size bound. Only complete responses are stored.
+
+Environment:
+- `RIVEN_GENERATION_CACHE` — `1` turns the cache on where a script's
+  `--cache/--no-cache` flag is not given (default off)
+- `RIVEN_GENERATION_CACHE_MB` — size bound in megabytes (default 256)
+- `RIVEN_GENERATION_CACHE_TTL_H` — entry lifetime in hours (default 168)
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+try:
+    from .ollama_client import Models, OllamaClient, model_chain
+except ImportError:  # run as a script from this folder
+    from ollama_client import Models, OllamaClient, model_chain
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+CACHE_PATH = os.path.join(DATA_DIR, "generation_cache.sqlite")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS generations (
+    key        TEXT PRIMARY KEY,
+    model      TEXT NOT NULL,
+    response   TEXT NOT NULL,
+    bytes      INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_used  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS generations_last_used ON generations (last_used);
+"""
+
+_digests: Dict[Tuple[str, str], Optional[Tuple[str, str]]] = {}
+_digests_lock = threading.Lock()
+
+
+def _tagged(model: str) -> str:
+    return model if ":" in model else f"{model}:latest"
+
+
+def resolve_model(client: OllamaClient, models: Models) -> Optional[Tuple[str, str]]:
+    """(name, digest) of the model in the chain that will answer, or None if unknown."""
+    chain = model_chain(models)
+    memo_key = (client.base_url, "\0".join(chain))
+    with _digests_lock:
+        if memo_key in _digests:
+            return _digests[memo_key]
+    try:
+        installed = client.tags()
+    except Exception as e:
+        print(f"[GenCache] Could not list models ({e}); not caching.")
+        return None
+    resolved = None
+    for model in chain:
+        name = _tagged(model)
+        if installed.get(name):
+            resolved = (name, installed[name])
+            break
+    with _digests_lock:
+        _digests[memo_key] = resolved
+    return resolved
+
+
+def generation_key(model_digest: str, prompt: str, options: Dict) -> str:
+    material = json.dumps([model_digest, prompt, options], sort_keys=True, ensure_ascii=False)
+    return hashlib.blake2b(material.encode("utf-8"), digest_size=20).hexdigest()
+
+
+class GenerationCache:
+    def __init__(self, path: str = CACHE_PATH, max_bytes: int = 256 * 1024 * 1024, ttl_s: float = 7 * 24 * 3600):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(_SCHEMA)
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response FROM generations WHERE key = ? AND created_at >= ?", (key, now - self.ttl_s)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            with self._conn:
+                self._conn.execute("UPDATE generations SET last_used = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def put(self, key: str, model: str, response: str) -> None:
+        size = len(response.encode("utf-8"))
+        if not response or size > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO generations (key, model, response, bytes, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, response, size, now, now),
+            )
+            self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        self._conn.execute("DELETE FROM generations WHERE created_at < ?", (now - self.ttl_s,))
+        total = self._conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM generations").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Trim to 90% so a full cache doesn't rescan on every put.
+        target = self.max_bytes * 0.9
+        doomed = []
+        for key, size in self._conn.execute("SELECT key, bytes FROM generations ORDER BY last_used"):
+            if total <= target:
+                break
+            doomed.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM generations WHERE key = ?", doomed)
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def open_generation_cache(enabled: Optional[bool] = None) -> Optional[GenerationCache]:
+    """The cache under data/, or None when it is off.
+
+    `enabled` is a script's --cache/--no-cache flag; None defers to RIVEN_GENERATION_CACHE.
+    """
+    if enabled is None:
+        enabled = os.environ.get("RIVEN_GENERATION_CACHE", "").lower() in ("1", "true", "yes", "on")
+    if not enabled:
+        return None
+    megabytes = float(os.environ.get("RIVEN_GENERATION_CACHE_MB", "256"))
+    hours = float(os.environ.get("RIVEN_GENERATION_CACHE_TTL_H", "168"))
+    return GenerationCache(CACHE_PATH, int(megabytes * 1024 * 1024), hours * 3600)
+
+
+def cached_generate(
+    client: OllamaClient,
+    prompt: str,
+    models: Models,
+    cache: Optional[GenerationCache],
+    validate: Optional[Callable[[str], bool]] = None,
+    **options,
+) -> Dict:
+    """client.generate(), answered from the cache for a request it has seen before.
+
+    A cached answer is {"model", "response", "done": True, "cached": True}.
+    With `validate`, a response is only stored if validate(response) is true,
+    so an answer the caller cannot use is not handed back on the next run.
+    """
+    if cache is None:
+        return client.generate(prompt, models, **options)
+    resolved = resolve_model(client, models)
+    if resolved is None:
+        return client.generate(prompt, models, **options)
+    name, digest = resolved
+    key = generation_key(digest, prompt, options)
+    response = cache.get(key)
+    if response is not None:
+        print(f"[GenCache] Reusing the stored {name} response.")
+        return {"model": name, "response": response, "done": True, "cached": True}
+
+    result = client.generate(prompt, models, **options)
+    # Only complete answers from the resolved model are stored; a fallback's answer
+    # belongs to another digest, and one cut off at the token limit is not worth keeping.
+    complete = result.get("done", True) and result.get("done_reason") != "length"
+    response = result.get("response", "")
+    if complete and _tagged(result.get("model", name)) == name and (validate is None or validate(response)):
+        cache.put(key, name, response)
+    return result
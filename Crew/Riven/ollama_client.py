@@ -0,0 +1,326 @@
+"""Shared Ollama client for every Riven entry point.
+
+One pooled keep-alive `requests.Session` per Ollama host, per-operation timeouts,
+retry with exponential backoff on network errors and 5xx responses (4xx responses
+are not retried), and model fallback chains: `models=["riven", "phi3"]` tries
+each model in order until one answers.
+
+`AsyncOllamaClient` is the asyncio twin (needs `httpx`), for callers like
+RiverAgent that serve many concurrent requests. Cancelling the awaiting task
+closes the HTTP connection, which makes Ollama abort the generation.
+
+Environment:
+- `OLLAMA_BASE_URL` / `OLLAMA_HOST` — Ollama host (default http://127.0.0.1:11434)
+- `OLLAMA_KEEP_ALIVE` — how long Ollama keeps a model loaded after a call
+  (e.g. `30m`, `-1` for forever); unset leaves Ollama's default
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import threading
+import time
+import weakref
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Sequence, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except ImportError:  # only needed by AsyncOllamaClient
+    httpx = None  # type: ignore
+
+OLLAMA_BASE_URL = (os.environ.get("OLLAMA_BASE_URL") or os.environ.get("OLLAMA_HOST") or "http://127.0.0.1:11434").rstrip("/")
+
+# (connect, read) seconds. For streams, read is the longest gap between chunks.
+DEFAULT_TIMEOUTS: Dict[str, tuple] = {
+    "embed": (5, 60),
+    "chat": (5, 120),
+    "generate": (5, 600),
+    "show": (5, 10),
+}
+
+Models = Union[str, Sequence[str]]
+
+
+class OllamaError(RuntimeError):
+    """Every model in the fallback chain failed."""
+
+
+def base_url_from_endpoint(url: str) -> str:
+    """'http://host:11434/api/generate' -> 'http://host:11434'."""
+    url = url.rstrip("/")
+    marker = url.find("/api/")
+    return url[:marker] if marker != -1 else url
+
+
+def _keep_alive_from_env() -> Optional[Union[str, int]]:
+    value = os.environ.get("OLLAMA_KEEP_ALIVE")
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+class OllamaClient:
+    def __init__(
+        self,
+        base_url: str = OLLAMA_BASE_URL,
+        *,
+        pool_size: int = 8,
+        retries: int = 2,
+        backoff: float = 0.5,
+        max_backoff: float = 10.0,
+        keep_alive: Optional[Union[str, int]] = None,
+        timeouts: Optional[Dict[str, tuple]] = None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.keep_alive = keep_alive if keep_alive is not None else _keep_alive_from_env()
+        self.timeouts = {**DEFAULT_TIMEOUTS, **(timeouts or {})}
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _payload(self, payload: Dict) -> Dict:
+        if self.keep_alive is not None and "keep_alive" not in payload:
+            payload = {**payload, "keep_alive": self.keep_alive}
+        return payload
+
+    def post(self, path: str, payload: Dict, *, op: str, stream: bool = False) -> requests.Response:
+        """POSTs with retry/backoff. Returns the response (4xx included); raises after the last retry."""
+        url = f"{self.base_url}{path}"
+        last_error: Optional[Exception] = None
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.post(url, json=self._payload(payload), timeout=self.timeouts[op], stream=stream)
+                if response.status_code < 500:
+                    return response
+                last_error = requests.HTTPError(f"{response.status_code} from {url}", response=response)
+                response.close()
+            except (requests.ConnectionError, requests.Timeout) as e:
+                last_error = e
+            if attempt < self.retries:
+                time.sleep(min(self.backoff * (2 ** attempt), self.max_backoff))
+        raise last_error  # type: ignore[misc]
+
+    def _first_success(self, path: str, payload: Dict, models: Models, *, op: str, stream: bool = False) -> requests.Response:
+        chain = model_chain(models)
+        errors = []
+        for model in chain:
+            try:
+                response = self.post(path, {**payload, "model": model}, op=op, stream=stream)
+            except requests.RequestException as e:
+                errors.append(f"{model}: {e}")
+                continue
+            if response.ok:
+                return response
+            errors.append(f"{model}: HTTP {response.status_code} {response.text[:200]}")
+            response.close()
+            if len(chain) > 1:
+                print(f"[Ollama] '{model}' failed ({response.status_code}); trying next model...")
+        raise OllamaError("; ".join(errors) or "no models given")
+
+    def embed(self, texts: Union[str, Sequence[str]], models: Models) -> Dict:
+        """/api/embed. The response's `model` names the model that answered."""
+        inputs = texts if isinstance(texts, str) else list(texts)
+        return self._first_success("/api/embed", {"input": inputs}, models, op="embed").json()
+
+    def tags(self) -> Dict[str, str]:
+        """Installed models (/api/tags), as name -> digest."""
+        response = self.session.get(f"{self.base_url}/api/tags", timeout=self.timeouts["show"])
+        response.raise_for_status()
+        return {m["name"]: m.get("digest", "") for m in response.json().get("models", [])}
+
+    def generate(self, prompt: str, models: Models, **options) -> Dict:
+        """Non-streaming /api/generate; extra keyword arguments (format, system, options, ...) go in the payload."""
+        payload = {"prompt": prompt, "stream": False, **options}
+        return self._first_success("/api/generate", payload, models, op="generate").json()
+
+    def generate_stream(self, prompt: str, models: Models, **options) -> Iterator[Dict]:
+        """Streaming /api/generate; yields each decoded NDJSON chunk until `done`."""
+        payload = {"prompt": prompt, "stream": True, **options}
+        yield from self._iter_chunks(self._first_success("/api/generate", payload, models, op="generate", stream=True))
+
+    def chat(self, messages: List[Dict], models: Models, **options) -> Dict:
+        payload = {"messages": messages, "stream": False, **options}
+        return self._first_success("/api/chat", payload, models, op="chat").json()
+
+    def chat_stream(self, messages: List[Dict], models: Models, **options) -> Iterator[Dict]:
+        payload = {"messages": messages, "stream": True, **options}
+        yield from self._iter_chunks(self._first_success("/api/chat", payload, models, op="chat", stream=True))
+
+    @staticmethod
+    def _iter_chunks(response: requests.Response) -> Iterator[Dict]:
+        with response:
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                try:
+                    chunk = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                yield chunk
+                if chunk.get("done") is True:
+                    break
+
+
+def model_chain(models: Models) -> List[str]:
+    """The models tried, in order, for a `models` argument (one name or a fallback list)."""
+    return [models] if isinstance(models, str) else list(models)
+
+
+class AsyncOllamaClient:
+    """asyncio version of OllamaClient over a pooled `httpx.AsyncClient`.
+
+    Bound to the event loop it was created on; use get_async_client().
+    """
+
+    def __init__(
+        self,
+        base_url: str = OLLAMA_BASE_URL,
+        *,
+        max_connections: int = 100,
+        retries: int = 2,
+        backoff: float = 0.5,
+        max_backoff: float = 10.0,
+        keep_alive: Optional[Union[str, int]] = None,
+        timeouts: Optional[Dict[str, tuple]] = None,
+    ):
+        if httpx is None:
+            raise RuntimeError("AsyncOllamaClient needs httpx (pip install httpx)")
+        self.base_url = base_url.rstrip("/")
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.keep_alive = keep_alive if keep_alive is not None else _keep_alive_from_env()
+        self.timeouts = {**DEFAULT_TIMEOUTS, **(timeouts or {})}
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    def _payload(self, payload: Dict) -> Dict:
+        if self.keep_alive is not None and "keep_alive" not in payload:
+            payload = {**payload, "keep_alive": self.keep_alive}
+        return payload
+
+    async def post(self, path: str, payload: Dict, *, op: str, stream: bool = False) -> "httpx.Response":
+        """POSTs with retry/backoff. With stream=True the caller must `await response.aclose()`."""
+        connect, read = self.timeouts[op]
+        timeout = httpx.Timeout(read, connect=connect)
+        last_error: Optional[Exception] = None
+        for attempt in range(self.retries + 1):
+            try:
+                request = self.client.build_request("POST", path, json=self._payload(payload), timeout=timeout)
+                response = await self.client.send(request, stream=stream)
+                if response.status_code < 500:
+                    return response
+                last_error = httpx.HTTPStatusError(f"{response.status_code} from {path}", request=request, response=response)
+                await response.aclose()
+            except (httpx.TransportError, httpx.TimeoutException) as e:
+                last_error = e
+            if attempt < self.retries:
+                await asyncio.sleep(min(self.backoff * (2 ** attempt), self.max_backoff))
+        raise last_error  # type: ignore[misc]
+
+    async def _first_success(self, path: str, payload: Dict, models: Models, *, op: str, stream: bool = False) -> "httpx.Response":
+        chain = model_chain(models)
+        errors = []
+        for model in chain:
+            try:
+                response = await self.post(path, {**payload, "model": model}, op=op, stream=stream)
+            except httpx.HTTPError as e:
+                errors.append(f"{model}: {e}")
+                continue
+            if response.is_success:
+                return response
+            body = (await response.aread()).decode("utf-8", errors="replace")
+            errors.append(f"{model}: HTTP {response.status_code} {body[:200]}")
+            await response.aclose()
+            if len(chain) > 1:
+                print(f"[Ollama] '{model}' failed ({response.status_code}); trying next model...")
+        raise OllamaError("; ".join(errors) or "no models given")
+
+    async def embed(self, texts: Union[str, Sequence[str]], models: Models) -> Dict:
+        inputs = texts if isinstance(texts, str) else list(texts)
+        return (await self._first_success("/api/embed", {"input": inputs}, models, op="embed")).json()
+
+    async def generate(self, prompt: str, models: Models, **options) -> Dict:
+        payload = {"prompt": prompt, "stream": False, **options}
+        return (await self._first_success("/api/generate", payload, models, op="generate")).json()
+
+    async def generate_stream(self, prompt: str, models: Models, **options) -> AsyncIterator[Dict]:
+        payload = {"prompt": prompt, "stream": True, **options}
+        response = await self._first_success("/api/generate", payload, models, op="generate", stream=True)
+        async for chunk in self._iter_chunks(response):
+            yield chunk
+
+    async def chat(self, messages: List[Dict], models: Models, **options) -> Dict:
+        payload = {"messages": messages, "stream": False, **options}
+        return (await self._first_success("/api/chat", payload, models, op="chat")).json()
+
+    async def chat_stream(self, messages: List[Dict], models: Models, **options) -> AsyncIterator[Dict]:
+        payload = {"messages": messages, "stream": True, **options}
+        response = await self._first_success("/api/chat", payload, models, op="chat", stream=True)
+        async for chunk in self._iter_chunks(response):
+            yield chunk
+
+    @staticmethod
+    async def _iter_chunks(response: "httpx.Response") -> AsyncIterator[Dict]:
+        # aclose() in finally also runs on cancellation, dropping the connection mid-generation.
+        try:
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                try:
+                    chunk = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                yield chunk
+                if chunk.get("done") is True:
+                    break
+        finally:
+            await response.aclose()
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+_clients: Dict[str, OllamaClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(base_url: Optional[str] = None) -> OllamaClient:
+    """The process-wide client for an Ollama host, created on first use."""
+    key = (base_url or OLLAMA_BASE_URL).rstrip("/")
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = OllamaClient(key)
+        return _clients[key]
+
+
+# loop -> host -> client; a closed loop's clients go with it, and a new loop that
+# reuses its id() cannot pick them up.
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, AsyncOllamaClient]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_async_client(base_url: Optional[str] = None) -> AsyncOllamaClient:
+    """The shared async client for an Ollama host on the running event loop."""
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    url = (base_url or OLLAMA_BASE_URL).rstrip("/")
+    client = clients.get(url)
+    if client is None or client.client.is_closed:
+        client = clients[url] = AsyncOllamaClient(url)
+    return client
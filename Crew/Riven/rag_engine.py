@@ -1,96 +1,523 @@
-import json
+import asyncio
+import atexit
 import os
 import math
-import requests
+import weakref
+import numpy as np
 from typing import List, Dict, Optional
 
+try:
+    from .dedup import DuplicateIndex, content_digest, from_signed64, simhash
+    from .chunker import DEFAULT_MAX_TOKENS, DEFAULT_OVERLAP, chunk_document, collapse_by_parent
+    from .ann_index import IVFIndex
+    from .embedding_cache import EmbeddingCache
+    from .ollama_client import get_async_client, get_client
+    from .rag_store import BrainStore, FileLock, StaleStoreError, WriteAheadLog, migrate_json
+except ImportError:  # run as a script from this folder
+    from dedup import DuplicateIndex, content_digest, from_signed64, simhash
+    from chunker import DEFAULT_MAX_TOKENS, DEFAULT_OVERLAP, chunk_document, collapse_by_parent
+    from ann_index import IVFIndex
+    from embedding_cache import EmbeddingCache
+    from ollama_client import get_async_client, get_client
+    from rag_store import BrainStore, FileLock, StaleStoreError, WriteAheadLog, migrate_json
+
 # Configuration
 import os
 
 OLLAMA_BASE_URL = (os.environ.get("OLLAMA_BASE_URL") or os.environ.get("OLLAMA_HOST") or "http://127.0.0.1:11434").rstrip("/")
 # Using 'phi' as the default since it's already installed and stable
 EMBEDDING_MODEL = "phi" 
+FALLBACK_EMBEDDING_MODEL = "nomic-embed-text"
+# Texts per /api/embed request for batched embedding (get_embeddings / ingest_many)
+EMBEDDING_BATCH_SIZE = int(os.environ.get("RIVEN_EMBED_BATCH_SIZE", "32"))
+
+class EmbeddingMatrix:
+    """Read-only base rows (usually a memmap of the store) plus a growable in-memory tail.
+
+    Norms are precomputed for every row, so scoring a query is one matrix-vector
+    product per block.
+    """
+
+    def __init__(self):
+        self.dim: Optional[int] = None
+        self._base = np.zeros((0, 0), dtype=np.float32)
+        self._base_norms = np.zeros(0, dtype=np.float32)
+        self._tail = np.zeros((0, 0), dtype=np.float32)
+        self._tail_norms = np.zeros(0, dtype=np.float32)
+        self._tail_count = 0
+
+    def __len__(self) -> int:
+        return self._base.shape[0] + self._tail_count
+
+    def reset(self, base: np.ndarray, norms: np.ndarray):
+        self.dim = base.shape[1] or None
+        self._base = base
+        self._base_norms = np.asarray(norms, dtype=np.float32)
+        self._tail = np.zeros((0, self.dim or 0), dtype=np.float32)
+        self._tail_norms = np.zeros(0, dtype=np.float32)
+        self._tail_count = 0
+
+    def append(self, embedding: List[float]) -> bool:
+        """Appends one row, growing the tail geometrically. Returns False on a dimension mismatch."""
+        vec = np.asarray(embedding, dtype=np.float32)
+        if self.dim is None:
+            self.dim = vec.shape[0]
+        if vec.shape[0] != self.dim:
+            print(f"[RAG] Warning: {vec.shape[0]}-dim embedding does not match the {self.dim}-dim index. Skipping.")
+            return False
+
+        n = self._tail_count
+        if n == self._tail.shape[0]:
+            capacity = max(16, n * 2)
+            tail = np.zeros((capacity, self.dim), dtype=np.float32)
+            norms = np.zeros(capacity, dtype=np.float32)
+            if n:
+                tail[:n] = self._tail[:n]
+                norms[:n] = self._tail_norms[:n]
+            self._tail, self._tail_norms = tail, norms
+
+        self._tail[n] = vec
+        self._tail_norms[n] = np.linalg.norm(vec)
+        self._tail_count += 1
+        return True
+
+    def tail_rows(self, count: int) -> np.ndarray:
+        """The last `count` appended rows."""
+        return self._tail[self._tail_count - count:self._tail_count]
+
+    def take(self, rows: np.ndarray):
+        """(vectors, norms) for the given row indices."""
+        rows = np.asarray(rows, dtype=np.int64)
+        n_base = self._base.shape[0]
+        in_base = rows < n_base
+        vectors = np.empty((len(rows), self.dim or 0), dtype=np.float32)
+        norms = np.empty(len(rows), dtype=np.float32)
+        if in_base.any():
+            vectors[in_base] = self._base[rows[in_base]]
+            norms[in_base] = self._base_norms[rows[in_base]]
+        if not in_base.all():
+            tail_rows = rows[~in_base] - n_base
+            vectors[~in_base] = self._tail[tail_rows]
+            norms[~in_base] = self._tail_norms[tail_rows]
+        return vectors, norms
+
+    @staticmethod
+    def cosine(vectors: np.ndarray, norms: np.ndarray, query: np.ndarray) -> np.ndarray:
+        denom = norms * float(np.linalg.norm(query))
+        dots = vectors @ query
+        return np.divide(dots, denom, out=np.zeros_like(dots), where=denom > 0)
+
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        """Cosine similarity of `query` against every row (0 for zero-norm rows)."""
+        blocks = [(self._base, self._base_norms), (self._tail[:self._tail_count], self._tail_norms[:self._tail_count])]
+        out = [self.cosine(matrix, norms, query) for matrix, norms in blocks if matrix.shape[0]]
+        return np.concatenate(out) if out else np.zeros(0, dtype=np.float32)
+
+
+# Brains with records still in their write-ahead log are compacted at exit.
+_open_brains: "weakref.WeakSet[SimpleRAG]" = weakref.WeakSet()
+
+
+def _compact_open_brains():
+    for rag in list(_open_brains):
+        try:
+            rag.compact()
+        except Exception as e:
+            print(f"[RAG] Warning: could not compact {rag.store.db_path} at exit: {e}")
+
+
+atexit.register(_compact_open_brains)
+
 
 class SimpleRAG:
-    def __init__(self, storage_path: str):
+    def __init__(
+        self,
+        storage_path: str,
+        compact_every: int = 256,
+        near_duplicate_distance: Optional[int] = None,
+        embedding_cache: bool = True,
+        index: str = "exact",
+        ann_nprobe: int = 16,
+        ann_min_rows: int = 50_000,
+    ):
+        # storage_path is the legacy JSON brain; the binary store lives next to it
+        # and the JSON file is migrated into it once, on first load.
         self.storage_path = storage_path
-        self.documents = [] # List of {"id": str, "text": str, "metadata": dict, "embedding": List[float]}
+        base_path = os.path.splitext(storage_path)[0]
+        self.store = BrainStore(base_path)
+        self.wal = WriteAheadLog(base_path + ".wal")
+        # Held by every writer of this brain, in any process, while it logs or compacts.
+        self._lock = FileLock(base_path + ".lock")
+        self._wal_id: Optional[int] = None  # the log file read so far, and how far
+        self._wal_offset = 0
+        self.compact_every = compact_every
+        # Exact duplicates are always rejected; set near_duplicate_distance (SimHash
+        # bits; ~8 catches an abstract with a few words swapped) to also reject
+        # reworded copies.
+        self.near_duplicate_distance = near_duplicate_distance
+        self._dedup = DuplicateIndex(near_duplicate_distance)
+        # Shared by every brain in the same folder, keyed by (model, text digest).
+        self.embedding_cache = (
+            EmbeddingCache(os.path.join(os.path.dirname(storage_path), "embedding_cache.sqlite"))
+            if embedding_cache else None
+        )
+        self._matrix = EmbeddingMatrix()
+        self._pending: List[Dict] = []  # logged in the WAL, not yet compacted into the store
+        # index="ivf" switches to approximate search once the brain holds
+        # ann_min_rows documents; smaller brains are always scanned exactly.
+        self.ann_min_rows = ann_min_rows
+        self._ann = IVFIndex(base_path + ".ivf.npz", nprobe=ann_nprobe) if index == "ivf" else None
         self.load()
+        _open_brains.add(self)
+
+    def __len__(self) -> int:
+        return len(self._matrix)
 
     def load(self):
-        if os.path.exists(self.storage_path):
-            with open(self.storage_path, 'r', encoding='utf-8') as f:
-                self.documents = json.load(f)
-            print(f"[RAG] Loaded {len(self.documents)} documents from {self.storage_path}")
+        with self._lock:
+            if self.store.refresh() == 0 and os.path.exists(self.storage_path):
+                migrate_json(self.storage_path, self.store)
+            self._load_locked()
+
+        if len(self):
+            print(f"[RAG] Loaded {len(self)} documents from {self.store.db_path} ({len(self._pending)} from the write-ahead log)")
         else:
-            print(f"[RAG] No existing database found at {self.storage_path}. Starting fresh.")
+            print(f"[RAG] No existing database found at {self.store.db_path}. Starting fresh.")
+
+    def _load_locked(self):
+        self._pending = []
+        self._matrix.reset(self.store.vectors(), self.store.norms())
+        self._dedup = DuplicateIndex(self.near_duplicate_distance)
+        for doc_id, digest, sim in self.store.hashes():
+            self._dedup.add(digest, doc_id, from_signed64(sim))
+        self._wal_id, self._wal_offset = self.wal.file_id(), 0
+        self._replay_locked(first_row=self.store.count)
+
+        if self._ann is not None:
+            self._ann.load(len(self))
+            self._update_ann()
+
+    def _replay_locked(self, first_row: int):
+        """Appends log entries from row `first_row` on that were not read yet."""
+        entries, self._wal_offset = self.wal.read(self._wal_offset)
+        entries = [entry for entry in entries if entry[0] >= first_row]
+        # A record can outlive its compaction if the writer died before the log reset.
+        committed = self.store.committed_ids([record["id"] for _, record, _ in entries])
+        for _, record, vector in entries:
+            if record["id"] in committed or not self._matrix.append(vector):
+                continue
+            self._pending.append(record)
+            digest, sim = self._fingerprint(record['text'])
+            self._dedup.add(digest, record['id'], sim)
+
+    def _sync_locked(self):
+        """Catches up with rows other writers committed or logged since this instance last looked.
+
+        Must run under self._lock before anything is logged or compacted, so that
+        row numbers, pending records and the log stay the same in every process.
+        """
+        committed_before = self.store.count
+        known = len(self._matrix)
+        if self.store.refresh() != committed_before:
+            # Pending rows another writer compacted are now in the store, at the same rows.
+            self._pending = self._pending[max(0, min(self.store.count, known) - committed_before):]
+            if self.store.count > known:
+                for vector in self.store.vectors()[known:]:
+                    self._matrix.append(vector)
+                for doc_id, digest, sim in self.store.hashes(first_row=known):
+                    self._dedup.add(digest, doc_id, from_signed64(sim))
+
+        wal_id = self.wal.file_id()
+        if wal_id != self._wal_id:  # reset by a compaction elsewhere
+            self._wal_id, self._wal_offset = wal_id, 0
+        self._replay_locked(first_row=len(self._matrix))
+        if self._ann is not None and self._ann.ready:
+            self._ann.sync(self._matrix)
+
+    def compact(self):
+        """Folds logged records into the store, then retires the write-ahead log.
+
+        The store append commits in a single SQLite transaction; a crash before the
+        log reset is harmless because replay skips rows the store already has.
+        """
+        with self._lock:
+            self._sync_locked()
+            self._compact_locked()
+
+    def _compact_locked(self):
+        if not self._pending:
+            return
+        try:
+            self.store.append(self._pending, self._matrix.tail_rows(len(self._pending)), expected_first=self.store.count)
+        except StaleStoreError:
+            # A writer that bypassed the lock appended first, so our rows would not land
+            # where the matrix has them: pick up its rows, move ours after them and retry.
+            self._rebase_pending()
+            self.store.append(self._pending, self._matrix.tail_rows(len(self._pending)), expected_first=self.store.count)
+        self.wal.reset()
+        self._wal_id, self._wal_offset = self.wal.file_id(), 0
+        self._pending = []
+        print(f"[RAG] Saved {self.store.count} documents to {self.store.db_path}")
+        if self._ann is not None:
+            self._update_ann()
+            self._ann.save()
+
+    def _rebase_pending(self):
+        """Reloads the committed rows and re-appends the pending records after them."""
+        records = self._pending
+        vectors = np.array(self._matrix.tail_rows(len(records)))
+        committed = len(self) - len(records)
+        self.store.refresh()
+        self._matrix.reset(self.store.vectors(), self.store.norms())
+
+        self._dedup = DuplicateIndex(self.near_duplicate_distance)
+        for doc_id, digest, sim in self.store.hashes():
+            self._dedup.add(digest, doc_id, from_signed64(sim))
+        self._pending = []
+        for record, vector in zip(records, vectors):
+            digest, sim = self._fingerprint(record['text'])
+            # The other writer may have stored the same text in the meantime.
+            if self._dedup.find(digest, sim) is not None or not self._matrix.append(vector):
+                continue
+            record = {**record, "id": f"doc_{len(self._matrix)}"}
+            self._pending.append(record)
+            self._dedup.add(digest, record['id'], sim)
+
+        if self._ann is not None:
+            self._ann.truncate(committed)
+            self._ann.sync(self._matrix)
+
+    def _update_ann(self):
+        """Buckets new rows; once the brain is big enough, (re)trains the IVF index in the background."""
+        if len(self) < self.ann_min_rows:
+            return
+        if self._ann.poll(self._matrix):
+            self._ann.save()
+        if self._ann.needs_training(len(self)):
+            self._ann.train_async(self._matrix)
+        self._ann.sync(self._matrix)
+
+    # Kept for callers of the old JSON-backed API.
+    save = compact
 
-    def save(self):
-        with open(self.storage_path, 'w', encoding='utf-8') as f:
-            json.dump(self.documents, f, indent=2)
-        print(f"[RAG] Saved {len(self.documents)} documents to {self.storage_path}")
+    def _fingerprint(self, text: str):
+        """(content digest, SimHash or None when near-duplicate detection is off)."""
+        sim = simhash(text) if self.near_duplicate_distance is not None else None
+        return content_digest(text), sim
+
+    def _get_rows(self, rows: List[int]) -> List[Dict]:
+        saved = [r for r in rows if r < self.store.count]
+        docs = dict(zip(saved, self.store.get_documents(saved)))
+        for r in rows:
+            if r >= self.store.count:
+                docs[r] = dict(self._pending[r - self.store.count])
+        return [docs[r] for r in rows]
 
     def get_embedding(self, text: str) -> List[float]:
         """Fetches embedding from Ollama using the standard /api/embed endpoint."""
-        url = f"{OLLAMA_BASE_URL}/api/embed"
-        FALLBACK_MODEL = "nomic-embed-text"
+        return self.get_embeddings([text])[0]
+
+    def get_embeddings(self, texts: List[str], batch_size: int = EMBEDDING_BATCH_SIZE) -> List[List[float]]:
+        """Embeds texts with one /api/embed request per batch. Texts that fail come back as [].
+
+        Texts already in the embedding cache never reach Ollama.
+        """
+        embeddings, missing = self._cached_embeddings(texts)
+        for rows in self._batches(missing, batch_size):
+            batch = [texts[i] for i in rows]
+            model, vectors = self._embed_batch(batch)
+            self._remember(embeddings, rows, batch, model, vectors)
+        return [embedding or [] for embedding in embeddings]
+
+    async def aget_embeddings(self, texts: List[str], batch_size: int = EMBEDDING_BATCH_SIZE) -> List[List[float]]:
+        """asyncio version of get_embeddings() for callers on an event loop."""
+        # The SQLite cache lookup blocks, so it runs off the loop.
+        embeddings, missing = await asyncio.to_thread(self._cached_embeddings, texts)
+        for rows in self._batches(missing, batch_size):
+            batch = [texts[i] for i in rows]
+            model, vectors = await self._aembed_batch(batch)
+            await asyncio.to_thread(self._remember, embeddings, rows, batch, model, vectors)
+        return [embedding or [] for embedding in embeddings]
+
+    def _cached_embeddings(self, texts: List[str]):
+        """(embeddings with None for cache misses, indices of the misses)."""
+        if self.embedding_cache is not None:
+            embeddings = self.embedding_cache.get_many(EMBEDDING_MODEL, texts)
+        else:
+            embeddings = [None] * len(texts)
+        return embeddings, [i for i, embedding in enumerate(embeddings) if embedding is None]
+
+    @staticmethod
+    def _batches(rows: List[int], batch_size: int):
+        batch_size = max(1, batch_size)
+        for start in range(0, len(rows), batch_size):
+            yield rows[start:start + batch_size]
+
+    def _remember(self, embeddings, rows, batch, model, vectors):
+        # Lookups only ever ask for EMBEDDING_MODEL, so a fallback model's vectors
+        # would never be found again; they are not cached.
+        if self.embedding_cache is not None and model in (EMBEDDING_MODEL, f"{EMBEDDING_MODEL}:latest"):
+            self.embedding_cache.put_many(EMBEDDING_MODEL, batch, vectors)
+        for i, vector in zip(rows, vectors):
+            embeddings[i] = vector
+
+    def _embed_batch(self, texts: List[str]):
+        """Returns (model that answered, embeddings)."""
+        client = get_client(OLLAMA_BASE_URL)
         
-        # 1. Try Primary Model
-        payload = {"model": EMBEDDING_MODEL, "input": text}
-        try:
-            response = requests.post(url, json=payload)
-            if response.status_code == 200:
-                return response.json()["embeddings"][0]
-        except Exception:
-            pass
-
-        # 2. Try Fallback Model
-        print(f"[RAG] Warning: '{EMBEDDING_MODEL}' failed or missing. Trying fallback '{FALLBACK_MODEL}'...")
-        payload["model"] = FALLBACK_MODEL
+        # 1. Try Primary Model, 2. then Fallback Model (/api/embed takes the whole batch as "input")
         try:
-            response = requests.post(url, json=payload)
-            if response.status_code == 200:
-                return response.json()["embeddings"][0]
-        except Exception:
-            pass
-
-        # 3. Legacy endpoint /api/embeddings fallback
-        legacy_url = f"{OLLAMA_BASE_URL}/api/embeddings"
-        payload_legacy = {"model": EMBEDDING_MODEL, "prompt": text}
+            data = client.embed(texts, [EMBEDDING_MODEL, FALLBACK_EMBEDDING_MODEL])
+            return data.get("model", EMBEDDING_MODEL), data["embeddings"]
+        except Exception as e:
+            print(f"[RAG] Warning: '{EMBEDDING_MODEL}' and fallback '{FALLBACK_EMBEDDING_MODEL}' failed ({e}). Trying legacy endpoint...")
+
+        # 3. Legacy endpoint /api/embeddings fallback (one text per request)
+        embeddings = []
+        for text in texts:
+            payload_legacy = {"model": EMBEDDING_MODEL, "prompt": text}
+            try:
+                response = client.post("/api/embeddings", payload_legacy, op="embed")
+                if response.status_code == 200:
+                    embeddings.append(response.json()["embedding"])
+                    continue
+            except Exception as e:
+                print(f"[RAG] Error: All embedding attempts failed. {e}")
+                print(f"[RAG] CRITICAL: Run 'ollama pull {EMBEDDING_MODEL}' to fix this.")
+            embeddings.append([])
+        return EMBEDDING_MODEL, embeddings
+
+    async def _aembed_batch(self, texts: List[str]):
+        """asyncio version of _embed_batch()."""
+        client = get_async_client(OLLAMA_BASE_URL)
+
         try:
-            response = requests.post(legacy_url, json=payload_legacy)
-            if response.status_code == 200:
-                return response.json()["embedding"]
+            data = await client.embed(texts, [EMBEDDING_MODEL, FALLBACK_EMBEDDING_MODEL])
+            return data.get("model", EMBEDDING_MODEL), data["embeddings"]
         except Exception as e:
-            print(f"[RAG] Error: All embedding attempts failed. {e}")
-            print(f"[RAG] CRITICAL: Run 'ollama pull {EMBEDDING_MODEL}' to fix this.")
-            
-        return []
+            print(f"[RAG] Warning: '{EMBEDDING_MODEL}' and fallback '{FALLBACK_EMBEDDING_MODEL}' failed ({e}). Trying legacy endpoint...")
+
+        embeddings = []
+        for text in texts:
+            try:
+                response = await client.post("/api/embeddings", {"model": EMBEDDING_MODEL, "prompt": text}, op="embed")
+                if response.status_code == 200:
+                    embeddings.append(response.json()["embedding"])
+                    continue
+            except Exception as e:
+                print(f"[RAG] Error: All embedding attempts failed. {e}")
+            embeddings.append([])
+        return EMBEDDING_MODEL, embeddings
+
+    def contains(self, text: str) -> bool:
+        """True if the brain already holds this text (or, with near-duplicate detection on, a near copy)."""
+        digest, sim = self._fingerprint(text)
+        return self._dedup.find(digest, sim) is not None
 
     def ingest(self, text: str, metadata: Dict = None) -> bool:
         """Adds a document to the knowledge base."""
         if metadata is None:
             metadata = {}
         
-        # Check for duplicates
-        for doc in self.documents:
-            if doc['text'] == text:
-                return False
+        # Check for duplicates before paying for an embedding
+        digest, sim = self._fingerprint(text)
+        if self._dedup.find(digest, sim) is not None:
+            return False
 
         embedding = self.get_embedding(text)
         if not embedding:
             return False
 
-        doc = {
-            "id": f"doc_{len(self.documents) + 1}",
-            "text": text,
-            "metadata": metadata,
-            "embedding": embedding
-        }
-        self.documents.append(doc)
-        self.save()
+        with self._lock:
+            # Rows are numbered after everything other writers have logged so far.
+            self._sync_locked()
+            if self._dedup.find(digest, sim) is not None or not self._matrix.append(embedding):
+                return False
+            record = {
+                "id": f"doc_{len(self._matrix)}",
+                "text": text,
+                "metadata": metadata,
+            }
+            row = len(self._matrix) - 1
+            self._wal_offset = self.wal.append([row], [record], self._matrix.tail_rows(1))
+            if self._ann is not None:
+                self._ann.add(row, embedding)
+            self._pending.append(record)
+            self._dedup.add(digest, record['id'], sim)
+            if len(self._pending) >= self.compact_every:
+                self._compact_locked()
         return True
 
+    def ingest_many(
+        self,
+        texts: List[str],
+        metadatas: Optional[List[Dict]] = None,
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+    ) -> List[bool]:
+        """Adds many documents with batched embedding requests and a single store write.
+
+        Returns one flag per input text, like ingest().
+        """
+        if metadatas is None:
+            metadatas = [{} for _ in texts]
+
+        # Dedup against the brain and within the batch before embedding anything.
+        batch_dedup = DuplicateIndex(self.near_duplicate_distance)
+        fresh = []
+        for i, text in enumerate(texts):
+            digest, sim = self._fingerprint(text)
+            if self._dedup.find(digest, sim) is not None or batch_dedup.find(digest, sim) is not None:
+                continue
+            batch_dedup.add(digest, str(i), sim)
+            fresh.append((i, digest, sim))
+
+        accepted = [False] * len(texts)
+        embeddings = self.get_embeddings([texts[i] for i, _, _ in fresh], batch_size=batch_size)
+        with self._lock:
+            self._sync_locked()
+            for (i, digest, sim), embedding in zip(fresh, embeddings):
+                if not embedding or self._dedup.find(digest, sim) is not None or not self._matrix.append(embedding):
+                    continue
+                record = {
+                    "id": f"doc_{len(self._matrix)}",
+                    "text": texts[i],
+                    "metadata": metadatas[i] or {},
+                }
+                self._pending.append(record)
+                self._dedup.add(digest, record['id'], sim)
+                if self._ann is not None:
+                    self._ann.add(len(self._matrix) - 1, embedding)
+                accepted[i] = True
+            self._compact_locked()
+        return accepted
+
+    def ingest_document(
+        self,
+        text: str,
+        metadata: Dict = None,
+        doc_id: Optional[str] = None,
+        max_tokens: int = DEFAULT_MAX_TOKENS,
+        overlap: int = DEFAULT_OVERLAP,
+        markdown: bool = True,
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+    ) -> int:
+        """Chunks a long document and ingests the chunks. Returns how many were added.
+
+        Each chunk's metadata carries the caller's metadata plus parent_id,
+        chunk/chunks (position), start/end (character offsets) and section.
+        """
+        texts, metadatas = chunk_document(
+            text,
+            metadata,
+            parent_id=doc_id or f"src_{content_digest(text)[:16]}",
+            max_tokens=max_tokens,
+            overlap=overlap,
+            markdown=markdown,
+        )
+        if not texts:
+            return 0
+        return sum(self.ingest_many(texts, metadatas, batch_size=batch_size))
+
     def cosine_similarity(self, vec1: List[float], vec2: List[float]) -> float:
         if not vec1 or not vec2:
             return 0.0
@@ -101,23 +528,62 @@ class SimpleRAG:
             return 0.0
         return dot_product / (magnitude1 * magnitude2)
 
-    def query(self, query_text: str, k: int = 3) -> List[Dict]:
+    def query(self, query_text: str, k: int = 3, collapse: bool = False) -> List[Dict]:
         print(f"[RAG] Querying for: '{query_text}'")
         query_embedding = self.get_embedding(query_text)
         if not query_embedding:
             return []
+        return self.search(query_embedding, k=k, collapse=collapse)
 
-        scored_docs = []
-        for doc in self.documents:
-            score = self.cosine_similarity(query_embedding, doc['embedding'])
-            scored_docs.append((score, doc))
+    async def aquery(self, query_text: str, k: int = 3, collapse: bool = False) -> List[Dict]:
+        """query() for event-loop callers: the embedding is awaited and the search runs in a worker thread."""
+        print(f"[RAG] Querying for: '{query_text}'")
+        query_embedding = (await self.aget_embeddings([query_text]))[0]
+        if not query_embedding:
+            return []
+        return await asyncio.to_thread(self.search, query_embedding, k=k, collapse=collapse)
 
-        scored_docs.sort(key=lambda x: x[0], reverse=True)
-        
-        results = []
-        for score, doc in scored_docs[:k]:
-            result_doc = doc.copy()
-            del result_doc['embedding']
-            result_doc['score'] = score
-            results.append(result_doc)
-        return results
\ No newline at end of file
+    def search(self, query_embedding: List[float], k: int = 3, collapse: bool = False) -> List[Dict]:
+        """Top-k documents for an already-computed query embedding.
+
+        With collapse=True, chunks of the same parent document are folded into
+        one result (see chunker.collapse_by_parent), so k counts documents.
+        """
+        if collapse:
+            return collapse_by_parent(self.search(query_embedding, k=k * 4), k)
+
+        n = len(self._matrix)
+        if n == 0 or k <= 0:
+            return []
+
+        q = np.asarray(query_embedding, dtype=np.float32)
+        if q.shape[0] != self._matrix.dim:
+            print(f"[RAG] Warning: query embedding is {q.shape[0]}-dim but the index is {self._matrix.dim}-dim.")
+            return []
+        if not np.any(q):
+            return []
+
+        if self._ann is not None and self._ann.poll(self._matrix):
+            self._ann.save()
+        if self._ann is not None and self._ann.ready and n >= self.ann_min_rows:
+            # Approximate: exact scores, but only for rows in the nearest IVF buckets.
+            rows = self._ann.candidates(q)
+            scores = EmbeddingMatrix.cosine(*self._matrix.take(rows), q)
+        else:
+            rows = None
+            scores = self._matrix.scores(q)
+
+        # Partial sort: only the k winners get ordered.
+        k = min(k, len(scores))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        scores = scores[top]
+        if rows is not None:
+            top = rows[top]
+
+        results = self._get_rows([int(r) for r in top])
+        for result_doc, score in zip(results, scores):
+            result_doc['score'] = float(score)
+        return results
@@ -0,0 +1,410 @@
+"""Binary on-disk store for SimpleRAG's Neural Link.
+
+Embeddings live in a raw float32 file that is memory-mapped on load, so startup
+never parses a vector and pages are only faulted in when a query touches them.
+Ids, text and metadata live in a SQLite sidecar. The sidecar also records the
+committed row count, so vectors from an interrupted append are simply ignored.
+
+New memories first land in `<base>.wal`, an append-only log that costs one
+fsync per ingest. Compaction folds the log into the store and then retires it.
+
+Several processes may share a brain: writers hold `<base>.lock` while they
+log, replay or compact, and catch up on each other's rows before writing.
+
+Usage (one-shot migration of the old JSON brain):
+    python rag_store.py data/serenity_brain.json
+"""
+
+from __future__ import annotations
+
+import base64
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+try:
+    from .dedup import content_digest, simhash, to_signed64
+except ImportError:  # run as a script from this folder
+    from dedup import content_digest, simhash, to_signed64
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS documents (
+    row      INTEGER PRIMARY KEY,
+    id       TEXT NOT NULL,
+    text     TEXT NOT NULL,
+    metadata TEXT NOT NULL,
+    norm     REAL NOT NULL,
+    content_hash TEXT,
+    simhash  INTEGER
+);
+"""
+
+
+def _lock_file(f) -> None:
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        return
+    # msvcrt only offers a blocking lock that gives up after 10 s; poll instead.
+    f.seek(0)
+    while True:
+        try:
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            return
+        except OSError:
+            time.sleep(0.05)
+
+
+def _unlock_file(f) -> None:
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class FileLock:
+    """Exclusive lock on `path`, shared with other processes (flock / msvcrt).
+
+    Re-entrant: the thread holding it may enter it again.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    def __enter__(self) -> "FileLock":
+        self._thread_lock.acquire()
+        if self._depth == 0:
+            try:
+                f = open(self.path, "a+b")
+                try:
+                    _lock_file(f)
+                except BaseException:
+                    f.close()
+                    raise
+            except BaseException:
+                self._thread_lock.release()
+                raise
+            self._file = f
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._depth -= 1
+        if self._depth == 0:
+            try:
+                _unlock_file(self._file)
+            finally:
+                self._file.close()
+                self._file = None
+        self._thread_lock.release()
+
+
+class StaleStoreError(RuntimeError):
+    """Another writer appended to the store since this handle last read its row count."""
+
+
+class BrainStore:
+    """`<base>.sqlite` (rows + meta) next to `<base>.f32` (row-major float32 vectors)."""
+
+    def __init__(self, base_path: str):
+        self.base_path = base_path
+        self.db_path = base_path + ".sqlite"
+        self._lock = threading.RLock()
+        # The agent queries from worker threads; every access goes through self._lock.
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.executescript(_SCHEMA)
+        self._upgrade_schema()
+
+        dim = self._get_meta("dim")
+        self.dim: Optional[int] = int(dim) if dim else None
+        self.count = int(self._get_meta("count") or 0)
+        self.vectors_file = self._get_meta("vectors_file") or os.path.basename(base_path) + ".f32"
+        self._drop_torn_tail()
+
+    def refresh(self) -> int:
+        """Re-reads the committed row count (and dim) another writer may have moved on."""
+        with self._lock:
+            dim = self._get_meta("dim")
+            self.dim = int(dim) if dim else self.dim
+            self.count = int(self._get_meta("count") or 0)
+            return self.count
+
+    def _upgrade_schema(self) -> None:
+        """Adds and backfills the duplicate-detection columns on stores created before them."""
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(documents)")}
+        with self._conn:
+            for column, kind in (("content_hash", "TEXT"), ("simhash", "INTEGER")):
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE documents ADD COLUMN {column} {kind}")
+            missing = self._conn.execute("SELECT row, text FROM documents WHERE content_hash IS NULL").fetchall()
+            self._conn.executemany(
+                "UPDATE documents SET content_hash = ?, simhash = ? WHERE row = ?",
+                [(content_digest(text), to_signed64(simhash(text)), row) for row, text in missing],
+            )
+
+    @property
+    def vectors_path(self) -> str:
+        return os.path.join(os.path.dirname(self.base_path), self.vectors_file)
+
+    def _get_meta(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value) -> None:
+        self._conn.execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, str(value)),
+        )
+
+    def _committed_bytes(self) -> int:
+        return self.count * (self.dim or 0) * 4
+
+    def _drop_torn_tail(self) -> None:
+        """Truncates vector bytes written by an append whose rows never committed."""
+        if not os.path.exists(self.vectors_path):
+            return
+        if os.path.getsize(self.vectors_path) > self._committed_bytes():
+            os.truncate(self.vectors_path, self._committed_bytes())
+
+    def vectors(self) -> np.ndarray:
+        """Read-only memory map over the committed embedding rows."""
+        if not self.count:
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        return np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(self.count, self.dim))
+
+    def norms(self) -> np.ndarray:
+        with self._lock:
+            rows = self._conn.execute("SELECT norm FROM documents ORDER BY row").fetchall()
+        return np.fromiter((r[0] for r in rows), dtype=np.float32, count=len(rows))
+
+    def append(self, records: Sequence[Dict], vectors: np.ndarray, expected_first: Optional[int] = None) -> None:
+        """Durably appends rows.
+
+        Vectors are written and fsynced first; the rows and the new count then
+        commit in a single transaction, which is the point the append becomes real.
+        With `expected_first`, raises StaleStoreError (writing nothing) unless the
+        rows would land at that index, i.e. nobody else appended in the meantime.
+        """
+        if not records:
+            return
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(len(records), -1)
+        norms = np.linalg.norm(vectors, axis=1)
+
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f"{vectors.shape[1]}-dim vectors do not match the {self.dim}-dim store")
+
+            # BEGIN IMMEDIATE takes the write lock up front, so the committed count
+            # read here is the one the new rows land after.
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                first = int(self._get_meta("count") or 0)
+                if expected_first is not None and first != expected_first:
+                    raise StaleStoreError(f"{self.db_path} holds {first} rows, expected {expected_first}")
+                mode = "r+b" if os.path.exists(self.vectors_path) else "wb"
+                with open(self.vectors_path, mode) as f:
+                    f.seek(first * self.dim * 4)
+                    f.write(vectors.tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+
+                self._conn.executemany(
+                    "INSERT INTO documents (row, id, text, metadata, norm, content_hash, simhash) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (
+                            first + i,
+                            r["id"],
+                            r["text"],
+                            json.dumps(r.get("metadata") or {}),
+                            float(norms[i]),
+                            content_digest(r["text"]),
+                            to_signed64(simhash(r["text"])),
+                        )
+                        for i, r in enumerate(records)
+                    ],
+                )
+                self._set_meta("dim", self.dim)
+                self._set_meta("vectors_file", self.vectors_file)
+                self._set_meta("count", first + len(records))
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+            self.count = first + len(records)
+
+    def get_documents(self, rows: Sequence[int]) -> List[Dict]:
+        """Fetches id/text/metadata for the given rows, in the order requested."""
+        if not rows:
+            return []
+        placeholders = ",".join("?" * len(rows))
+        with self._lock:
+            fetched = self._conn.execute(
+                f"SELECT row, id, text, metadata FROM documents WHERE row IN ({placeholders})",
+                [int(r) for r in rows],
+            ).fetchall()
+        by_row = {
+            row: {"id": doc_id, "text": text, "metadata": json.loads(metadata)}
+            for row, doc_id, text, metadata in fetched
+        }
+        return [by_row[int(r)] for r in rows]
+
+    def hashes(self, first_row: int = 0) -> List[tuple]:
+        """(id, content_hash, signed simhash) for every committed row from `first_row` on."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT id, content_hash, simhash FROM documents WHERE row >= ? ORDER BY row", (first_row,)
+            ).fetchall()
+
+    def committed_ids(self, ids: Sequence[str]) -> Set[str]:
+        """The subset of `ids` already stored."""
+        if not ids:
+            return set()
+        placeholders = ",".join("?" * len(ids))
+        with self._lock:
+            rows = self._conn.execute(f"SELECT id FROM documents WHERE id IN ({placeholders})", list(ids)).fetchall()
+        return {row[0] for row in rows}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class WriteAheadLog:
+    """Append-only JSON-lines log of ingested rows that are not yet in the store.
+
+    Every record carries the store row it will occupy, so replaying after a crash
+    that happened between a compaction commit and the log reset skips rows the
+    store already holds. A torn last line (crash mid-write) is dropped on replay.
+
+    The log does no locking of its own; callers sharing it hold the brain's FileLock.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def file_id(self) -> Optional[int]:
+        """Identifies the current log file; reset() swaps in a new one."""
+        try:
+            return os.stat(self.path).st_ino
+        except OSError:
+            return None
+
+    def append(self, rows: Sequence[int], records: Sequence[Dict], vectors: np.ndarray) -> int:
+        """Durably logs a batch of records with one write and one fsync. Returns the new log size."""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(len(records), -1)
+        lines = [
+            json.dumps({
+                "row": int(row),
+                "id": r["id"],
+                "text": r["text"],
+                "metadata": r.get("metadata") or {},
+                "embedding": base64.b64encode(vec.tobytes()).decode("ascii"),
+            }) + "\n"
+            for row, r, vec in zip(rows, records, vectors)
+        ]
+        with open(self.path, "ab") as f:
+            f.write("".join(lines).encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+            return f.tell()
+
+    def read(self, offset: int = 0) -> Tuple[List[Tuple[int, Dict, np.ndarray]], int]:
+        """(row, record, vector) for entries logged from byte `offset` on, and the offset after them."""
+        entries: List[Tuple[int, Dict, np.ndarray]] = []
+        if not os.path.exists(self.path):
+            return entries, 0
+        size = os.path.getsize(self.path)
+        if offset > size:  # not the file the offset was taken from
+            offset = 0
+
+        good_bytes = offset
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            for raw in f:
+                try:
+                    entry = json.loads(raw)
+                except ValueError:
+                    break
+                good_bytes += len(raw)
+                record = {"id": entry["id"], "text": entry["text"], "metadata": entry["metadata"]}
+                vector = np.frombuffer(base64.b64decode(entry["embedding"]), dtype=np.float32)
+                entries.append((entry["row"], record, vector))
+
+        if good_bytes < size:
+            print(f"[RAG] Warning: dropping a torn record at the end of {self.path}")
+            os.truncate(self.path, good_bytes)
+        return entries, good_bytes
+
+    def replay(self, first_row: int):
+        """Returns (records, vectors) for logged rows at or after `first_row`."""
+        entries, _ = self.read()
+        kept = [(record, vector) for row, record, vector in entries if row >= first_row]
+        return [record for record, _ in kept], [vector for _, vector in kept]
+
+    def reset(self) -> None:
+        """Atomically swaps in an empty log."""
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+
+def migrate_json(json_path: str, store: BrainStore) -> int:
+    """One-shot import of the legacy indented-JSON brain. The JSON file is left untouched."""
+    with open(json_path, "r", encoding="utf-8") as f:
+        documents = json.load(f)
+
+    records, vectors, skipped = [], [], 0
+    dim = store.dim
+    for doc in documents:
+        embedding = doc.get("embedding") or []
+        if dim is None and embedding:
+            dim = len(embedding)
+        if not embedding or len(embedding) != dim:
+            skipped += 1
+            continue
+        records.append({"id": doc["id"], "text": doc["text"], "metadata": doc.get("metadata") or {}})
+        vectors.append(embedding)
+
+    if records:
+        store.append(records, np.asarray(vectors, dtype=np.float32))
+    print(f"[RAG] Migrated {len(records)} documents from {json_path} to {store.db_path}")
+    if skipped:
+        print(f"[RAG] Warning: skipped {skipped} documents with missing or mismatched embeddings.")
+    return len(records)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python rag_store.py <path_to_brain.json>")
+        raise SystemExit(1)
+    src = sys.argv[1]
+    target = BrainStore(os.path.splitext(src)[0])
+    if target.count:
+        print(f"[RAG] {target.db_path} already holds {target.count} documents. Nothing to do.")
+    else:
+        migrate_json(src, target)
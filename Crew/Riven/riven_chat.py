@@ -1,9 +1,11 @@
 import sys
 import os
 import json
-import requests
+import time
 from dotenv import load_dotenv
 from pathlib import Path
+from context_builder import build_context, hits_to_items
+from ollama_client import get_client
 from rag_engine import SimpleRAG
 
 # Load .env
@@ -16,15 +18,27 @@ if env_local.exists():
     load_dotenv(dotenv_path=env_local, override=True)
 
 # Configuration
-OLLAMA_URL = "http://localhost:11434/api/generate"
 MODEL_NAME = "riven" # Expects the custom model to be built
 DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
 RAG_DB_PATH = os.path.join(DATA_DIR, "serenity_brain.json")
+# Token budget for retrieved context per question; caps prefill time however much matches
+CONTEXT_TOKENS = 1500
+# Metadata worth showing the model; chunk bookkeeping (offsets, parent ids) is left out
+SOURCE_FIELDS = ("title", "source", "section", "link", "published")
 
 # Initialize RAG
 rag = SimpleRAG(RAG_DB_PATH)
 
+def source_header(doc):
+    fields = {k: doc['metadata'][k] for k in SOURCE_FIELDS if doc.get('metadata', {}).get(k)}
+    header = f"--- Source (Score: {doc['score']:.2f}) ---"
+    return f"{header}\nMetadata: {json.dumps(fields)}" if fields else header
+
 def query_ollama(prompt, context=""):
+    return "".join(query_ollama_stream(prompt, context))
+
+def query_ollama_stream(prompt, context=""):
+    """Yields River's answer piece by piece as Ollama generates it."""
     system_prompt = """
 You are Riven, a researcher with a \"Neural Link\" containing specific scientific knowledge.
 You are now in CHAT MODE with the Captain (the User).
@@ -42,23 +56,17 @@ Brilliant, slightly psychic, helpful, professional but with a Firefly-universe f
     
     full_prompt = f"{system_prompt}\n\n**RETRIEVED CONTEXT:**\n{context}\n\n**CAPTAIN:** {prompt}\n\n**RIVEN:**"
     
-    payload = {
-        "model": MODEL_NAME,
-        "prompt": full_prompt,
-        "stream": False
-    }
-    
     try:
-        response = requests.post(OLLAMA_URL, json=payload)
-        response.raise_for_status()
-        return response.json()['response']
+        for chunk in get_client().generate_stream(full_prompt, MODEL_NAME):
+            if chunk.get('response'):
+                yield chunk['response']
     except Exception as e:
-        return f"[Error communicating with River's mind: {e}]"
+        yield f"[Error communicating with River's mind: {e}]"
 
 def chat_loop():
     print("\n" + "="*50)
     print("RIVER - RESEARCH ASSISTANT (CHAT MODE)")
-    print(f"   [Neural Link Loaded: {len(rag.documents)} memories]")
+    print(f"   [Neural Link Loaded: {len(rag)} memories]")
     print("   Type 'exit' or 'quit' to leave.")
     print("="*50 + "\n")
 
@@ -74,24 +82,32 @@ def chat_loop():
 
             # 1. Retrieve Context
             print("   (River is searching her Neural Link...)")
-            retrieved_docs = rag.query(user_input, k=3)
-            
-            context_str = ""
+            retrieved_docs = rag.query(user_input, k=8)
+
             if retrieved_docs:
-                for i, doc in enumerate(retrieved_docs):
-                    context_str += f"--- Source {i+1} (Score: {doc['score']:.2f}) ---\n"
-                    # Include metadata if available (like title)
-                    if 'metadata' in doc:
-                        context_str += f"Metadata: {json.dumps(doc['metadata'])}\n"
-                    context_str += f"Content: {doc['text']}\n\n"
+                # Best passages first, overlapping chunks merged, within CONTEXT_TOKENS
+                packed = build_context(hits_to_items(retrieved_docs, header=source_header), CONTEXT_TOKENS)
+                context_str = packed.text
+                print(f"   (context: {packed.summary()})")
             else:
                 context_str = "No specific memories found in the Neural Link matching this query."
 
-            # 2. Generate Response
+            # 2. Generate Response (printed as it streams; Ctrl+C stops the answer)
             print("   (River is thinking...)")
-            response = query_ollama(user_input, context_str)
-            
-            print(f"\nRiver > {response}\n")
+            started = time.perf_counter()
+            ttft = None
+            print("\nRiver > ", end="", flush=True)
+            try:
+                for token in query_ollama_stream(user_input, context_str):
+                    if ttft is None:
+                        ttft = time.perf_counter() - started
+                    print(token, end="", flush=True)
+            except KeyboardInterrupt:
+                print(" [interrupted]", end="")
+            print()
+            if ttft is not None:
+                print(f"   (first token {ttft:.2f}s, total {time.perf_counter() - started:.2f}s)")
+            print()
 
         except KeyboardInterrupt:
             print("\n\nRiver > Connection severed. Bye.")
@@ -7,6 +7,9 @@ from datetime import datetime
 import re
 from dotenv import load_dotenv
 from pathlib import Path
+from context_builder import build_context, hits_to_items
+from discord_log import get_dispatcher
+from ollama_client import get_client
 from rag_engine import SimpleRAG
 
 import sys
@@ -32,12 +35,15 @@ if len(sys.argv) > 2:
     print(f"Redirecting output to channel: {TARGET_CHANNEL_ID}")
 
 # Configuration
-OLLAMA_URL = "http://localhost:11434/api/generate"
-MODEL_NAME = "riven" # Fallback to 'phi3' if riven not customized
+MODEL_NAME = "riven"
+# Tried in order: falls back to 'phi3' if riven is not customized
+MODEL_CHAIN = [MODEL_NAME, "phi3"]
 DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
 RAW_DIR = os.path.join(DATA_DIR, "raw")
 PROCESSED_DIR = os.path.join(DATA_DIR, "processed")
 RAG_DB_PATH = os.path.join(DATA_DIR, "serenity_brain.json")
+# Token budget for recalled memories fed back into the next step
+RECALL_TOKENS = 800
 
 os.makedirs(RAW_DIR, exist_ok=True)
 os.makedirs(PROCESSED_DIR, exist_ok=True)
@@ -49,46 +55,14 @@ def log_to_discord(message):
     if not DISCORD_TOKEN or not TARGET_CHANNEL_ID:
         print(f"[Discord Log Skipped]: {message}")
         return
-
-    url = f"https://discord.com/api/v9/channels/{TARGET_CHANNEL_ID}/messages"
-    headers = {
-        "Authorization": f"Bot {DISCORD_TOKEN}",
-        "Content-Type": "application/json"
-    }
-    
-    if len(message) > 1900:
-        message = message[:1900] + "... (truncated)"
-        
-    payload = {"content": message}
-    
-    try:
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-    except Exception as e:
-        print(f"Failed to log to Discord: {e}")
+    # Queued for the background dispatcher so the research loop never waits on Discord.
+    get_dispatcher(DISCORD_TOKEN, TARGET_CHANNEL_ID).send(message)
 
 def upload_file_to_discord(filepath, message=""):
     if not DISCORD_TOKEN or not TARGET_CHANNEL_ID:
         print(f"[Discord Upload Skipped]: {filepath}")
         return
-
-    url = f"https://discord.com/api/v9/channels/{TARGET_CHANNEL_ID}/messages"
-    headers = {
-        "Authorization": f"Bot {DISCORD_TOKEN}"
-    }
-    
-    try:
-        with open(filepath, 'rb') as f:
-            files = {
-                'file': (os.path.basename(filepath), f, 'text/markdown')
-            }
-            payload = {'content': message} if message else {}
-            
-            response = requests.post(url, headers=headers, data=payload, files=files)
-            response.raise_for_status()
-            print(f"Uploaded {filepath} to Discord.")
-    except Exception as e:
-        print(f"Failed to upload file to Discord: {e}")
+    get_dispatcher(DISCORD_TOKEN, TARGET_CHANNEL_ID).upload(filepath, message)
 
 SYSTEM_PROMPT = """
 You are River, a brilliant, intuitive, and slightly psychic researcher aboard the ship Serenity.
@@ -137,18 +111,9 @@ When writing a report, you MUST use the "NotebookLM Source Guide" style:
 def call_ollama(prompt, context=""):
     full_prompt = f"{SYSTEM_PROMPT}\n\n**CURRENT CONTEXT:**\n{context}\n\n**YOUR RESPONSE (JSON):**"
     
-    payload = {
-        "model": MODEL_NAME,
-        "prompt": full_prompt,
-        "stream": False,
-        "format": "json"
-    }
-    
     try:
         print(f"Thinking... (Model: {MODEL_NAME})")
-        response = requests.post(OLLAMA_URL, json=payload)
-        response.raise_for_status()
-        result = response.json()
+        result = get_client().generate(full_prompt, MODEL_CHAIN, format="json")
         return json.loads(result['response'])
     except Exception as e:
         print(f"Error calling Ollama: {e}")
@@ -238,11 +203,11 @@ def main():
                 context = "**SYSTEM:** Failed to ingest (possibly duplicate or empty)."
 
         elif action == "QUERY":
-            results = rag.query(argument, k=3)
+            results = rag.query(argument, k=6)
             context = f"**MEMORY RECALL for '{argument}':**\n"
             if results:
-                for res in results:
-                    context += f"- (Score: {res['score']:.2f}) {res['text'][:300]}...\n"
+                items = hits_to_items(results, header=lambda res: f"- (Score: {res['score']:.2f})")
+                context += build_context(items, RECALL_TOKENS, separator="\n").text + "\n"
             else:
                 context += "No relevant memories found."
 
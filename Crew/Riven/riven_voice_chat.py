@@ -1,16 +1,20 @@
 import os
+import re
 import sys
 import json
+import argparse
 import asyncio
 import threading
 import time
-import requests
-import pygame
 import speech_recognition as sr
-import edge_tts
 from dotenv import load_dotenv
 from pathlib import Path
+from audio_engine import AudioPlayer, MicrophoneListener, UtteranceDetector
+from context_builder import build_context, hits_to_items
+from ollama_client import get_async_client, get_client
 from rag_engine import SimpleRAG
+from speech_to_text import BACKENDS, create_stt
+from tts_cache import get_tts_cache, synthesize as synthesize_clip
 
 # Load .env
 repo_root = Path(__file__).parent.parent.parent
@@ -22,23 +26,30 @@ if env_local.exists():
     load_dotenv(dotenv_path=env_local, override=True)
 
 # Configuration
-OLLAMA_URL = "http://localhost:11434/api/generate"
 MODEL_NAME = "riven"
 DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
 RAG_DB_PATH = os.path.join(DATA_DIR, "serenity_brain.json")
-TEMP_AUDIO = os.path.join(DATA_DIR, "temp_speech.mp3")
+CALIBRATION_PATH = os.path.join(DATA_DIR, "voice_calibration.json")
+VOICE = "en-US-AriaNeural"
+# Retrieved context per question; answers are a few spoken sentences, so keep prefill short.
+CONTEXT_TOKENS = 400
+
+# Pipelined mode: sentences are synthesized while the model is still generating.
+SENTENCE_END = re.compile(r'[.!?…]+["\')\]]*\s+')
+MIN_SENTENCE_CHARS = 24  # shorter sentences are merged with the next one
+TTS_CONCURRENCY = 3
+MARKDOWN_MARKS = str.maketrans("", "", "*#_")
 
 # Initialize RAG
 rag = SimpleRAG(RAG_DB_PATH)
 
-# Initialize Audio
-pygame.mixer.init()
-
-# Flags
-is_speaking = False
-stop_speaking = False
+# Audio plays on its own thread; the microphone listens on another.
+player = None
+replying = threading.Event()     # set while River is answering
+interrupted = threading.Event()  # set when the Captain talks over her
+_cancel_reply = None             # aborts the pipelined reply in flight, if any
 
-def query_ollama(prompt, context=""):
+def build_prompt(prompt, context=""):
     system_prompt = """
 You are Riven, a brilliant, psychic researcher. 
 Your answers will be spoken aloud.
@@ -51,113 +62,270 @@ Your answers will be spoken aloud.
 
 **CONTEXT:**
 """
-    full_prompt = f"{system_prompt}\n{context}\n\n**CAPTAIN:** {prompt}\n\n**RIVER:**"
-    
-    payload = {
-        "model": MODEL_NAME,
-        "prompt": full_prompt,
-        "stream": False
-    }
-    
+    return f"{system_prompt}\n{context}\n\n**CAPTAIN:** {prompt}\n\n**RIVER:**"
+
+def query_ollama(prompt, context=""):
     try:
-        response = requests.post(OLLAMA_URL, json=payload)
-        response.raise_for_status()
-        return response.json()['response']
+        return get_client().generate(build_prompt(prompt, context), MODEL_NAME)['response']
     except Exception as e:
         return f"I can't reach my mind... {e}"
 
-async def generate_audio(text):
-    voice = "en-US-AriaNeural"
-    communicate = edge_tts.Communicate(text, voice)
-    await communicate.save(TEMP_AUDIO)
-
-def play_audio():
-    global is_speaking, stop_speaking
+async def query_ollama_stream(prompt, context=""):
+    """Yields the answer piece by piece as Ollama generates it."""
     try:
-        pygame.mixer.music.load(TEMP_AUDIO)
-        pygame.mixer.music.play()
-        is_speaking = True
-        
-        while pygame.mixer.music.get_busy():
-            if stop_speaking:
-                pygame.mixer.music.stop()
-                break
-            time.sleep(0.1)
-            
+        async for chunk in get_async_client().generate_stream(build_prompt(prompt, context), MODEL_NAME):
+            if chunk.get('response'):
+                yield chunk['response']
     except Exception as e:
-        print(f"[Audio Error: {e}]")
-    finally:
-        is_speaking = False
-        stop_speaking = False
-        # Clean up to allow overwrite
-        pygame.mixer.music.unload()
-
-def listen_for_input():
-    global stop_speaking
-    r = sr.Recognizer()
-    r.energy_threshold = 300
-    r.dynamic_energy_threshold = True
-    r.pause_threshold = 0.8
-    
-    with sr.Microphone() as source:
-        print("\n(Listening...)")
-        r.adjust_for_ambient_noise(source, duration=0.5)
-        
+        yield f"I can't reach my mind... {e}"
+
+async def synthesize(text):
+    """Synthesizes one sentence straight into memory (MP3 bytes), reusing cached clips."""
+    return await synthesize_clip(text, VOICE, cache=get_tts_cache())
+
+class SentenceSplitter:
+    """Cuts a token stream into speakable sentences."""
+
+    def __init__(self, min_chars=MIN_SENTENCE_CHARS):
+        self.min_chars = min_chars
+        self._buffer = ""
+
+    def feed(self, token):
+        """Adds a token; returns the sentences it completed."""
+        self._buffer += token
+        sentences = []
+        start = 0
+        for match in SENTENCE_END.finditer(self._buffer):
+            if match.end() - start >= self.min_chars:
+                sentences.append(self._buffer[start:match.end()].strip())
+                start = match.end()
+        self._buffer = self._buffer[start:]
+        return sentences
+
+    def flush(self):
+        """Whatever is left once the stream ends."""
+        rest, self._buffer = self._buffer.strip(), ""
+        return rest
+
+def barge_in():
+    """Called by the microphone thread for every utterance. True if it cut a reply short."""
+    if not replying.is_set():
+        return False
+    print("\n![Interruption Detected]!")
+    interrupted.set()
+    player.stop()
+    if _cancel_reply:
+        _cancel_reply()
+    return True
+
+async def respond_pipelined(prompt, context):
+    """
+    Streams the answer, cuts it at sentence boundaries, synthesizes sentences
+    concurrently and plays them back in order as soon as each is ready.
+    Barge-in stops playback, pending synthesis and the generation itself.
+    """
+    global _cancel_reply
+    loop = asyncio.get_running_loop()
+    cancelled = asyncio.Event()
+    _cancel_reply = lambda: loop.call_soon_threadsafe(cancelled.set)
+    # barge_in stops the player before the cancel reaches this loop, so clips are
+    # queued against this generation and dropped once it has moved on.
+    generation = player.generation
+    if interrupted.is_set():
+        cancelled.set()
+    started = time.perf_counter()
+    first_audio = None
+    segments = asyncio.Queue()  # synthesis tasks in speaking order; None ends the reply
+    limit = asyncio.Semaphore(TTS_CONCURRENCY)
+
+    async def synth(sentence):
+        async with limit:
+            return await synthesize(sentence)
+
+    async def produce():
+        splitter = SentenceSplitter()
+        print("River > ", end="", flush=True)
         try:
-            audio = r.listen(source, timeout=None)
-            
-            # If River is speaking and we hear something, STOP her immediately
-            if is_speaking:
-                print("![Interruption Detected]!")
-                stop_speaking = True
-                return "STOP"
-
-            print("(Recognizing...)")
-            text = r.recognize_google(audio)
-            return text
-        except sr.UnknownValueError:
-            return None
-        except sr.RequestError:
-            return None
-        except Exception:
+            async for token in query_ollama_stream(prompt, context):
+                if cancelled.is_set():
+                    break
+                print(token, end="", flush=True)
+                for sentence in splitter.feed(token.translate(MARKDOWN_MARKS)):
+                    segments.put_nowait(asyncio.create_task(synth(sentence)))
+            rest = splitter.flush()
+            if rest and not cancelled.is_set():
+                segments.put_nowait(asyncio.create_task(synth(rest)))
+        finally:
+            print()
+            segments.put_nowait(None)
+
+    async def until_cancelled(awaitable):
+        # The awaitable's result, or None if barge-in came first.
+        waiter = asyncio.ensure_future(cancelled.wait())
+        task = asyncio.ensure_future(awaitable)
+        try:
+            await asyncio.wait({waiter, task}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            waiter.cancel()
+        if not task.done():
+            task.cancel()
             return None
+        return task.result()
+
+    producer = asyncio.create_task(produce())
+    try:
+        # Clips are handed to the player as soon as they are ready, so the next
+        # sentence is already queued when the current one finishes.
+        while not cancelled.is_set():
+            task = await until_cancelled(segments.get())
+            if task is None:
+                break
+            try:
+                data = await until_cancelled(task)
+            except Exception as e:
+                print(f"[TTS Error: {e}]")
+                continue
+            if data is None or cancelled.is_set() or interrupted.is_set():
+                break
+            if not player.play(data, generation=generation):
+                break
+            if first_audio is None:
+                first_audio = time.perf_counter() - started
+        await until_cancelled(asyncio.to_thread(player.wait_idle))
+    finally:
+        _cancel_reply = None
+        producer.cancel()
+        pending = []
+        while not segments.empty():
+            task = segments.get_nowait()
+            if task is not None:
+                task.cancel()
+                pending.append(task)
+        # Wait for the cancellations to land, so no synthesis outlives the reply.
+        await asyncio.gather(producer, *pending, return_exceptions=True)
+
+    if first_audio is not None:
+        print(f"   (first audio after {first_audio:.2f}s)")
+
+def listen_for_input(listener, stt):
+    audio = listener.next_utterance()
+    if audio is None:
+        if listener.error:
+            raise RuntimeError(f"microphone stopped: {listener.error}")
+        raise EOFError
+
+    try:
+        print("(Recognizing...)")
+        started = time.perf_counter()
+        text = stt.transcribe(audio)
+        print(f"   ({stt.name}: {time.perf_counter() - started:.2f}s)")
+        return text
+    except Exception:
+        return None
 
 def main():
+    parser = argparse.ArgumentParser(description="Talk to River by voice")
+    parser.add_argument(
+        "--pipeline",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Speak sentence by sentence while the answer is still generating",
+    )
+    parser.add_argument(
+        "--stt",
+        choices=["auto", *BACKENDS],
+        default=os.environ.get("RIVEN_STT", "auto"),
+        help="Speech-to-text backend (auto prefers the offline Vosk model)",
+    )
+    parser.add_argument("--wav", nargs="+", help="Read the Captain's side from WAV files instead of the microphone")
+    parser.add_argument(
+        "--transcribe-only",
+        action="store_true",
+        help="Only print what was heard; no model, no speech (works offline with --wav and an offline STT)",
+    )
+    args = parser.parse_args()
+    loop = asyncio.new_event_loop()
+
+    stt = create_stt(args.stt)
+    if args.wav:
+        # Recorded fixtures: no calibration, the detector adapts to the file's noise floor.
+        listener = MicrophoneListener(
+            interrupt=barge_in,
+            sources=[sr.AudioFile(path) for path in args.wav],
+            calibrate=False,
+        )
+    else:
+        listener = MicrophoneListener(
+            interrupt=barge_in,
+            detector=UtteranceDetector(calibration_path=CALIBRATION_PATH),
+        )
+
+    if args.transcribe_only:
+        try:
+            while True:
+                print(f"Captain > {listen_for_input(listener, stt)}")
+        except EOFError:
+            pass
+        except RuntimeError as e:
+            print(f"[Mic Error: {e}]")
+        finally:
+            listener.close()
+        return
+
+    global player
+    player = AudioPlayer()
+
     print("="*50)
     print("🌊 RIVER - VOICE INTERFACE (INTERRUPTIBLE)")
     print("   [Speak to chat. Interrupt her if she talks too much.]")
     print("="*50)
 
-    while True:
-        user_input = listen_for_input()
-        
-        if not user_input:
-            continue
-            
-        if user_input == "STOP":
-            # Just stop audio, loop back to listen
-            continue
-            
-        print(f"Captain > {user_input}")
-        
-        if user_input.lower() in ["exit", "quit", "leave"]:
-            print("River > Signing off.")
-            break
-
-        # RAG Retrieval
-        docs = rag.query(user_input, k=2)
-        context = "\n".join([d['text'] for d in docs]) if docs else "No specific data."
-
-        # Generate Response
-        response = query_ollama(user_input, context)
-        print(f"River > {response}")
-        
-        # TTS
-        try:
-            asyncio.run(generate_audio(response))
-            play_audio()
-        except Exception as e:
-            print(f"[TTS Error: {e}]")
+    try:
+        while True:
+            print("\n(Listening...)")
+            user_input = listen_for_input(listener, stt)
+
+            if not user_input:
+                continue
+
+            print(f"Captain > {user_input}")
+
+            if user_input.lower() in ["exit", "quit", "leave"]:
+                print("River > Signing off.")
+                break
+
+            # RAG Retrieval
+            docs = rag.query(user_input, k=4)
+            context = build_context(hits_to_items(docs), CONTEXT_TOKENS).text if docs else "No specific data."
+
+            interrupted.clear()
+            replying.set()
+            try:
+                if args.pipeline:
+                    loop.run_until_complete(respond_pipelined(user_input, context))
+                    continue
+
+                # Generate Response
+                generation = player.generation
+                response = query_ollama(user_input, context)
+                print(f"River > {response}")
+
+                # TTS
+                data = loop.run_until_complete(synthesize(response))
+                if not interrupted.is_set() and player.play(data, generation=generation):
+                    player.wait_idle()
+            except Exception as e:
+                print(f"[TTS Error: {e}]")
+            finally:
+                replying.clear()
+    except EOFError:
+        print("(Input ended.)")
+    except RuntimeError as e:
+        print(f"[Mic Error: {e}]")
+    finally:
+        listener.close()
+        player.close()
+        loop.close()
 
 if __name__ == "__main__":
     main()
@@ -8,9 +8,15 @@ import time
 from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
-from typing import Iterable, Optional
+from typing import Any, Callable, Optional, Sequence, Tuple
 
-import requests
+from chunker import count_tokens
+from context_builder import PackedContext, build_context, context_window, documents_to_items
+from discord_log import get_dispatcher
+from generation_cache import GenerationCache, generation_key, open_generation_cache, resolve_model
+from ollama_client import base_url_from_endpoint, get_client
+from source_loader import Source, SourceCache, expand_glob, fingerprint, load_sources, read_source
+from stream_json import IncrementalJSONParser
 
 try:
     from dotenv import load_dotenv
@@ -47,50 +53,47 @@ def _now_stamp() -> str:
     return datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
 
 
+# Sources are packed by token budget; this only guards against absurdly large files.
+SOURCE_MAX_CHARS = 2_000_000
+# Room left in the context window for the dossier itself.
+OUTPUT_RESERVE_TOKENS = 2048
+
+
 def _read_text_safely(path: Path, max_chars: int = 30_000) -> str:
-    try:
-        text = path.read_text(encoding="utf-8")
-    except UnicodeDecodeError:
-        text = path.read_text(encoding="utf-8", errors="replace")
-
-    if len(text) <= max_chars:
-        return text
-
-    head = text[: max_chars // 2]
-    tail = text[-max_chars // 2 :]
-    return (
-        head
-        + "\n\n… [TRUNCATED] …\n\n"
-        + tail
-        + f"\n\n[NOTE] Source truncated from {len(text)} chars."
-    )
+    return read_source(path, max_chars)
+
+
+def _find_identical_run(run_root: Path, prompt_fingerprint: str) -> Optional[Path]:
+    """The newest finished run that sent exactly this prompt to this model, if any."""
+    if not run_root.is_dir():
+        return None
+    for run_dir in sorted((p for p in run_root.iterdir() if p.is_dir()), reverse=True):
+        try:
+            meta = json.loads((run_dir / "meta.json").read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            continue
+        if meta.get("fingerprint") == prompt_fingerprint and meta.get("completed_at"):
+            return run_dir
+    return None
 
 
 def log_to_discord(message: str, *, token: Optional[str], channel_id: Optional[str]) -> None:
+    """Queues the message for the background dispatcher; never waits on Discord."""
     if not token or not channel_id or "REPLACE_ME" in token or "REPLACE_ME" in str(channel_id):
         print(f"[Discord Log Skipped] {message}")
         return
-
-    url = f"https://discord.com/api/v9/channels/{channel_id}/messages"
-    headers = {
-        "Authorization": f"Bot {token}",
-        "Content-Type": "application/json",
-    }
-
-    if len(message) > 1900:
-        message = message[:1900] + "... (truncated)"
-
-    try:
-        resp = requests.post(url, headers=headers, json={"content": message}, timeout=20)
-        resp.raise_for_status()
-    except Exception as e:
-        print(f"Failed to log to Discord: {e}")
+    get_dispatcher(token, channel_id).send(message)
 
 
 @dataclass
 class OllamaResult:
-    raw_text: str
-    json_obj: Optional[dict]
+    raw_path: Path
+    json_obj: Optional[Any]
+    truncated: bool = False
+    cached: bool = False
+
+
+_PREVIEW_CHARS = 1200
 
 
 def _ollama_generate(
@@ -99,65 +102,77 @@ def _ollama_generate(
     model: str,
     prompt: str,
     stream: bool,
+    raw_path: Path,
+    on_section: Optional[Callable[[str, Any], None]],
+    cache: Optional[GenerationCache],
     discord_token: Optional[str],
     discord_channel: Optional[str],
     discord_interval_s: float,
 ) -> OllamaResult:
-    payload = {
-        "model": model,
-        "prompt": prompt,
-        "stream": stream,
-        "format": "json",
-    }
-
-    assembled = ""
+    """Runs the generation, writing the raw response to raw_path as it arrives.
+
+    The response is parsed incrementally: each top-level dossier section goes to
+    on_section as soon as it closes. If the call fails midway, whatever can be
+    repaired is saved as dossier.partial.json next to raw_path.
+    With a cache, an identical earlier request is answered from it.
+    """
+    client = get_client(base_url_from_endpoint(url))
+    parser = IncrementalJSONParser(on_section)
+    tail = ""  # last few hundred characters, for Discord previews
     last_discord = 0.0
 
+    cache_key = cached = resolved = None
+    if cache is not None:
+        resolved = resolve_model(client, model)
+        if resolved is not None:
+            cache_key = generation_key(resolved[1], prompt, {"format": "json"})
+            cached = cache.get(cache_key)
+
     try:
-        if not stream:
-            resp = requests.post(url, json=payload, timeout=600)
-            resp.raise_for_status()
-            data = resp.json()
-            assembled = data.get("response", "")
-        else:
-            with requests.post(url, json=payload, stream=True, timeout=600) as resp:
-                resp.raise_for_status()
-                for line in resp.iter_lines(decode_unicode=True):
-                    if not line:
-                        continue
-                    try:
-                        chunk = json.loads(line)
-                    except json.JSONDecodeError:
+        with raw_path.open("w", encoding="utf-8") as raw:
+            if cached is not None:
+                print(f"[GenCache] Reusing the stored {resolved[0]} response.")
+                raw.write(cached)
+                parser.feed(cached)
+            elif not stream:
+                data = client.generate(prompt, model, format="json")
+                raw.write(data.get("response", ""))
+                parser.feed(data.get("response", ""))
+            else:
+                for chunk in client.generate_stream(prompt, model, format="json"):
+                    piece = chunk.get("response", "")
+                    if not piece:
                         continue
-
-                    assembled += chunk.get("response", "")
+                    raw.write(piece)
+                    parser.feed(piece)
+                    tail = (tail + piece)[-_PREVIEW_CHARS:]
 
                     now = time.time()
                     if (
                         discord_interval_s > 0
                         and now - last_discord >= discord_interval_s
-                        and len(assembled) > 250
+                        and parser.chars > 250
                     ):
                         last_discord = now
-                        preview = assembled[-1200:]
                         log_to_discord(
-                            "Riven Research (in progress)…\n" + preview,
+                            "Riven Research (in progress)…\n" + tail,
                             token=discord_token,
                             channel_id=discord_channel,
                         )
 
-                    if chunk.get("done") is True:
-                        break
-
-        parsed: Optional[dict]
-        try:
-            parsed = json.loads(assembled)
-        except json.JSONDecodeError:
-            parsed = None
-
-        return OllamaResult(raw_text=assembled, json_obj=parsed)
+        parsed = parser.finish()
+        if parser.truncated:
+            print(f"[Research] Response was incomplete; kept the sections that could be repaired: {list(parser.sections)}")
+        elif parsed is not None and cache_key is not None and cached is None:
+            cache.put(cache_key, resolved[0], raw_path.read_text(encoding="utf-8"))
+        return OllamaResult(raw_path=raw_path, json_obj=parsed, truncated=parser.truncated, cached=cached is not None)
 
     except Exception as e:
+        partial = parser.finish()
+        if partial:
+            (raw_path.parent / "dossier.partial.json").write_text(
+                json.dumps(partial, indent=2, ensure_ascii=False), encoding="utf-8"
+            )
         msg = f"Riven Research failed calling Ollama: {e}"
         log_to_discord(msg, token=discord_token, channel_id=discord_channel)
         raise
@@ -182,33 +197,45 @@ def build_prompt(
     *,
     topic: str,
     prompt_file: Path,
-    sources: Iterable[Path],
-) -> str:
+    sources: Sequence[Source],
+    context_tokens: int,
+) -> Tuple[str, PackedContext]:
+    """The run prompt, with the source notes packed into what is left of context_tokens.
+
+    Source chunks are ranked against the topic, so the most relevant notes go
+    in first and the prompt never outgrows the budget.
+    """
     prompt_template = ""
     if prompt_file.exists():
         prompt_template = _extract_prompt_body(_read_text_safely(prompt_file, max_chars=20_000))
 
-    sources_blob = ""
-    sources = list(sources)
-    if sources:
-        chunks: list[str] = []
-        for p in sources:
-            if not p.exists() or not p.is_file():
-                chunks.append(f"[Missing source] {p}")
-                continue
-            chunks.append(f"\n---\nSOURCE: {p.as_posix()}\n---\n{_read_text_safely(p)}")
-        sources_blob = "\n\n# SOURCES (notes; avoid long quotes)\n" + "\n".join(chunks)
-
     # Keep this as a 'user prompt'. The model already has a SYSTEM prompt in its Modelfile.
-    return (
+    instructions = (
         "Create a Riven Research dossier run.\n\n"
         f"RUN TOPIC: {topic}\n"
         "- If anything is uncertain, say so explicitly.\n"
         "- Do not output long verbatim passages.\n"
         "- Output JSON following the model schema.\n\n"
         + (prompt_template + "\n\n" if prompt_template else "")
-        + sources_blob
-    ).strip()
+    )
+
+    missing: list[str] = []
+    documents: list[tuple[str, str]] = []
+    for source in sources:
+        if source.text is None:
+            missing.append(f"[Missing source] {source.path}")
+            continue
+        documents.append((f"---\nSOURCE: {source.path.as_posix()}\n---", source.text))
+
+    sources_header = "\n\n# SOURCES (notes; avoid long quotes)\n"
+    fixed = instructions + sources_header + "\n".join(missing)
+    budget = max(0, context_tokens - count_tokens(fixed))
+    packed = build_context(documents_to_items(documents, query=topic), budget)
+
+    sources_blob = ""
+    if documents or missing:
+        sources_blob = sources_header + "\n".join(missing + [packed.text])
+    return (instructions + sources_blob).strip(), packed
 
 
 def main() -> int:
@@ -236,6 +263,12 @@ def main() -> int:
         default=[],
         help="Optional source files to include as notes (paths or globs)",
     )
+    parser.add_argument(
+        "--context-tokens",
+        type=int,
+        default=None,
+        help="Prompt budget in tokens (default: the model's context window minus room for the answer)",
+    )
     parser.add_argument(
         "--stream",
         action=argparse.BooleanOptionalAction,
@@ -254,6 +287,17 @@ def main() -> int:
         default=45.0,
         help="Minimum seconds between Discord progress messages (streaming only)",
     )
+    parser.add_argument(
+        "--skip-identical",
+        action="store_true",
+        help="Skip the run when a finished run already sent the same prompt to the same model build",
+    )
+    parser.add_argument(
+        "--cache",
+        action=argparse.BooleanOptionalAction,
+        default=None,
+        help="Reuse the stored response for an identical model + prompt (default: RIVEN_GENERATION_CACHE)",
+    )
     parser.add_argument(
         "--dry-run",
         action="store_true",
@@ -269,27 +313,52 @@ def main() -> int:
         repo_root / "Crew" / "Riven" / "models" / "riven-research" / "riven_research_prompt.md"
     )
 
+    source_cache = SourceCache()
+
     # Expand sources (allow simple globs). Interpret relative paths/globs from repo root
     # so the script works even if invoked from another working directory.
     expanded_sources: list[Path] = []
     for s in args.sources:
         if any(ch in s for ch in ("*", "?", "[")):
-            expanded_sources.extend(repo_root.glob(s))
+            expanded_sources.extend(expand_glob(repo_root, s, source_cache))
         else:
             p = Path(s)
             if not p.is_absolute():
                 p = repo_root / p
             expanded_sources.append(p)
 
-    run_id = f"{_now_stamp()}_{_slugify(args.topic)}"
-    out_dir = run_root / run_id
-    out_dir.mkdir(parents=True, exist_ok=True)
+    started = time.perf_counter()
+    sources = load_sources(expanded_sources, SOURCE_MAX_CHARS, source_cache)
+    print(
+        f"[Sources] {len(sources)} loaded in {time.perf_counter() - started:.2f}s "
+        f"({sum(s.cached for s in sources)} from cache)"
+    )
 
     discord_token = os.getenv("DISCORD_TOKEN")
     discord_channel = os.getenv("CHANNEL_RIVEN_LOGS") or os.getenv("CHANNEL_SERENITY_LOGS")
 
     discord_enabled = bool(args.discord and discord_token and discord_channel)
 
+    context_tokens = args.context_tokens or max(0, context_window(args.model) - OUTPUT_RESERVE_TOKENS)
+    prompt, packed = build_prompt(
+        topic=args.topic, prompt_file=prompt_file, sources=sources, context_tokens=context_tokens
+    )
+    print(f"[Context] Sources: {packed.summary()}")
+    # Everything that decides the model's output: same fingerprint, same request.
+    # The digest, not the name, identifies the model: a re-pulled tag is a new model.
+    resolved = resolve_model(get_client(base_url_from_endpoint(args.ollama_url)), args.model)
+    prompt_fingerprint = fingerprint(resolved[1], "json", prompt) if resolved is not None else None
+
+    if args.skip_identical and not args.dry_run:
+        previous = _find_identical_run(run_root, prompt_fingerprint) if prompt_fingerprint else None
+        if previous is not None:
+            print(f"[Research] Identical prompt already run: {previous}. Skipping (drop --skip-identical to rerun).")
+            return 0
+
+    run_id = f"{_now_stamp()}_{_slugify(args.topic)}"
+    out_dir = run_root / run_id
+    out_dir.mkdir(parents=True, exist_ok=True)
+
     meta = {
         "run_id": run_id,
         "created_at": datetime.now().isoformat(timespec="seconds"),
@@ -298,13 +367,16 @@ def main() -> int:
         "ollama_url": args.ollama_url,
         "stream": bool(args.stream),
         "sources": [str(p) for p in expanded_sources],
+        "source_digests": {str(s.path): s.digest for s in sources if s.text is not None},
+        "fingerprint": prompt_fingerprint,
         "prompt_file": str(prompt_file),
+        "prompt_tokens": count_tokens(prompt),
+        "source_context": {"tokens": packed.tokens, "budget": packed.budget, "passages": packed.included, "left_out": packed.dropped},
         "discord_enabled": discord_enabled,
         "discord_channel_env": "CHANNEL_RIVEN_LOGS" if os.getenv("CHANNEL_RIVEN_LOGS") else "CHANNEL_SERENITY_LOGS",
     }
     (out_dir / "meta.json").write_text(json.dumps(meta, indent=2, ensure_ascii=False), encoding="utf-8")
 
-    prompt = build_prompt(topic=args.topic, prompt_file=prompt_file, sources=expanded_sources)
     (out_dir / "prompt.txt").write_text(prompt, encoding="utf-8")
 
     start_msg = (
@@ -319,17 +391,33 @@ def main() -> int:
         print(f"[DRY RUN] Prepared run folder: {out_dir}")
         return 0
 
+    sections_dir = out_dir / "sections"
+
+    def save_section(key: str, value: Any) -> None:
+        # Each finished section lands on disk while the rest is still generating.
+        sections_dir.mkdir(exist_ok=True)
+        (sections_dir / f"{_slugify(key)}.json").write_text(
+            json.dumps(value, indent=2, ensure_ascii=False), encoding="utf-8"
+        )
+        print(f"[Research] Section complete: {key}")
+
     result = _ollama_generate(
         url=args.ollama_url,
         model=args.model,
         prompt=prompt,
         stream=bool(args.stream),
+        raw_path=out_dir / "ollama_response.txt",
+        on_section=save_section,
+        cache=open_generation_cache(args.cache),
         discord_token=(discord_token if discord_enabled else None),
         discord_channel=(discord_channel if discord_enabled else None),
         discord_interval_s=float(args.discord_interval),
     )
 
-    (out_dir / "ollama_response.txt").write_text(result.raw_text, encoding="utf-8")
+    if result.truncated:
+        meta["dossier_truncated"] = True
+    if result.cached:
+        meta["generation_cached"] = True
 
     if result.json_obj is not None:
         (out_dir / "dossier.json").write_text(
@@ -376,6 +464,11 @@ def main() -> int:
 
     (out_dir / "run.md").write_text("\n".join(summary_lines), encoding="utf-8")
 
+    # Only a complete, parsed dossier counts as a previous result for --skip-identical.
+    if not result.truncated and result.json_obj is not None:
+        meta["completed_at"] = datetime.now().isoformat(timespec="seconds")
+    (out_dir / "meta.json").write_text(json.dumps(meta, indent=2, ensure_ascii=False), encoding="utf-8")
+
     done_msg = f"Riven Research complete. Run folder: {out_dir.as_posix()}"
     log_to_discord(done_msg, token=(discord_token if discord_enabled else None), channel_id=(discord_channel if discord_enabled else None))
 
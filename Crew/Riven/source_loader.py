@@ -0,0 +1,264 @@
+"""Concurrent, memoized loading of source notes for research prompts.
+
+Reading hundreds of notes one after another, and walking the tree again for
+every `--sources` glob, used to dominate the time before a research run even
+reached Ollama. Here files are read on a thread pool, and both the normalized
+text of each file and the result of each glob are cached in one SQLite file:
+
+- a file is reused while its (path, mtime, size) are unchanged;
+- a glob is reused while every directory it looked in has the same mtime
+  (adding, removing or renaming an entry changes the directory's mtime).
+
+`fingerprint` digests the prompt inputs, so a run can tell that it would send
+exactly the same prompt as an earlier one.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence
+
+DATA_DIR = Path(__file__).parent / "data"
+CACHE_PATH = DATA_DIR / "source_cache.sqlite"
+LOAD_WORKERS = 8
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    key       TEXT PRIMARY KEY,
+    mtime_ns  INTEGER NOT NULL,
+    size      INTEGER NOT NULL,
+    text      TEXT NOT NULL,
+    digest    TEXT NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS globs (
+    key       TEXT PRIMARY KEY,
+    dirs      TEXT NOT NULL,
+    matches   TEXT NOT NULL,
+    last_used REAL NOT NULL
+);
+"""
+
+_MAGIC = re.compile(r"[*?\[]")
+_BLANK_RUNS = re.compile(r"\n{4,}")
+
+
+def digest(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=20).hexdigest()
+
+
+def fingerprint(*parts: str) -> str:
+    """Digest of several strings, unambiguous about where each one ends."""
+    h = hashlib.blake2b(digest_size=20)
+    for part in parts:
+        data = part.encode("utf-8")
+        h.update(len(data).to_bytes(8, "little"))
+        h.update(data)
+    return h.hexdigest()
+
+
+def normalize_text(text: str) -> str:
+    text = text.lstrip("\ufeff").replace("\r\n", "\n").replace("\r", "\n")
+    return _BLANK_RUNS.sub("\n\n\n", text)
+
+
+def truncate_middle(text: str, max_chars: int) -> str:
+    """Keeps the head and tail of an over-long text, with a note of what was cut."""
+    if len(text) <= max_chars:
+        return text
+    head = text[: max_chars // 2]
+    tail = text[-max_chars // 2 :]
+    return (
+        head
+        + "\n\n… [TRUNCATED] …\n\n"
+        + tail
+        + f"\n\n[NOTE] Source truncated from {len(text)} chars."
+    )
+
+
+def read_source(path: Path, max_chars: int) -> str:
+    with open(path, "rb") as f:
+        raw = f.read()
+    return truncate_middle(normalize_text(raw.decode("utf-8", errors="replace")), max_chars)
+
+
+@dataclass
+class Source:
+    path: Path
+    text: Optional[str]  # None when the file is missing or unreadable
+    digest: str = ""
+    cached: bool = False
+
+
+class SourceCache:
+    def __init__(self, path: Path = CACHE_PATH, max_entries: int = 5000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.executescript(_SCHEMA)
+
+    def get_text(self, key: str, mtime_ns: int, size: int) -> Optional[tuple]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text, digest FROM sources WHERE key = ? AND mtime_ns = ? AND size = ?",
+                (key, mtime_ns, size),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return row
+
+    def touch(self, keys: Sequence[str]) -> None:
+        """Marks entries as recently used, in one transaction."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany("UPDATE sources SET last_used = ? WHERE key = ?", [(now, k) for k in keys])
+
+    def put_texts(self, rows: Sequence[tuple]) -> None:
+        """Stores (key, mtime_ns, size, text, digest) rows, in one transaction."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO sources (key, mtime_ns, size, text, digest, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                [(*row, now) for row in rows],
+            )
+            excess = self._conn.execute("SELECT COUNT(*) FROM sources").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self._conn.execute(
+                    "DELETE FROM sources WHERE key IN (SELECT key FROM sources ORDER BY last_used LIMIT ?)",
+                    (excess,),
+                )
+
+    def get_glob(self, key: str) -> Optional[List[str]]:
+        with self._lock:
+            row = self._conn.execute("SELECT dirs, matches FROM globs WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        for directory, mtime_ns in json.loads(row[0]).items():
+            try:
+                if os.stat(directory).st_mtime_ns != mtime_ns:
+                    return None
+            except OSError:
+                return None
+        return json.loads(row[1])
+
+    def put_glob(self, key: str, dirs: Dict[str, int], matches: List[str]) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO globs (key, dirs, matches, last_used) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(dirs), json.dumps(matches), time.time()),
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def _walk(base: Path, parts: Sequence[str], dirs: Dict[str, int]) -> Iterator[Path]:
+    """Path.glob over `parts`, recording the mtime of every directory it looks in."""
+    if not parts:
+        yield base
+        return
+    try:
+        dirs[str(base)] = os.stat(base).st_mtime_ns
+    except OSError:
+        return
+    part, rest = parts[0], parts[1:]
+    if not _MAGIC.search(part):
+        child = base / part
+        if rest and child.is_dir():
+            yield from _walk(child, rest, dirs)
+        elif not rest and child.exists():
+            yield child
+        return
+    if part == "**":
+        yield from _walk(base, rest, dirs)
+    try:
+        entries = list(os.scandir(base))
+    except OSError:
+        return
+    for entry in entries:
+        if part == "**":
+            # Symlinked folders are not followed, so links cannot make the walk loop.
+            if entry.is_dir(follow_symlinks=False):
+                yield from _walk(Path(entry.path), parts, dirs)
+        elif fnmatch(entry.name, part):
+            if not rest:
+                yield Path(entry.path)
+            elif entry.is_dir():
+                yield from _walk(Path(entry.path), rest, dirs)
+
+
+def expand_glob(root: Path, pattern: str, cache: Optional[SourceCache] = None) -> List[Path]:
+    """Matches of `pattern` under `root`, sorted; unchanged directories are not listed again."""
+    key = f"{root}\0{pattern}"
+    if cache is not None:
+        matches = cache.get_glob(key)
+        if matches is not None:
+            return [Path(m) for m in matches]
+    dirs: Dict[str, int] = {}
+    found = sorted({str(p) for p in _walk(root, Path(pattern).parts, dirs)})
+    if cache is not None:
+        cache.put_glob(key, dirs, found)
+    return [Path(m) for m in found]
+
+
+def load_sources(
+    paths: Sequence[Path],
+    max_chars: int,
+    cache: Optional[SourceCache] = None,
+    workers: int = LOAD_WORKERS,
+) -> List[Source]:
+    """Reads `paths` concurrently, in order; cached text is used while a file is unchanged."""
+
+    hits: List[str] = []
+    fresh: List[tuple] = []  # list.append is atomic, so the workers can share these
+
+    def load(path: Path) -> Source:
+        try:
+            stat = path.stat()
+        except OSError:
+            return Source(path, None)
+        if not path.is_file():
+            return Source(path, None)
+        key = f"{path.resolve()}\0{max_chars}"
+        if cache is not None:
+            row = cache.get_text(key, stat.st_mtime_ns, stat.st_size)
+            if row is not None:
+                hits.append(key)
+                return Source(path, row[0], row[1], cached=True)
+        try:
+            text = read_source(path, max_chars)
+        except OSError:
+            return Source(path, None)
+        text_digest = digest(text)
+        fresh.append((key, stat.st_mtime_ns, stat.st_size, text, text_digest))
+        return Source(path, text, text_digest)
+
+    if len(paths) <= 1:
+        sources = [load(p) for p in paths]
+    else:
+        with ThreadPoolExecutor(max_workers=min(workers, len(paths))) as pool:
+            sources = list(pool.map(load, paths))
+    # Cache writes are batched: one commit per run instead of one per file.
+    if cache is not None:
+        if hits:
+            cache.touch(hits)
+        if fresh:
+            cache.put_texts(fresh)
+    return sources
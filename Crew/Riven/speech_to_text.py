@@ -0,0 +1,110 @@
+"""Pluggable speech-to-text backends for the voice interface.
+
+- `google`  — Google Web Speech through speech_recognition (needs the network)
+- `vosk`    — offline Kaldi model (`pip install vosk`); point `RIVEN_VOSK_MODEL`
+  at an unpacked model folder (default `data/models/vosk`)
+- `whisper` — offline Whisper through speech_recognition
+  (`pip install openai-whisper`); `RIVEN_WHISPER_MODEL` picks the size (default `base`)
+
+`create_stt("auto")` prefers vosk when its model is present, so turn latency
+does not depend on an external service, and falls back to google otherwise.
+"""
+
+from __future__ import annotations
+
+import abc
+import json
+import os
+from typing import Dict, Optional, Type
+
+import speech_recognition as sr
+
+try:
+    import vosk
+except ImportError:  # only needed by the vosk backend
+    vosk = None  # type: ignore
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+VOSK_MODEL_PATH = os.environ.get("RIVEN_VOSK_MODEL") or os.path.join(DATA_DIR, "models", "vosk")
+WHISPER_MODEL = os.environ.get("RIVEN_WHISPER_MODEL", "base")
+
+
+class SpeechToText(abc.ABC):
+    """Turns one utterance into text; None when nothing intelligible was said."""
+
+    name = "base"
+
+    @abc.abstractmethod
+    def transcribe(self, audio: sr.AudioData) -> Optional[str]:
+        ...
+
+
+class GoogleSTT(SpeechToText):
+    name = "google"
+
+    def __init__(self):
+        self.recognizer = sr.Recognizer()
+
+    def transcribe(self, audio: sr.AudioData) -> Optional[str]:
+        try:
+            return self.recognizer.recognize_google(audio)
+        except sr.UnknownValueError:
+            return None
+        except sr.RequestError as e:
+            print(f"[STT] Google request failed: {e}")
+            return None
+
+
+class VoskSTT(SpeechToText):
+    name = "vosk"
+    SAMPLE_RATE = 16000
+
+    def __init__(self, model_path: str = VOSK_MODEL_PATH):
+        if vosk is None:
+            raise RuntimeError("the vosk backend needs vosk (pip install vosk)")
+        if not os.path.isdir(model_path):
+            raise RuntimeError(f"no Vosk model at {model_path} (set RIVEN_VOSK_MODEL)")
+        vosk.SetLogLevel(-1)
+        # Loading the model is the slow part, so it happens once per session.
+        self.model = vosk.Model(model_path)
+
+    def transcribe(self, audio: sr.AudioData) -> Optional[str]:
+        recognizer = vosk.KaldiRecognizer(self.model, self.SAMPLE_RATE)
+        recognizer.AcceptWaveform(audio.get_raw_data(convert_rate=self.SAMPLE_RATE, convert_width=2))
+        text = json.loads(recognizer.FinalResult()).get("text", "").strip()
+        return text or None
+
+
+class WhisperSTT(SpeechToText):
+    name = "whisper"
+
+    def __init__(self, model: str = WHISPER_MODEL):
+        self.model = model
+        # speech_recognition keeps the loaded model on the Recognizer instance.
+        self.recognizer = sr.Recognizer()
+
+    def transcribe(self, audio: sr.AudioData) -> Optional[str]:
+        try:
+            text = self.recognizer.recognize_whisper(audio, model=self.model, language="english")
+        except sr.UnknownValueError:
+            return None
+        return text.strip() or None
+
+
+BACKENDS: Dict[str, Type[SpeechToText]] = {
+    "google": GoogleSTT,
+    "vosk": VoskSTT,
+    "whisper": WhisperSTT,
+}
+
+
+def create_stt(name: str = "auto") -> SpeechToText:
+    if name == "auto":
+        if vosk is not None and os.path.isdir(VOSK_MODEL_PATH):
+            name = "vosk"
+        else:
+            print("[STT] No offline model found; using Google Web Speech.")
+            name = "google"
+    if name not in BACKENDS:
+        raise ValueError(f"unknown speech-to-text backend '{name}' (choose from {', '.join(BACKENDS)})")
+    return BACKENDS[name]()
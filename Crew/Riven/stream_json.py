@@ -0,0 +1,208 @@
+"""Incremental parsing of a JSON object as it streams out of the model.
+
+`IncrementalJSONParser` is fed the response chunk by chunk. It only buffers the
+top-level member currently being written; as soon as a member's value closes it
+is decoded, stored and handed to `on_section`, so completed sections can be
+written out while the model is still generating and nothing holds the whole
+response as one growing string.
+
+`repair_json` is the tolerant mode for output that stops early (timeout, token
+limit): it closes open strings and brackets, dropping a trailing member that
+cannot be completed, and returns whatever decodes.
+"""
+
+from __future__ import annotations
+
+import json
+from typing import Any, Callable, Dict, List, Optional
+
+_CLOSERS = {"{": "}", "[": "]"}
+
+
+def _close(text: str) -> str:
+    """Appends whatever closes the strings and brackets left open in `text`."""
+    stack: List[str] = []
+    in_string = escape = False
+    for ch in text:
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in _CLOSERS:
+            stack.append(_CLOSERS[ch])
+        elif ch in "}]" and stack:
+            stack.pop()
+
+    if in_string:
+        text = (text[:-1] if escape else text) + '"'
+    text = text.rstrip()
+    if text.endswith(":"):
+        text += " null"
+    elif text.endswith(","):
+        text = text[:-1]
+    return text + "".join(reversed(stack))
+
+
+def repair_json(text: str, max_attempts: int = 64) -> Optional[Any]:
+    """Best-effort decode of truncated JSON; None if nothing usable is left."""
+    candidate = text.strip()
+    for _ in range(max_attempts):
+        if not candidate:
+            return None
+        try:
+            return json.loads(_close(candidate))
+        except ValueError:
+            pass
+        # Drop the last (incomplete) element and try again.
+        cut = max(candidate.rfind(","), candidate.rfind("{"), candidate.rfind("["))
+        if cut < 0:
+            return None
+        if candidate[cut] in "{[" and cut < len(candidate) - 1:
+            candidate = candidate[:cut + 1]
+        else:
+            candidate = candidate[:cut]
+    return None
+
+
+class IncrementalJSONParser:
+    """Streams a top-level JSON object, decoding each member as soon as it closes.
+
+    Text before the first bracket is skipped. A top-level array is buffered
+    whole and decoded by `finish()`.
+    """
+
+    def __init__(self, on_section: Optional[Callable[[str, Any], None]] = None):
+        self.on_section = on_section
+        self.sections: Dict[str, Any] = {}
+        self.errors: List[str] = []
+        self.truncated = False
+        self.chars = 0
+        self._state = "start"
+        self._depth = 0  # bracket depth, the top-level object included
+        self._in_string = False
+        self._escape = False
+        self._key: List[str] = []
+        self._value: List[str] = []
+        self._current_key: Optional[str] = None
+
+    @property
+    def done(self) -> bool:
+        return self._state == "done"
+
+    def feed(self, text: str) -> None:
+        self.chars += len(text)
+        for ch in text:
+            self._step(ch)
+
+    def _string_char(self, ch: str) -> bool:
+        """Tracks escapes inside a string; True once the closing quote is consumed."""
+        if self._escape:
+            self._escape = False
+        elif ch == "\\":
+            self._escape = True
+        elif ch == '"':
+            self._in_string = False
+            return True
+        return False
+
+    def _step(self, ch: str) -> None:
+        state = self._state
+        if state == "start":
+            # Chatter before the JSON ("Sure! Here is...") is skipped.
+            if ch == "{":
+                self._depth, self._state = 1, "key_or_end"
+            elif ch == "[":
+                self._state = "other"
+                self._value.append(ch)
+        elif state == "other":
+            self._value.append(ch)
+        elif state == "key_or_end":
+            if ch == '"':
+                self._in_string, self._state = True, "key"
+                self._key = ['"']
+            elif ch == "}":
+                self._depth, self._state = 0, "done"
+        elif state == "key":
+            self._key.append(ch)
+            if self._string_char(ch):
+                self._current_key = json.loads("".join(self._key))
+                self._state = "colon"
+        elif state == "colon":
+            if ch == ":":
+                self._state = "value_start"
+        elif state == "value_start":
+            if ch.isspace():
+                return
+            self._value = [ch]
+            if ch in _CLOSERS:
+                self._depth += 1
+                self._state = "value"
+            elif ch == '"':
+                self._in_string, self._state = True, "value"
+            else:
+                self._state = "scalar"
+        elif state == "value":
+            self._value.append(ch)
+            if self._in_string:
+                if self._string_char(ch) and self._depth == 1:
+                    self._emit()
+            elif ch == '"':
+                self._in_string = True
+            elif ch in _CLOSERS:
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 1:
+                    self._emit()
+        elif state == "scalar":
+            if ch in ",}":
+                self._emit()
+                if ch == "}":
+                    self._depth, self._state = 0, "done"
+            else:
+                self._value.append(ch)
+
+    def _emit(self) -> None:
+        text = "".join(self._value).strip()
+        self._value = []
+        self._state = "key_or_end"
+        try:
+            value = json.loads(text)
+        except ValueError as e:
+            self.errors.append(f"{self._current_key}: {e}")
+            value = repair_json(text)
+            if value is None:
+                return
+        self._store(self._current_key, value)
+
+    def _store(self, key: str, value: Any) -> None:
+        self.sections[key] = value
+        if self.on_section is not None:
+            self.on_section(key, value)
+
+    def finish(self, repair: bool = True) -> Optional[Any]:
+        """The decoded document. Unfinished output is repaired (or dropped with repair=False)."""
+        if self._state == "other":
+            text = "".join(self._value)
+            try:
+                return json.loads(text)
+            except ValueError:
+                self.truncated = True
+                return repair_json(text) if repair else None
+        if self._state == "start":
+            return None
+        if self._state != "done":
+            self.truncated = True
+            if self._state == "scalar":
+                self._emit()
+            elif self._state == "value" and repair:
+                value = repair_json("".join(self._value))
+                if value is not None:
+                    self._store(self._current_key, value)
+            self._state = "done"
+        return self.sections
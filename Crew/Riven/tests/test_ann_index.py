@@ -0,0 +1,104 @@
+import threading
+
+import numpy as np
+import pytest
+
+import ann_index
+from ann_index import IVFIndex
+from rag_engine import EmbeddingMatrix, SimpleRAG
+
+
+def _matrix(n, dim=16, seed=0):
+    matrix = EmbeddingMatrix()
+    for row in np.random.default_rng(seed).standard_normal((n, dim)):
+        matrix.append(row)
+    return matrix
+
+
+def _recall(index, matrix, queries=20):
+    hits = 0
+    for row in range(0, len(matrix), len(matrix) // queries):
+        query = matrix.take(np.array([row]))[0][0]
+        hits += row in set(index.candidates(query).tolist())
+    return hits / queries
+
+
+def test_training_in_blocks_matches_every_row(tmp_path, monkeypatch):
+    monkeypatch.setattr(ann_index, "_ASSIGN_CHUNK", 64)
+    matrix = _matrix(2000)
+    index = IVFIndex(str(tmp_path / "brain.ivf.npz"), nprobe=8)
+    index.train(matrix, sample_size=500)
+    assert len(index.assignments) == 2000
+    assert _recall(index, matrix) == 1.0
+
+    index.save()
+    reloaded = IVFIndex(index.path, nprobe=8)
+    assert reloaded.load(2000)
+    np.testing.assert_array_equal(reloaded.assignments, index.assignments)
+
+
+def test_add_grows_the_assignments_without_copying_per_row(tmp_path):
+    matrix = _matrix(500)
+    index = IVFIndex(str(tmp_path / "brain.ivf.npz"))
+    index.train(matrix)
+    buffers = set()
+    for row in np.random.default_rng(1).standard_normal((300, 16)):
+        matrix.append(row)
+        index.add(len(matrix) - 1, row)
+        buffers.add(id(index._buffer))
+    assert len(index.assignments) == 800
+    assert len(buffers) <= 2
+    assert _recall(index, matrix) == 1.0
+
+
+def test_background_training_is_installed_by_poll(tmp_path):
+    matrix = _matrix(1000)
+    index = IVFIndex(str(tmp_path / "brain.ivf.npz"))
+    index.train_async(matrix)
+    index._trainer.join(30)
+    for row in np.random.default_rng(2).standard_normal((10, 16)):
+        matrix.append(row)
+    assert not index.ready
+    assert index.poll(matrix)
+    assert index.ready and index.trained_rows == 1000
+    assert len(index.assignments) == 1010
+
+
+def test_concurrent_searches_install_the_trained_index_once(tmp_path):
+    matrix = _matrix(1000)
+    index = IVFIndex(str(tmp_path / "brain.ivf.npz"))
+    index.train_async(matrix)
+    index._trainer.join(30)
+    start = threading.Barrier(4)
+    installed, found = [], []
+
+    def search(row):
+        query = matrix.take(np.array([row]))[0][0]
+        start.wait()
+        installed.append(index.poll(matrix))
+        if index.ready:
+            found.append(row in set(index.candidates(query).tolist()))
+
+    threads = [threading.Thread(target=search, args=(row,)) for row in (0, 250, 500, 750)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+    assert sorted(installed) == [False, False, False, True]
+    assert found == [True] * 4
+
+
+def test_compaction_does_not_train_synchronously(tmp_path, monkeypatch):
+    vectors = {f"note {i}": list(v) for i, v in enumerate(np.random.default_rng(3).standard_normal((40, 16)))}
+    monkeypatch.setattr(SimpleRAG, "get_embeddings", lambda self, texts, batch_size=None: [vectors[t] for t in texts])
+
+    def fail(*args, **kwargs):
+        raise AssertionError("trained on the compaction path")
+    monkeypatch.setattr(IVFIndex, "train", fail)
+
+    rag = SimpleRAG(str(tmp_path / "brain.json"), embedding_cache=False, index="ivf", ann_min_rows=20)
+    assert all(rag.ingest_many(list(vectors)))
+    rag._ann._trainer.join(30)
+    hit = rag.search(vectors["note 7"], k=1)[0]
+    assert hit["text"] == "note 7" and hit["score"] == pytest.approx(1.0)
+    assert rag._ann.ready
@@ -0,0 +1,65 @@
+import asyncio
+import gc
+import threading
+
+import pytest
+
+pytest.importorskip("httpx")
+
+import ollama_client
+from ollama_client import get_async_client
+from rag_engine import SimpleRAG
+
+
+def test_async_clients_are_shared_per_loop_and_host():
+    async def clients():
+        first = get_async_client("http://ollama.test:11434/")
+        assert get_async_client("http://ollama.test:11434") is first
+        assert get_async_client("http://other.test:11434") is not first
+        return first
+
+    first = asyncio.run(clients())
+    second = asyncio.run(clients())
+    assert first is not second
+
+
+def test_a_collected_loop_takes_its_clients_with_it():
+    async def connect():
+        get_async_client("http://ollama.test:11434")
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(connect())
+    assert loop in ollama_client._async_clients
+    loop.close()
+    del loop
+    gc.collect()
+    assert len(ollama_client._async_clients) == 0
+
+
+def test_aquery_keeps_sqlite_and_the_search_off_the_loop(tmp_path, monkeypatch):
+    threads = {}
+
+    def record(name, method):
+        def wrapper(self, *args, **kwargs):
+            threads.setdefault(name, threading.current_thread())
+            return method(self, *args, **kwargs)
+        return wrapper
+
+    async def aembed_batch(self, texts):
+        return "phi", [[1.0, 0.0] if "alpha" in t else [0.0, 1.0] for t in texts]
+
+    monkeypatch.setattr(SimpleRAG, "_aembed_batch", aembed_batch)
+    monkeypatch.setattr(SimpleRAG, "get_embeddings", lambda self, texts, batch_size=None: [[1.0, 0.0] for _ in texts])
+    monkeypatch.setattr(SimpleRAG, "_cached_embeddings", record("cache", SimpleRAG._cached_embeddings))
+    monkeypatch.setattr(SimpleRAG, "search", record("search", SimpleRAG.search))
+
+    rag = SimpleRAG(str(tmp_path / "brain.json"))
+    assert rag.ingest("alpha doc")
+
+    async def main():
+        return threading.current_thread(), await rag.aquery("alpha?", k=1)
+
+    loop_thread, hits = asyncio.run(main())
+    assert hits[0]["text"] == "alpha doc"
+    assert threads["cache"] is not loop_thread
+    assert threads["search"] is not loop_thread
@@ -0,0 +1,34 @@
+import os
+
+import pytest
+
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+pytest.importorskip("pygame")
+pytest.importorskip("speech_recognition")
+
+from audio_engine import AudioPlayer
+
+
+@pytest.fixture
+def player():
+    try:
+        player = AudioPlayer()
+    except Exception as e:  # no audio device, not even the dummy one
+        pytest.skip(f"pygame mixer unavailable: {e}")
+    yield player
+    player.close()
+
+
+def test_a_clip_from_before_a_stop_is_dropped(player):
+    generation = player.generation
+    player.stop()  # barge-in
+    assert not player.play(b"late clip", generation=generation)
+    assert not player.busy
+
+
+def test_a_clip_of_the_current_generation_is_queued(player, monkeypatch):
+    played = []
+    monkeypatch.setattr(player, "_play_one", lambda generation, data, hint: played.append(data))
+    assert player.play(b"clip", generation=player.generation)
+    assert player.wait_idle(2)
+    assert played == [b"clip"]
@@ -0,0 +1,82 @@
+import json
+import sys
+
+import numpy as np
+import pytest
+
+import bulk_ingest
+from rag_engine import SimpleRAG
+
+
+@pytest.fixture
+def embed(monkeypatch):
+    """Fake embeddings; texts mentioning 'unembeddable' fail like an Ollama error."""
+    def get_embeddings(self, texts, batch_size=None):
+        return [
+            [] if "unembeddable" in t else list(np.random.default_rng(len(t) * 7919 + sum(map(ord, t))).standard_normal(8))
+            for t in texts
+        ]
+    monkeypatch.setattr(SimpleRAG, "get_embeddings", get_embeddings)
+
+
+def _dump(path, *summaries):
+    papers = [{"title": f"Paper {i}", "summary": s, "link": f"http://arxiv.org/{path.name}/{i}"} for i, s in enumerate(summaries)]
+    path.write_text(json.dumps(papers), encoding="utf-8")
+
+
+def _run(tmp_path, monkeypatch, *extra):
+    argv = [
+        "bulk_ingest.py",
+        "--brain", str(tmp_path / "brain.json"),
+        "--raw", str(tmp_path / "raw"),
+        "--processed", str(tmp_path / "processed"),
+        *extra,
+    ]
+    monkeypatch.setattr(sys, "argv", argv)
+    bulk_ingest.main()
+    checkpoint = tmp_path / "brain.ingest_checkpoint.json"
+    return json.loads(checkpoint.read_text(encoding="utf-8"))["done"]
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    raw = tmp_path / "raw"
+    raw.mkdir()
+    (tmp_path / "processed").mkdir()
+    _dump(raw / "good.json", "Warp field harmonics in subspace.", "Dilithium lattice resonance.")
+    _dump(raw / "broken.json", "Tachyon pulses.", "An unembeddable abstract.")
+    _dump(raw / "copies.json", "Warp field harmonics in subspace.")
+    (tmp_path / "processed" / "report.md").write_text("# Report\n\nThe nebula is stable.\n", encoding="utf-8")
+    return raw
+
+
+def test_only_fully_embedded_files_are_checkpointed(tmp_path, monkeypatch, embed, corpus):
+    done = _run(tmp_path, monkeypatch)
+    names = {key.rsplit("/", 1)[-1].rsplit("\\", 1)[-1] for key in done}
+    # copies.json only held a duplicate: nothing to embed, but nothing missing either.
+    assert names == {"good.json", "copies.json", "report.md"}
+    assert SimpleRAG(str(tmp_path / "brain.json"), embedding_cache=False).store.count == 4
+
+
+def test_a_rerun_retries_only_incomplete_files(tmp_path, monkeypatch, embed, corpus, capsys):
+    _run(tmp_path, monkeypatch)
+    capsys.readouterr()
+    _run(tmp_path, monkeypatch)
+    out = capsys.readouterr().out
+    assert "1 files, 2 chunks (0 new)" in out
+    assert "1 files had chunks that could not be embedded" in out
+
+    _dump(corpus / "broken.json", "Tachyon pulses.", "A repaired abstract.")
+
+    done = _run(tmp_path, monkeypatch)
+    out = capsys.readouterr().out
+    assert "1 files, 2 chunks (1 new)" in out
+    assert "3 unchanged files skipped" in out
+    assert len(done) == 4
+    assert SimpleRAG(str(tmp_path / "brain.json"), embedding_cache=False).store.count == 5
+
+
+def test_checkpoints_are_written_per_commit(tmp_path, monkeypatch, embed, corpus):
+    done = _run(tmp_path, monkeypatch, "--commit-every", "1")
+    assert len(done) == 3
+    assert _run(tmp_path, monkeypatch, "--restart") == done
@@ -0,0 +1,103 @@
+from pathlib import Path
+
+import pytest
+
+from chunker import chunk_document, chunk_text, collapse_by_parent, count_tokens, truncate_tokens
+
+RIVEN_DIR = Path(__file__).resolve().parents[1]
+
+
+def _markdown(sections=6, sentences=40):
+    parts = ["Intro paragraph before any heading.\n\n"]
+    for s in range(sections):
+        parts.append(f"{'#' * (1 + s % 3)} Section {s}\n\n")
+        parts.append(" ".join(f"Sentence {i} of section {s} talks about warp cores." for i in range(sentences)))
+        parts.append("\n\n")
+    return "".join(parts)
+
+
+def _assert_offsets(text, chunks):
+    assert chunks
+    for chunk in chunks:
+        assert 0 <= chunk.start < chunk.end <= len(text)
+        assert text[chunk.start:chunk.end] == chunk.text
+        assert chunk.text.strip()
+
+
+@pytest.mark.parametrize("max_tokens,overlap", [(256, 48), (64, 16), (32, 0)])
+def test_offsets_match_text_in_multi_section_markdown(max_tokens, overlap):
+    text = _markdown()
+    chunks = chunk_text(text, max_tokens=max_tokens, overlap=overlap)
+    _assert_offsets(text, chunks)
+    assert {c.section for c in chunks} >= {None, "Section 0"}
+    assert all(count_tokens(c.text) <= max_tokens for c in chunks)
+
+
+@pytest.mark.parametrize("name", ["README.md", "riven_continuous_deepdive_prompt.md"])
+def test_offsets_on_repo_documents(name):
+    path = RIVEN_DIR / name
+    if not path.exists():
+        pytest.skip(f"{name} not present")
+    text = path.read_text(encoding="utf-8")
+    _assert_offsets(text, chunk_text(text, max_tokens=64, overlap=16))
+
+
+def test_windows_cover_every_token():
+    text = _markdown(sections=2, sentences=80)
+    chunks = chunk_text(text, max_tokens=50, overlap=10, markdown=False)
+    covered = 0
+    for chunk in chunks:
+        assert chunk.start <= max(covered, chunk.start)
+        covered = max(covered, chunk.end)
+    assert covered == len(text.rstrip())
+
+
+def test_overlap_must_be_smaller_than_window():
+    with pytest.raises(ValueError):
+        chunk_text("a b c", max_tokens=4, overlap=4)
+
+
+def test_chunk_document_metadata():
+    text = _markdown(sections=2)
+    texts, metadatas = chunk_document(text, {"title": "T"}, "doc-1", max_tokens=64, overlap=8)
+    assert len(texts) == len(metadatas)
+    for i, (chunk, meta) in enumerate(zip(texts, metadatas)):
+        assert meta["title"] == "T" and meta["parent_id"] == "doc-1"
+        assert meta["chunk"] == i and meta["chunks"] == len(texts)
+        assert text[meta["start"]:meta["end"]] == chunk
+
+
+def test_collapse_merges_overlapping_chunks_verbatim():
+    text = _markdown(sections=1, sentences=60)
+    texts, metadatas = chunk_document(text, None, "p", max_tokens=40, overlap=10, markdown=False)
+    hits = [{"id": f"c{i}", "text": t, "metadata": m, "score": 0.5} for i, (t, m) in enumerate(zip(texts, metadatas))]
+    hits[1]["score"] = 0.9
+    collapsed = collapse_by_parent(hits[:3], k=5)
+    assert len(collapsed) == 1
+    assert collapsed[0]["chunks"] == 3
+    assert collapsed[0]["score"] == 0.9
+    assert collapsed[0]["text"] == text[metadatas[0]["start"]:metadatas[2]["end"]]
+
+
+def test_collapse_joins_chunks_only_across_whitespace():
+    text = _markdown(sections=2, sentences=20)
+    texts, metadatas = chunk_document(text, None, "p", max_tokens=40, overlap=0)
+    hits = [{"id": f"c{i}", "text": t, "metadata": m, "score": 0.5} for i, (t, m) in enumerate(zip(texts, metadatas))]
+    collapsed = collapse_by_parent([hits[0], hits[1], hits[3]], k=5)
+    assert collapsed[0]["text"] == text[metadatas[0]["start"]:metadatas[1]["end"]] + " … " + texts[3]
+
+
+def test_collapse_marks_a_short_gap_that_is_not_whitespace():
+    text = "Warp core stable. OK. Shields up."
+    hits = [
+        {"id": "a", "text": "Warp core stable.", "score": 0.9, "metadata": {"parent_id": "p", "start": 0, "end": 17, "leading_space": None}},
+        {"id": "b", "text": "Shields up.", "score": 0.5, "metadata": {"parent_id": "p", "start": 22, "end": 33, "leading_space": " "}},
+    ]
+    assert text[hits[1]["metadata"]["start"]:] == "Shields up."
+    assert collapse_by_parent(hits, k=1)[0]["text"] == "Warp core stable. … Shields up."
+
+
+def test_truncate_tokens():
+    assert truncate_tokens("one, two three", 2) == "one,"
+    assert truncate_tokens("one two", 10) == "one two"
+    assert truncate_tokens("one two", 0) == ""
@@ -0,0 +1,120 @@
+import pytest
+
+from chunker import chunk_text, count_tokens
+from context_builder import (
+    MIN_TRIM_TOKENS,
+    ContextItem,
+    bm25_scores,
+    build_context,
+    context_window,
+    documents_to_items,
+    hits_to_items,
+)
+
+
+def _words(n, word="warp"):
+    return " ".join(f"{word}{i}" for i in range(n))
+
+
+@pytest.mark.parametrize("budget", [0, 10, 60, 200, 1000])
+def test_the_budget_is_never_exceeded(budget):
+    items = [ContextItem(_words(40, f"w{i}_"), score=float(i), header=f"## Note {i}", group=str(i)) for i in range(10)]
+    packed = build_context(items, budget)
+    assert packed.tokens == count_tokens(packed.text) <= budget
+    assert packed.included + packed.dropped == len(items)
+
+
+def test_best_items_are_packed_first():
+    items = [ContextItem(_words(30, f"w{i}_"), score=s) for i, s in enumerate([0.1, 0.9, 0.5])]
+    packed = build_context(items, 70)
+    assert packed.included == 2 and packed.dropped == 1
+    assert packed.text.index("w1_0") < packed.text.index("w2_0")
+    assert "w0_0" not in packed.text
+
+
+def test_an_overflowing_item_is_trimmed_to_fit():
+    packed = build_context([ContextItem(_words(500))], 100)
+    assert packed.included == 1
+    assert packed.tokens <= 100
+    assert packed.text.startswith("warp0 warp1")
+
+
+def test_no_trim_below_the_minimum():
+    items = [ContextItem(_words(50, "a"), score=1.0), ContextItem(_words(500, "b"), score=0.5)]
+    packed = build_context(items, 50 + MIN_TRIM_TOKENS - 1)
+    assert packed.included == 1 and "b0" not in packed.text
+
+
+def test_duplicates_are_paid_for_once():
+    text = _words(30)
+    packed = build_context([ContextItem(text, 1.0), ContextItem(text.upper(), 0.9), ContextItem(text[:40], 0.8)], 1000)
+    assert packed.included == 1 and packed.dropped == 2
+    assert packed.tokens == count_tokens(text)
+
+
+def test_overlapping_chunks_only_cost_their_new_tokens():
+    document = ". ".join(_words(12, f"s{i}_") for i in range(20)) + "."
+    chunks = chunk_text(document, max_tokens=64, overlap=24)
+    items = [ContextItem(c.text, score=1.0, group="doc", header="# Doc", start=c.start, end=c.end) for c in chunks]
+    packed = build_context(items, 10_000)
+    assert packed.included == len(chunks)
+    # Merged back into the document, not repeated chunk by chunk.
+    assert packed.text == "# Doc\n" + document[chunks[0].start:chunks[-1].end]
+
+
+def test_groups_share_one_header_in_document_order():
+    items = [
+        ContextItem("second part", score=0.9, group="a", header="# A", start=100, end=111),
+        ContextItem("other note", score=0.5, group="b", header="# B"),
+        ContextItem("first part", score=0.2, group="a", header="# A", start=0, end=10),
+    ]
+    packed = build_context(items, 1000)
+    assert packed.text == "# A\nfirst part … second part\n\n# B\nother note"
+
+
+def test_only_whitespace_between_chunks_is_joined_without_a_marker():
+    document = "\n\n".join(_words(40, f"p{i}_") for i in range(4))
+    items = documents_to_items([("# Doc", document)], max_tokens=40)
+    assert len(items) == 4
+    packed = build_context([items[0], items[1], items[3]], 1000)
+    assert packed.text == "# Doc\n" + document[:items[1].end] + " … " + items[3].text
+
+
+def test_a_short_gap_that_is_not_whitespace_is_marked():
+    items = [
+        ContextItem("Warp core stable.", group="a", start=0, end=17),
+        ContextItem("Shields up.", group="a", start=22, end=33, leading_space=" "),
+    ]
+    assert build_context(items, 1000).text == "Warp core stable. … Shields up."
+
+
+def test_documents_to_items_ranks_by_bm25():
+    items = documents_to_items([("# Plasma", "Plasma conduits overheat."), ("# Warp", "The warp core hums softly.")], query="warp core")
+    best = max(items, key=lambda i: i.score)
+    assert best.header == "# Warp"
+    packed = build_context(items, 1000)
+    assert packed.text.startswith("# Warp")
+
+
+def test_bm25_scores():
+    scores = bm25_scores("warp", ["warp warp drive", "warp", "impulse"])
+    assert scores[2] == 0.0 and scores[0] > 0 and scores[1] > 0
+    assert bm25_scores("", ["warp"]) == [0.0]
+
+
+def test_hits_to_items_keeps_offsets_only_for_single_chunks():
+    hits = [
+        {"id": "doc_1", "text": "x", "score": 0.8, "metadata": {"parent_id": "p", "start": 5, "end": 6}},
+        {"id": "doc_2", "text": "y … z", "score": 0.7, "chunks": 2, "metadata": {"parent_id": "q", "start": 0, "end": 9}},
+    ]
+    first, second = hits_to_items(hits, header=lambda h: h["id"])
+    assert (first.group, first.start, first.end, first.header) == ("p", 5, 6, "doc_1")
+    assert (second.group, second.start) == ("q", None)
+
+
+def test_context_window(monkeypatch):
+    monkeypatch.delenv("RIVEN_CONTEXT_TOKENS", raising=False)
+    assert context_window("riven:latest") == 16384
+    assert context_window("unknown") == 4096
+    monkeypatch.setenv("RIVEN_CONTEXT_TOKENS", "2048")
+    assert context_window("riven") == 2048
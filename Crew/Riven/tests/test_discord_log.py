@@ -0,0 +1,109 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("requests")
+
+from discord_log import DiscordDispatcher
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        server = self.server
+        server.requests.append({
+            "at": time.monotonic(),
+            "path": self.path,
+            "auth": self.headers.get("Authorization"),
+            "json": json.loads(body) if self.headers.get("Content-Type") == "application/json" else None,
+        })
+        status, reply = server.replies.pop(0) if server.replies else (200, {"id": "1"})
+        data = json.dumps(reply).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def discord():
+    """A local stand-in for the Discord API; replies are (status, json) pairs, then 200s."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.requests, server.replies = [], []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server.api_base = f"http://127.0.0.1:{server.server_address[1]}/api/v9"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _dispatcher(discord, **kwargs):
+    return DiscordDispatcher("t0ken", "42", api_base=discord.api_base, **kwargs)
+
+
+def _contents(discord):
+    return [r["json"]["content"] for r in discord.requests]
+
+
+def test_a_burst_goes_out_as_one_post(discord):
+    dispatcher = _dispatcher(discord, coalesce_s=0.2)
+    for line in ("one", "two", "three"):
+        assert dispatcher.send(line)
+    assert dispatcher.flush(5)
+    assert _contents(discord) == ["one\ntwo\nthree"]
+    assert discord.requests[0]["path"] == "/api/v9/channels/42/messages"
+    assert discord.requests[0]["auth"] == "Bot t0ken"
+    assert dispatcher.posts == 1
+    dispatcher.close()
+
+
+def test_a_429_is_retried_after_retry_after(discord):
+    discord.replies.append((429, {"retry_after": 0.3}))
+    dispatcher = _dispatcher(discord, coalesce_s=0)
+    dispatcher.send("hello")
+    assert dispatcher.flush(5)
+    assert _contents(discord) == ["hello", "hello"]
+    assert discord.requests[1]["at"] - discord.requests[0]["at"] >= 0.3
+    assert dispatcher.posts == 1
+    dispatcher.close()
+
+
+def test_overflow_is_counted_and_reported_in_the_next_post(discord):
+    dispatcher = _dispatcher(discord, max_queue=2, coalesce_s=0.3)
+    sent = [dispatcher.send(f"m{i}") for i in range(5)]  # all inside one coalescing window
+    assert sent == [True, True, False, False, False]
+    assert dispatcher.dropped == 3
+    assert dispatcher.flush(5)
+    assert _contents(discord) == ["[3 log messages dropped: queue full]\nm0\nm1"]
+    dispatcher.send("later")
+    assert dispatcher.flush(5)
+    assert _contents(discord)[-1] == "later"
+    dispatcher.close()
+
+
+def test_close_posts_what_is_queued_without_waiting_out_the_window(discord):
+    dispatcher = _dispatcher(discord, coalesce_s=30)
+    dispatcher.send("last words")
+    started = time.monotonic()
+    dispatcher.close(5)
+    assert time.monotonic() - started < 5
+    assert not dispatcher._thread.is_alive()
+    assert _contents(discord) == ["last words"]
+    assert not dispatcher.send("too late")
+    assert dispatcher.dropped == 1
+
+
+def test_flush_times_out_while_the_window_is_open(discord):
+    dispatcher = _dispatcher(discord, coalesce_s=1.0)
+    dispatcher.send("pending")
+    assert not dispatcher.flush(0.1)
+    assert dispatcher.flush(5)
+    assert _contents(discord) == ["pending"]
+    dispatcher.close()
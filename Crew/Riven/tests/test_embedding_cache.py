@@ -0,0 +1,34 @@
+import pytest
+
+import rag_engine
+from rag_engine import SimpleRAG
+
+
+@pytest.fixture
+def rag(tmp_path, monkeypatch):
+    calls = []
+
+    def embed_batch(self, texts):
+        calls.append(list(texts))
+        return self.answering_model, [[float(len(t)), 1.0] for t in texts]
+
+    monkeypatch.setattr(SimpleRAG, "_embed_batch", embed_batch)
+    brain = SimpleRAG(str(tmp_path / "brain.json"))
+    brain.calls = calls
+    return brain
+
+
+@pytest.mark.parametrize("model", [rag_engine.EMBEDDING_MODEL, f"{rag_engine.EMBEDDING_MODEL}:latest"])
+def test_primary_model_embeddings_are_reused(rag, model):
+    rag.answering_model = model
+    first = rag.get_embeddings(["warp core", "nebula"])
+    assert rag.get_embeddings(["nebula", "warp core"]) == first[::-1]
+    assert rag.calls == [["warp core", "nebula"]]
+
+
+def test_fallback_model_embeddings_are_not_cached(rag):
+    rag.answering_model = rag_engine.FALLBACK_EMBEDDING_MODEL
+    rag.get_embeddings(["warp core"])
+    rag.get_embeddings(["warp core"])
+    assert rag.calls == [["warp core"], ["warp core"]]
+    assert rag.embedding_cache.get_many(rag_engine.FALLBACK_EMBEDDING_MODEL, ["warp core"]) == [None]
@@ -0,0 +1,59 @@
+import json
+
+import pytest
+
+import generation_cache
+from generation_cache import GenerationCache, cached_generate
+
+
+class FakeClient:
+    """Answers /api/tags and /api/generate like Ollama would, without a server."""
+
+    base_url = "http://ollama.test:11434"
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def tags(self):
+        return {"riven:latest": "sha256:abc"}
+
+    def generate(self, prompt, models, **options):
+        self.calls += 1
+        return {"model": "riven", "response": self.responses.pop(0), "done": True}
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(generation_cache, "_digests", {})
+    return GenerationCache(str(tmp_path / "cache.sqlite"))
+
+
+def _valid(text):
+    try:
+        json.loads(text)
+        return True
+    except ValueError:
+        return False
+
+
+def test_a_stored_response_is_reused(cache):
+    client = FakeClient(['[{"speaker": "Mal"}]'])
+    first = cached_generate(client, "prompt", "riven", cache, validate=_valid, format="json")
+    second = cached_generate(client, "prompt", "riven", cache, validate=_valid, format="json")
+    assert second["cached"] and second["response"] == first["response"]
+    assert client.calls == 1
+
+
+def test_a_response_that_fails_validation_is_not_stored(cache):
+    client = FakeClient(["Sorry, I cannot [do that", '[{"speaker": "Mal"}]'])
+    assert cached_generate(client, "prompt", "riven", cache, validate=_valid)["response"].startswith("Sorry")
+    retry = cached_generate(client, "prompt", "riven", cache, validate=_valid)
+    assert not retry.get("cached") and retry["response"] == '[{"speaker": "Mal"}]'
+    assert client.calls == 2
+
+
+def test_options_are_part_of_the_key(cache):
+    client = FakeClient(["a", "b"])
+    cached_generate(client, "prompt", "riven", cache, format="json")
+    assert cached_generate(client, "prompt", "riven", cache)["response"] == "b"
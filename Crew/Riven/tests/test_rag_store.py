@@ -0,0 +1,234 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from rag_engine import SimpleRAG
+from rag_store import BrainStore, StaleStoreError, WriteAheadLog
+
+RIVEN_DIR = Path(__file__).resolve().parents[1]
+
+VECTORS = {
+    "alpha doc": [1.0, 0.0, 0.0, 0.0],
+    "beta doc": [0.0, 1.0, 0.0, 0.0],
+    "gamma doc": [0.0, 0.0, 1.0, 0.0],
+    "delta doc": [0.0, 0.0, 0.0, 1.0],
+}
+
+
+def _records(*texts):
+    return [{"id": f"doc_{i + 1}", "text": t, "metadata": {"n": i}} for i, t in enumerate(texts)]
+
+
+@pytest.fixture
+def fake_embeddings(monkeypatch):
+    """Embeds from VECTORS instead of asking Ollama; unknown texts fail to embed."""
+    def get_embeddings(self, texts, batch_size=None):
+        return [list(VECTORS.get(t, [])) for t in texts]
+    monkeypatch.setattr(SimpleRAG, "get_embeddings", get_embeddings)
+
+
+def _brain(tmp_path, **kwargs):
+    return SimpleRAG(str(tmp_path / "brain.json"), embedding_cache=False, **kwargs)
+
+
+def test_store_append_round_trip(tmp_path):
+    base = str(tmp_path / "brain")
+    store = BrainStore(base)
+    store.append(_records("alpha doc", "beta doc"), np.array([VECTORS["alpha doc"], VECTORS["beta doc"]]))
+    store.close()
+
+    store = BrainStore(base)
+    assert store.count == 2 and store.dim == 4
+    np.testing.assert_array_equal(store.vectors()[1], VECTORS["beta doc"])
+    np.testing.assert_allclose(store.norms(), [1.0, 1.0])
+    docs = store.get_documents([1, 0])
+    assert [d["text"] for d in docs] == ["beta doc", "alpha doc"]
+    assert docs[0]["metadata"] == {"n": 1}
+
+
+def test_store_append_rejects_a_stale_first_row(tmp_path):
+    base = str(tmp_path / "brain")
+    first, second = BrainStore(base), BrainStore(base)
+    first.append(_records("alpha doc"), np.array([VECTORS["alpha doc"]]), expected_first=0)
+    with pytest.raises(StaleStoreError):
+        second.append(_records("beta doc"), np.array([VECTORS["beta doc"]]), expected_first=0)
+    assert second.refresh() == 1
+    second.append(_records("beta doc"), np.array([VECTORS["beta doc"]]), expected_first=1)
+    assert [d["text"] for d in first.get_documents([0, 1])] == ["alpha doc", "beta doc"]
+
+
+def test_store_ignores_vectors_of_an_uncommitted_append(tmp_path):
+    base = str(tmp_path / "brain")
+    store = BrainStore(base)
+    store.append(_records("alpha doc"), np.array([VECTORS["alpha doc"]]))
+    with open(store.vectors_path, "ab") as f:
+        f.write(np.array(VECTORS["beta doc"], dtype=np.float32).tobytes())
+    store.close()
+    store = BrainStore(base)
+    assert store.count == 1
+    assert store.vectors().shape == (1, 4)
+
+
+def test_wal_replay_skips_committed_rows_and_drops_a_torn_tail(tmp_path):
+    wal = WriteAheadLog(str(tmp_path / "brain.wal"))
+    vectors = np.array([VECTORS["alpha doc"], VECTORS["beta doc"]])
+    wal.append([0, 1], _records("alpha doc", "beta doc"), vectors)
+    with open(wal.path, "a", encoding="utf-8") as f:
+        f.write('{"row": 2, "id": "doc_3", "te')
+
+    records, replayed = wal.replay(first_row=1)
+    assert [r["text"] for r in records] == ["beta doc"]
+    np.testing.assert_array_equal(replayed[0], VECTORS["beta doc"])
+    with open(wal.path, encoding="utf-8") as f:
+        assert len(f.read().splitlines()) == 2
+
+    wal.reset()
+    assert wal.replay(first_row=0) == ([], [])
+
+
+def test_wal_records_survive_a_restart_and_compact_once(tmp_path, fake_embeddings):
+    rag = _brain(tmp_path, compact_every=100)
+    assert rag.ingest("alpha doc", {"source": "a"})
+    assert rag.store.count == 0
+
+    reopened = _brain(tmp_path)
+    assert len(reopened) == 1
+    assert reopened.search(VECTORS["alpha doc"], k=1)[0]["metadata"] == {"source": "a"}
+    reopened.compact()
+    assert reopened.store.count == 1
+    assert reopened.wal.replay(first_row=0) == ([], [])
+
+    fresh = _brain(tmp_path)
+    assert len(fresh) == 1
+    assert fresh.search(VECTORS["alpha doc"], k=1)[0]["text"] == "alpha doc"
+
+
+def test_ingest_many_compacts_into_the_store(tmp_path, fake_embeddings):
+    rag = _brain(tmp_path)
+    assert rag.ingest_many(["alpha doc", "alpha doc", "unknown", "beta doc"]) == [True, False, False, True]
+    assert rag.store.count == 2
+    assert not rag._pending
+    hit = _brain(tmp_path).search(VECTORS["beta doc"], k=1)[0]
+    assert (hit["text"], hit["score"]) == ("beta doc", pytest.approx(1.0))
+
+
+def test_two_writers_on_one_brain_keep_rows_aligned(tmp_path, fake_embeddings):
+    first, second = _brain(tmp_path), _brain(tmp_path)
+    assert first.ingest("alpha doc")
+    first.compact()
+    assert second.ingest("beta doc")
+    second.compact()
+
+    for rag in (second, _brain(tmp_path)):
+        assert len(rag) == 2
+        for text in ("alpha doc", "beta doc"):
+            hit = rag.search(VECTORS[text], k=1)[0]
+            assert (hit["text"], hit["score"]) == (text, pytest.approx(1.0))
+    ids = [doc["id"] for doc in rag.store.get_documents([0, 1])]
+    assert len(set(ids)) == 2
+
+
+def test_compact_rebases_after_a_writer_that_bypassed_the_lock(tmp_path, fake_embeddings, monkeypatch):
+    rag = _brain(tmp_path)
+    assert rag.ingest("beta doc")
+    BrainStore(str(tmp_path / "brain")).append(_records("alpha doc"), np.array([VECTORS["alpha doc"]]))
+    monkeypatch.setattr(rag, "_sync_locked", lambda: None)
+    rag.compact()
+
+    assert [d["text"] for d in rag.store.get_documents([0, 1])] == ["alpha doc", "beta doc"]
+    assert rag.search(VECTORS["beta doc"], k=1)[0]["text"] == "beta doc"
+
+
+def test_a_second_instance_does_not_compact_the_first_ones_log_again(tmp_path, fake_embeddings):
+    first = _brain(tmp_path)
+    assert first.ingest("alpha doc")
+    second = _brain(tmp_path)
+    assert len(second) == 1
+    first.compact()
+    second.compact()
+
+    store = _brain(tmp_path).store
+    assert store.count == 1
+    assert store.get_documents([0])[0]["text"] == "alpha doc"
+
+
+def test_writers_number_logged_rows_after_each_other(tmp_path, fake_embeddings):
+    first, second = _brain(tmp_path), _brain(tmp_path)
+    assert first.ingest("alpha doc")
+    assert second.ingest("beta doc")
+    assert first.ingest("gamma doc")
+    assert not second.ingest("alpha doc")  # logged by the other writer
+    assert [row for row, _, _ in first.wal.read()[0]] == [0, 1, 2]
+
+    second.compact()  # folds every logged record, not only its own
+    assert second.store.count == 3
+    first.compact()
+    assert first.store.count == 3
+
+    rag = _brain(tmp_path)
+    ids = [d["id"] for d in rag.store.get_documents([0, 1, 2])]
+    assert len(set(ids)) == 3
+    for text in ("alpha doc", "beta doc", "gamma doc"):
+        assert rag.search(VECTORS[text], k=1)[0]["text"] == text
+
+
+def test_compaction_keeps_records_another_writer_logged(tmp_path, fake_embeddings):
+    first, second = _brain(tmp_path), _brain(tmp_path)
+    assert first.ingest("alpha doc")
+    assert second.ingest("beta doc")
+    first.compact()
+    assert first.store.count == 2
+    assert _brain(tmp_path).search(VECTORS["beta doc"], k=1)[0]["text"] == "beta doc"
+
+
+def test_replay_skips_records_already_committed(tmp_path, fake_embeddings):
+    rag = _brain(tmp_path)
+    assert rag.ingest("alpha doc")
+    # As if the process died between the store commit and the log reset, with the
+    # committed row renumbered (the log entry claims row 1).
+    entries, _ = rag.wal.read()
+    row, record, vector = entries[0]
+    rag.store.append([record], vector[None, :])
+    rag.wal.reset()
+    rag.wal.append([1], [record], vector[None, :])
+
+    reopened = _brain(tmp_path)
+    assert len(reopened) == 1 and not reopened._pending
+
+
+_WRITER = """
+import sys
+import numpy as np
+from rag_engine import SimpleRAG
+
+def get_embeddings(self, texts, batch_size=None):
+    return [list(np.random.default_rng(abs(hash(t)) % 2**32).standard_normal(8)) for t in texts]
+
+SimpleRAG.get_embeddings = get_embeddings
+rag = SimpleRAG(sys.argv[1], embedding_cache=False, compact_every=7)
+for i in range(40):
+    rag.ingest(f"{sys.argv[2]} note {i}")
+"""
+
+
+def test_concurrent_processes_share_one_brain(tmp_path):
+    env = {**os.environ, "PYTHONPATH": str(RIVEN_DIR), "PYTHONHASHSEED": "0"}
+    brain = str(tmp_path / "brain.json")
+    procs = [
+        subprocess.Popen([sys.executable, "-c", _WRITER, brain, name], env=env, stdout=subprocess.DEVNULL)
+        for name in ("first", "second", "third")
+    ]
+    assert [p.wait(timeout=60) for p in procs] == [0, 0, 0]
+
+    rag = _brain(tmp_path)
+    assert rag.store.count == 120 and not rag._pending
+    docs = rag.store.get_documents(list(range(120)))
+    assert len({d["id"] for d in docs}) == 120
+    assert len({d["text"] for d in docs}) == 120
+    vectors = rag.store.vectors()
+    for row in (0, 59, 119):
+        assert rag.search(list(vectors[row]), k=1)[0]["text"] == docs[row]["text"]
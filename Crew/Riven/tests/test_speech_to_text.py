@@ -0,0 +1,117 @@
+import wave
+
+import numpy as np
+import pytest
+
+sr = pytest.importorskip("speech_recognition")
+pytest.importorskip("pygame")
+
+import speech_to_text
+from audio_engine import UtteranceDetector
+from speech_to_text import GoogleSTT, SpeechToText, VoskSTT, WhisperSTT, create_stt
+
+RATE = 16000
+
+
+def _write_wav(path, segments):
+    """segments: (seconds, amplitude) pairs; amplitude 0 is quiet room noise, anything else a 220 Hz tone."""
+    rng = np.random.default_rng(0)
+    parts = []
+    for seconds, amplitude in segments:
+        n = int(seconds * RATE)
+        if amplitude:
+            parts.append(amplitude * np.sin(2 * np.pi * 220 * np.arange(n) / RATE))
+        else:
+            parts.append(rng.normal(0, 40, n))
+    samples = np.concatenate(parts).astype("<i2")
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(RATE)
+        f.writeframes(samples.tobytes())
+    return str(path)
+
+
+@pytest.fixture
+def two_utterances(tmp_path):
+    return _write_wav(tmp_path / "two.wav", [(0.5, 0), (0.6, 8000), (0.7, 0), (0.9, 8000), (0.7, 0)])
+
+
+def _detect(path, **kwargs):
+    detector = UtteranceDetector(**kwargs)
+    detector._vad = None  # a pure tone is not speech to webrtcvad; test the energy gate
+    with sr.AudioFile(path) as source:
+        return [audio for audio in detector.utterances(source)]
+
+
+def _seconds(audio):
+    return len(audio.get_raw_data()) / (audio.sample_rate * audio.sample_width)
+
+
+def test_vad_cuts_the_file_at_each_pause(two_utterances):
+    utterances = _detect(two_utterances)
+    assert len(utterances) == 2
+    # Each keeps its pre-roll and loses its trailing silence.
+    first, second = (_seconds(u) for u in utterances)
+    assert 0.6 <= first <= 0.6 + 0.3 + 0.06
+    assert 0.9 <= second <= 0.9 + 0.3 + 0.06
+    assert utterances[0].sample_rate == RATE and utterances[0].sample_width == 2
+
+
+def test_vad_ignores_blips_shorter_than_start_speech(tmp_path):
+    path = _write_wav(tmp_path / "blip.wav", [(0.5, 0), (0.03, 8000), (0.5, 0)])
+    assert _detect(path) == []
+
+
+def test_vad_splits_an_utterance_at_max_duration(tmp_path):
+    path = _write_wav(tmp_path / "long.wav", [(0.3, 0), (2.0, 8000), (0.6, 0)])
+    utterances = _detect(path, max_duration=1.0)
+    assert len(utterances) >= 2
+    assert all(_seconds(u) <= 1.0 + 1e-9 for u in utterances)
+    assert sum(_seconds(u) for u in utterances) >= 2.0 - 0.1  # only the re-trigger frames go missing
+
+
+def test_a_backend_must_implement_transcribe():
+    with pytest.raises(TypeError):
+        SpeechToText()
+
+    class Incomplete(SpeechToText):
+        name = "incomplete"
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+class _FakeVosk:
+    @staticmethod
+    def SetLogLevel(level):
+        pass
+
+    class Model:
+        def __init__(self, path):
+            self.path = path
+
+
+def test_auto_prefers_vosk_when_its_model_is_present(tmp_path, monkeypatch):
+    monkeypatch.setattr(speech_to_text, "vosk", _FakeVosk)
+    monkeypatch.setattr(speech_to_text, "VOSK_MODEL_PATH", str(tmp_path))
+    monkeypatch.setattr(VoskSTT.__init__, "__defaults__", (str(tmp_path),))
+    stt = create_stt("auto")
+    assert isinstance(stt, VoskSTT) and stt.model.path == str(tmp_path)
+
+
+@pytest.mark.parametrize("vosk_installed", [False, True])
+def test_auto_falls_back_to_google_without_a_vosk_model(tmp_path, monkeypatch, vosk_installed):
+    monkeypatch.setattr(speech_to_text, "vosk", _FakeVosk if vosk_installed else None)
+    monkeypatch.setattr(speech_to_text, "VOSK_MODEL_PATH", str(tmp_path / "missing"))
+    assert isinstance(create_stt("auto"), GoogleSTT)
+
+
+def test_backends_by_name(monkeypatch):
+    monkeypatch.setattr(speech_to_text, "vosk", None)
+    assert isinstance(create_stt("google"), GoogleSTT)
+    assert isinstance(create_stt("whisper"), WhisperSTT)
+    with pytest.raises(RuntimeError, match="pip install vosk"):
+        create_stt("vosk")
+    with pytest.raises(ValueError, match="unknown speech-to-text backend"):
+        create_stt("sphinx")
@@ -0,0 +1,91 @@
+import json
+
+import pytest
+
+from stream_json import IncrementalJSONParser, repair_json
+
+DOSSIER = {
+    "summary": "Warp field harmonics, reviewed.",
+    "claims": [{"text": "Subspace is \"flat\"", "confidence": 0.7}, {"text": "Nebulae {hum}", "confidence": 0.4}],
+    "score": 42,
+    "verified": True,
+    "notes": None,
+}
+
+
+def _feed(text, chunk=7):
+    sections = []
+    parser = IncrementalJSONParser(on_section=lambda key, value: sections.append(key))
+    for i in range(0, len(text), chunk):
+        parser.feed(text[i:i + chunk])
+    return parser, sections
+
+
+@pytest.mark.parametrize("chunk", [1, 3, 64, 10_000])
+def test_sections_arrive_in_order_whatever_the_chunking(chunk):
+    text = "Sure! Here is the dossier:\n" + json.dumps(DOSSIER, indent=2)
+    parser, sections = _feed(text, chunk)
+    assert parser.done
+    assert sections == list(DOSSIER)
+    assert parser.finish() == DOSSIER
+    assert not parser.truncated and not parser.errors
+
+
+def test_a_section_is_emitted_before_the_document_ends():
+    parser, sections = _feed('{"summary": "done", "claims": [1, 2')
+    assert sections == ["summary"]
+    assert not parser.done
+
+
+def test_truncated_output_keeps_complete_sections_and_repairs_the_last():
+    text = json.dumps(DOSSIER)
+    cut = text.index('"Nebulae') + 5
+    parser, _ = _feed(text[:cut])
+    result = parser.finish()
+    assert parser.truncated
+    assert result["summary"] == DOSSIER["summary"]
+    assert result["claims"][0] == DOSSIER["claims"][0]
+    assert result["claims"][1]["text"].startswith("Nebu")
+
+
+def test_finish_without_repair_drops_the_unfinished_section():
+    parser, _ = _feed('{"summary": "done", "claims": [{"text": "half')
+    assert parser.finish(repair=False) == {"summary": "done"}
+    assert parser.truncated
+
+
+def test_a_truncated_scalar_is_still_decoded():
+    parser, _ = _feed('{"summary": "done", "score": 42')
+    assert parser.finish() == {"summary": "done", "score": 42}
+
+
+def test_top_level_arrays_are_decoded_whole():
+    parser, sections = _feed('[{"a": 1}, {"b": 2}]')
+    assert parser.finish() == [{"a": 1}, {"b": 2}]
+    assert sections == []
+    parser, _ = _feed('[{"a": 1}, {"b": 2')
+    assert parser.finish() == [{"a": 1}, {"b": 2}]
+    assert parser.truncated
+
+
+def test_no_json_at_all():
+    parser, _ = _feed("I could not find any sources.")
+    assert parser.finish() is None
+
+
+@pytest.mark.parametrize("text,expected", [
+    ('{"a": 1, "b": "unfinished', {"a": 1, "b": "unfinished"}),
+    ('{"a": 1, "b":', {"a": 1, "b": None}),
+    ('{"a": 1,', {"a": 1}),
+    ('{"a": [1, 2, {"c": "x\\', {"a": [1, 2, {"c": "x"}]}),
+    ('{"a": {"b": [1, 2], "c": tr', {"a": {"b": [1, 2]}}),
+    ('[1, 2, 3', [1, 2, 3]),
+    ('{"a": "brace } and bracket ] in a string', {"a": "brace } and bracket ] in a string"}),
+])
+def test_repair_json(text, expected):
+    assert repair_json(text) == expected
+
+
+def test_repair_json_gives_up_on_nothing_usable():
+    assert repair_json("") is None
+    assert repair_json("not json") is None
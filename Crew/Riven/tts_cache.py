@@ -0,0 +1,140 @@
+"""Content-addressed disk cache of synthesized speech.
+
+A clip is keyed by a digest of (engine, voice, engine settings, text), so
+regenerating a podcast after a small script edit only sends the changed lines
+to the TTS engine, and stock voice replies are synthesized once. Clips live
+under `data/tts_cache/` as `<digest>.mp3`; once the folder grows past
+`max_bytes`, the least recently used clips are deleted.
+
+Environment:
+- `RIVEN_TTS_CACHE_MB` — size bound in megabytes (default 512, 0 disables the cache)
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, Optional
+
+import edge_tts
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+CACHE_DIR = os.path.join(DATA_DIR, "tts_cache")
+ENGINE = "edge-tts"
+DEFAULT_SETTINGS: Dict[str, str] = {"rate": "+0%", "volume": "+0%", "pitch": "+0Hz"}
+
+
+def clip_key(text: str, voice: str, settings: Optional[Dict[str, str]] = None) -> str:
+    settings = {**DEFAULT_SETTINGS, **(settings or {})}
+    material = json.dumps([ENGINE, voice, settings, text], sort_keys=True, ensure_ascii=False)
+    return hashlib.blake2b(material.encode("utf-8"), digest_size=20).hexdigest()
+
+
+class TTSCache:
+    def __init__(self, directory: str = CACHE_DIR, max_bytes: int = 512 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(size for _, size, _ in self._entries())
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".mp3")
+
+    def _entries(self):
+        """(path, size, last used) for every clip on disk."""
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(".mp3"):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:  # evicted by another process
+                        continue
+                    yield entry.path, stat.st_size, stat.st_mtime
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)  # mtime doubles as the LRU timestamp
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        if not data or len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        entries = sorted(self._entries(), key=lambda e: e[2])
+        self._size = sum(size for _, size, _ in entries)
+        # Trim to 90% so a full cache doesn't rescan on every put.
+        target = self.max_bytes * 0.9
+        for path, size, _ in entries:
+            if self._size <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._size -= size
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+            "bytes": self._size,
+        }
+
+
+_cache: Optional[TTSCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_tts_cache() -> Optional[TTSCache]:
+    """The shared cache under data/tts_cache, or None when RIVEN_TTS_CACHE_MB is 0."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            megabytes = float(os.environ.get("RIVEN_TTS_CACHE_MB", "512"))
+            if megabytes <= 0:
+                return None
+            _cache = TTSCache(CACHE_DIR, int(megabytes * 1024 * 1024))
+        return _cache
+
+
+async def synthesize(text: str, voice: str, settings: Optional[Dict[str, str]] = None, cache: Optional[TTSCache] = None) -> bytes:
+    """MP3 bytes for `text`, from the cache when the same clip was made before."""
+    settings = {**DEFAULT_SETTINGS, **(settings or {})}
+    key = clip_key(text, voice, settings)
+    if cache is not None:
+        data = cache.get(key)
+        if data is not None:
+            return data
+
+    audio = bytearray()
+    async for chunk in edge_tts.Communicate(text, voice, **settings).stream():
+        if chunk["type"] == "audio":
+            audio.extend(chunk["data"])
+    data = bytes(audio)
+    if cache is not None:
+        cache.put(key, data)
+    return data